@@ -1,11 +1,13 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_marshmallow import Marshmallow
 from flask_restful import Api
 import os
+import threading
+import time
 
-db = SQLAlchemy()
-ma = Marshmallow()
+from .config import env_bool, env_float, env_int
+from .routing import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 
 
 def create_app(config_object=None):
@@ -21,12 +23,22 @@ def create_app(config_object=None):
         )
 
     db.init_app(app)
-    ma.init_app(app)
+
+    # pool sizing, timeouts and SQLite pragmas
+    from . import database
+    database.init_app(app)
+
     api = Api(app)
 
     # Health check endpoint for EBS
     @app.route('/')
     def health_check():
+        if not app.extensions.get('schema_ready', True):
+            return {
+                'status': 'unhealthy',
+                'service': 'Flask Blacklist API',
+                'reason': 'database schema is not initialized',
+            }, 503
         return {
             'status': 'healthy',
             'service': 'Flask Blacklist API',
@@ -34,16 +46,134 @@ def create_app(config_object=None):
         }, 200
 
     # import resources here to register endpoints
-    from .resources.blacklist import BlacklistResource, BlacklistLookupResource
+    from .resources.blacklist import (
+        BlacklistResource,
+        BlacklistBulkResource,
+        BlacklistBatchLookupResource,
+        BlacklistChangesResource,
+        BlacklistExportResource,
+        BlacklistLookupResource,
+        BlacklistStatsResource,
+    )
 
     api.add_resource(BlacklistResource, '/blacklists')
+    api.add_resource(BlacklistBulkResource, '/blacklists/bulk')
+    api.add_resource(BlacklistBatchLookupResource, '/blacklists/lookup')
+    api.add_resource(BlacklistExportResource, '/blacklists/export')
+    api.add_resource(BlacklistStatsResource, '/blacklists/stats')
+    api.add_resource(BlacklistChangesResource, '/blacklists/changes')
     api.add_resource(BlacklistLookupResource, '/blacklists/<string:email>')
 
+    # Prometheus /metrics and request/database instrumentation
+    from . import metrics
+    metrics.init_app(app)
+
+    # slow query log and per-request query counts
+    from . import querylog
+    querylog.init_app(app)
+
+    # sampled cProfile dumps, off unless PROFILING_ENABLED is set
+    from . import profiling
+    profiling.init_app(app)
+
     # static bearer token for simplicity (can be overridden with env)
     app.config.setdefault('STATIC_BEARER_TOKEN', os.environ.get('STATIC_BEARER_TOKEN', 'secret-token'))
 
-    # Create tables automatically on startup
+    # provider-specific normalization (Gmail dots and +tags) of email keys;
+    # changing it requires running `flask migrate-email-key`
+    app.config.setdefault('EMAIL_PROVIDER_RULES', env_bool('EMAIL_PROVIDER_RULES', False))
+
+    # limits for POST /blacklists/bulk
+    app.config.setdefault('BULK_MAX_ROWS', env_int('BULK_MAX_ROWS', 50000))
+    app.config.setdefault('BULK_INSERT_CHUNK_SIZE', env_int('BULK_INSERT_CHUNK_SIZE', 1000))
+
+    # page sizes for GET /blacklists
+    app.config.setdefault('LIST_PAGE_SIZE', env_int('LIST_PAGE_SIZE', 100))
+    app.config.setdefault('LIST_MAX_PAGE_SIZE', env_int('LIST_MAX_PAGE_SIZE', 1000))
+
+    # how long responses to requests with an Idempotency-Key are replayed
+    app.config.setdefault('IDEMPOTENCY_KEY_TTL', env_int('IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+    # limit for POST /blacklists/lookup
+    app.config.setdefault('LOOKUP_BATCH_MAX_EMAILS', env_int('LOOKUP_BATCH_MAX_EMAILS', 5000))
+
+    # optional write-behind queue for POST /blacklists
+    from . import writer
+    writer.init_app(app)
+
+    # rows fetched and serialized per chunk by GET /blacklists/export
+    app.config.setdefault('EXPORT_CHUNK_SIZE', env_int('EXPORT_CHUNK_SIZE', 1000))
+
+    # in-process cache for GET /blacklists/<email>
+    from . import cache
+    cache.init_app(app)
+
+    # one database query per email for concurrent cache misses
+    from . import singleflight
+    singleflight.init_app(app)
+
+    # stale-while-revalidate and circuit breaker for lookups
+    from . import resilience
+    resilience.init_app(app)
+
+    # change feed for GET /blacklists/changes
+    from . import changes
+    changes.init_app(app)
+
+    # archiving of expired entries, in each worker if EXPIRY_SWEEP_INTERVAL is set
+    from . import expiry
+    expiry.init_app(app)
+
+    # optional read replica for lookups, listing and export
+    from . import replica
+    replica.init_app(app)
+
+    # flask commands (init-db, sweep-expired, write-snapshot, ...), whichever
+    # module FLASK_APP points at
+    from . import commands
+    commands.init_app(app)
+
+    # create or upgrade the schema only when it is not current; production
+    # runs `flask init-db` once per deploy and sets DB_AUTO_INIT=false
+    app.config.setdefault('DB_AUTO_INIT', env_bool('DB_AUTO_INIT', True))
+    # how often a worker started before `flask init-db` checks the schema again
+    app.config.setdefault('SCHEMA_CHECK_INTERVAL', env_float('SCHEMA_CHECK_INTERVAL', 5))
+    from .schema import check_schema
     with app.app_context():
-        db.create_all()
+        app.extensions['schema_ready'] = check_schema(app)
+        if app.extensions['schema_ready']:
+            _init_fast_paths(app)
+
+    if not app.extensions['schema_ready']:
+        schema_lock = threading.Lock()
+        schema_checked_at = [time.monotonic()]
+
+        @app.before_request
+        def recheck_schema():
+            if app.extensions['schema_ready']:
+                return
+            with schema_lock:
+                now = time.monotonic()
+                if app.extensions['schema_ready'] or now - schema_checked_at[0] < app.config['SCHEMA_CHECK_INTERVAL']:
+                    return
+                schema_checked_at[0] = now
+                if check_schema(app):
+                    _init_fast_paths(app)
+                    app.extensions['schema_ready'] = True
 
     return app
+
+
+def _init_fast_paths(app):
+    """Set up the in-memory lookup paths, which read tables that must already exist."""
+    # negative fast path for lookups, built from the current table
+    from . import bloom
+    bloom.init_app(app)
+
+    # domain and subdomain patterns
+    from . import patterns
+    patterns.init_app(app)
+
+    # shared read-only snapshot of the blocked set, if configured
+    from . import snapshot
+    snapshot.init_app(app)
@@ -0,0 +1,241 @@
+"""
+Bloom filter of blacklisted email keys used as a negative fast path for lookups.
+"""
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, func
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .changes import changes_after, latest_change_id
+from .config import env_bool, env_float, env_int
+from .metrics import BLOOM_FILTER
+from .models import Blacklist, BlacklistChange, BlacklistStatus
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('<4sHHQQQQd')
+_MAGIC = b'BLMF'
+_VERSION = 3
+
+_FILTERED = BLOOM_FILTER.labels('filtered')
+_DB_FALLBACK = BLOOM_FILTER.labels('db_fallback')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over byte strings using double hashing."""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+    def estimated_error_rate(self):
+        """False-positive rate expected for the current number of items."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class BlacklistFilter:
+    """Bloom filter over ``Blacklist.email_key`` kept in sync with the table.
+
+    The filter is built from the database (or loaded from ``path``), updated
+    in-process whenever a ``Blacklist`` row is inserted, and caught up with
+    emails blocked by other processes by reading ``blacklist_changes`` past
+    its watermark at most once every ``refresh_interval`` seconds. The
+    watermark is a change id rather than a ``Blacklist.id``, because change
+    ids commit in order: on PostgreSQL a row with a lower id can commit after
+    one with a higher id, and a watermark moved past both would skip it.
+    """
+
+    def __init__(self, error_rate=0.001, min_capacity=100000, refresh_interval=5.0, path=None):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.refresh_interval = refresh_interval
+        self.path = path
+        self.watermark = 0
+        self.filter_hits = 0
+        self.db_fallbacks = 0
+        self._filter = BloomFilter(min_capacity, error_rate)
+        self._loaded_mtime = None
+        self._last_refresh = time.monotonic()
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        """Rebuild the filter from every email key in the blacklist status table."""
+        # read first, so changes committed while reading are applied again
+        watermark = latest_change_id()
+        total = db.session.query(func.count(BlacklistStatus.email_key)).scalar() or 0
+        bloom = BloomFilter(max(self.min_capacity, total * 2), self.error_rate)
+        for (key,) in db.session.query(BlacklistStatus.email_key).yield_per(10000):
+            bloom.add(key)
+        with self._lock:
+            self._filter = bloom
+            self.watermark = watermark
+            self._last_refresh = time.monotonic()
+
+    def load(self):
+        """Replace the filter with the one saved at ``path``; return True if loaded."""
+        try:
+            with open(self.path, 'rb') as fh:
+                mtime = os.fstat(fh.fileno()).st_mtime
+                header = fh.read(_HEADER.size)
+                magic, version, num_hashes, num_bits, count, capacity, watermark, error_rate = \
+                    _HEADER.unpack(header)
+                if magic != _MAGIC or version != _VERSION:
+                    return False
+                bits = bytearray(fh.read())
+        except (OSError, struct.error):
+            return False
+        bloom = BloomFilter.__new__(BloomFilter)
+        bloom.capacity = capacity
+        bloom.error_rate = error_rate
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        bloom.bits = bits
+        bloom.count = count
+        with self._lock:
+            self._filter = bloom
+            self.watermark = watermark
+            self._loaded_mtime = mtime
+        return True
+
+    def save(self):
+        """Atomically write the filter to ``path``."""
+        bloom = self._filter
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as fh:
+            fh.write(_HEADER.pack(
+                _MAGIC, _VERSION, bloom.num_hashes, bloom.num_bits, bloom.count,
+                bloom.capacity, self.watermark, bloom.error_rate,
+            ))
+            fh.write(bloom.bits)
+        os.replace(tmp_path, self.path)
+        self._loaded_mtime = os.stat(self.path).st_mtime
+
+    def add(self, key):
+        with self._lock:
+            self._filter.add(key)
+
+    def refresh(self):
+        """Pick up a newer saved filter and emails blocked past the watermark.
+
+        If the database cannot be read, the filter is kept as it is until
+        the next refresh.
+        """
+        self._last_refresh = time.monotonic()
+        try:
+            self._refresh()
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.warning('Refreshing the Bloom filter failed; keeping the current one', exc_info=True)
+
+    def _refresh(self):
+        if self.path and self._saved_filter_changed():
+            self.load()
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            changes = changes_after(self.watermark, BlacklistChange.email_key, BlacklistChange.blocked)
+            for change_id, key, blocked in changes or ():
+                if blocked:
+                    self._filter.add(key)
+                self.watermark = change_id
+            # rebuilt if the changes past the watermark were purged
+            stale = changes is None or self._filter.saturated
+        finally:
+            self._lock.release()
+        if stale:
+            self.rebuild()
+
+    def _saved_filter_changed(self):
+        try:
+            return os.stat(self.path).st_mtime != self._loaded_mtime
+        except OSError:
+            return False
+
+    def might_contain(self, key):
+        """Return False only if the email with ``key`` is definitely not blacklisted."""
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+        if key in self._filter:
+            self.db_fallbacks += 1
+            _DB_FALLBACK.inc()
+            return True
+        self.filter_hits += 1
+        _FILTERED.inc()
+        return False
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            'count': bloom.count,
+            'capacity': bloom.capacity,
+            'num_bits': bloom.num_bits,
+            'num_hashes': bloom.num_hashes,
+            'estimated_error_rate': bloom.estimated_error_rate(),
+            'watermark': self.watermark,
+            'filter_hits': self.filter_hits,
+            'db_fallbacks': self.db_fallbacks,
+        }
+
+
+@event.listens_for(Blacklist, 'after_insert')
+def _add_inserted_email(mapper, connection, target):
+    if not has_app_context():
+        return
+    bloom = current_app.extensions.get('bloom_filter')
+    if bloom is not None:
+        bloom.add(target.email_key)
+
+
+def init_app(app):
+    """Build the Bloom filter for ``app``; must run inside an app context."""
+    app.config.setdefault('BLOOM_FILTER_ENABLED', env_bool('BLOOM_FILTER_ENABLED', True))
+    app.config.setdefault('BLOOM_FILTER_ERROR_RATE', env_float('BLOOM_FILTER_ERROR_RATE', 0.001))
+    app.config.setdefault('BLOOM_FILTER_CAPACITY', env_int('BLOOM_FILTER_CAPACITY', 100000))
+    app.config.setdefault('BLOOM_FILTER_REFRESH_INTERVAL', env_float('BLOOM_FILTER_REFRESH_INTERVAL', 5))
+    app.config.setdefault('BLOOM_FILTER_PATH', os.environ.get('BLOOM_FILTER_PATH'))
+    if not app.config['BLOOM_FILTER_ENABLED']:
+        return
+    bloom = BlacklistFilter(
+        error_rate=app.config['BLOOM_FILTER_ERROR_RATE'],
+        min_capacity=app.config['BLOOM_FILTER_CAPACITY'],
+        refresh_interval=app.config['BLOOM_FILTER_REFRESH_INTERVAL'],
+        path=app.config['BLOOM_FILTER_PATH'],
+    )
+    if bloom.path and bloom.load():
+        bloom.refresh()
+    else:
+        bloom.rebuild()
+    app.extensions['bloom_filter'] = bloom
@@ -0,0 +1,167 @@
+"""
+In-process LRU/TTL cache for blacklist lookups.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .config import env_float, env_int
+from .metrics import LOOKUP_CACHE, LOOKUP_CACHE_EVICTIONS
+
+MISSING = object()
+
+_HIT = LOOKUP_CACHE.labels('hit')
+_STALE_HIT = LOOKUP_CACHE.labels('stale')
+_MISS = LOOKUP_CACHE.labels('miss')
+
+
+class LookupCache:
+    """Bounded, thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    Both positive and negative lookup results are cached, so values are
+    stored as-is and a miss is signalled with the ``MISSING`` sentinel.
+    Expired entries are kept for ``stale_ttl`` more seconds, during which
+    ``get_entry`` still returns them, marked as stale.
+
+    ``invalidate`` gives the key a new generation. A reader takes
+    ``generation(key)`` before querying and passes it to ``set``, which
+    drops the value if a write invalidated the key in between.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30.0, clock=time.monotonic, stale_ttl=0.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        # key -> (value, expires, stale_until, stored_at)
+        self._data = OrderedDict()
+        # key -> generation of its last invalidation, for the newest maxsize keys
+        self._generations = OrderedDict()
+        self._generation = 0
+        # generation of keys not in _generations, at least that of any key dropped from it
+        self._base_generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _find(self, key, now):
+        # the caller holds the lock
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[2] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            now = self._clock()
+            entry = self._find(key, now)
+            if entry is None or entry[1] <= now:
+                self.misses += 1
+                _MISS.inc()
+                return MISSING
+            self.hits += 1
+            _HIT.inc()
+            return entry[0]
+
+    def get_entry(self, key):
+        """Return ``(value, age, fresh)`` for ``key``, stale entries included, or ``MISSING``.
+
+        ``age`` is the number of seconds since the value was cached.
+        """
+        with self._lock:
+            now = self._clock()
+            entry = self._find(key, now)
+            if entry is None:
+                self.misses += 1
+                _MISS.inc()
+                return MISSING
+            value, expires, _, stored_at = entry
+            fresh = expires > now
+            if fresh:
+                self.hits += 1
+                _HIT.inc()
+            else:
+                self.stale_hits += 1
+                _STALE_HIT.inc()
+            return value, now - stored_at, fresh
+
+    def generation(self, key):
+        """Return the generation of ``key``, to pass to ``set`` with a value read after this call."""
+        with self._lock:
+            return self._generations.get(key, self._base_generation)
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Cache ``value`` for ``ttl`` seconds, at most the cache's own ``ttl``.
+
+        A value with a shorter ``ttl`` is wrong once it expires, e.g. because
+        the blacklist entry behind it expired, so it is never served stale.
+        If ``generation`` is given and ``key`` was invalidated since, the
+        value may predate a write and is not cached.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key, self._base_generation):
+                return
+            now = self._clock()
+            if ttl is None or ttl >= self.ttl:
+                expires = now + self.ttl
+                stale_until = expires + self.stale_ttl
+            else:
+                expires = stale_until = now + ttl
+            self._data[key] = (value, expires, stale_until, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                LOOKUP_CACHE_EVICTIONS.inc()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+            self._generations[key] = self._generation
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.maxsize:
+                # ordered by generation, so this is the newest generation dropped so far
+                self._base_generation = self._generations.popitem(last=False)[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+            self._generation += 1
+            self._base_generation = self._generation
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return a snapshot of the cache counters."""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+def init_app(app):
+    """Attach a lookup cache to ``app`` sized from its config."""
+    app.config.setdefault('LOOKUP_CACHE_SIZE', env_int('LOOKUP_CACHE_SIZE', 1024))
+    app.config.setdefault('LOOKUP_CACHE_TTL', env_float('LOOKUP_CACHE_TTL', 30))
+    app.config.setdefault('LOOKUP_CACHE_STALE_TTL', env_float('LOOKUP_CACHE_STALE_TTL', 300))
+    app.extensions['lookup_cache'] = LookupCache(
+        maxsize=app.config['LOOKUP_CACHE_SIZE'],
+        ttl=app.config['LOOKUP_CACHE_TTL'],
+        stale_ttl=app.config['LOOKUP_CACHE_STALE_TTL'],
+    )
@@ -0,0 +1,187 @@
+"""
+Change feed for GET /blacklists/changes.
+
+Every write appends the resulting status of each affected email to
+``blacklist_changes`` in the same transaction (see ``record_changes``), so a
+consumer keeping a local copy of the blocked set reads the rows after its
+cursor, applies them in order and stores ``next_cursor``: O(changes) work
+instead of re-reading the table. The cursor is the id of the last change
+read, so it is opaque to consumers but stays valid across restarts.
+
+With ``wait`` set and nothing new, a request holds until a change arrives or
+``wait`` seconds pass. Changes committed by this worker wake it at once;
+those committed by other workers or hosts are seen within
+``CHANGES_POLL_INTERVAL`` seconds, each poll being one primary key range
+read. The database connection is returned to the pool while waiting.
+
+Changes older than ``CHANGES_RETENTION_DAYS`` are deleted by
+``flask purge-changes``; a consumer whose cursor falls behind that gets 410
+and re-syncs from GET /blacklists/export, whose ``X-Changes-Cursor`` header
+is where to resume. Domain patterns, ``flask backfill-status`` and
+``flask migrate-email-key`` are not in the feed and also need a re-sync.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, select
+
+from . import db
+from .config import env_float, env_int
+from .models import BlacklistChange
+from .routing import RoutingSession
+
+
+# notifiers whose engine is committing changes in this thread
+_committing = threading.local()
+
+
+class ChangeNotifier:
+    """Wakes requests waiting for changes once this process commits some."""
+
+    def __init__(self):
+        self.version = 0
+        self._condition = threading.Condition()
+
+    def notify(self):
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait(self, version, timeout):
+        """Wait up to ``timeout`` seconds for a notification after ``version``; return True if one came."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.version != version, timeout)
+
+    def _on_commit(self, conn):
+        # runs before the database commits, so readers are only woken by
+        # _notify_committed once the changes are visible
+        if conn.info.pop('changes_recorded', False):
+            _pending_notifiers().add(self)
+
+    def _on_rollback(self, conn):
+        conn.info.pop('changes_recorded', None)
+        _pending_notifiers().discard(self)
+
+    def listen(self, engine):
+        event.listen(engine, 'commit', self._on_commit)
+        event.listen(engine, 'rollback', self._on_rollback)
+
+
+def _pending_notifiers():
+    if not hasattr(_committing, 'notifiers'):
+        _committing.notifiers = set()
+    return _committing.notifiers
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _notify_committed(session):
+    notifiers = _pending_notifiers()
+    while notifiers:
+        notifiers.pop().notify()
+
+
+def latest_change_id():
+    """Return the id of the newest change, or 0 if there are none."""
+    return db.session.execute(select(func.max(BlacklistChange.id))).scalar() or 0
+
+
+def oldest_change_id():
+    """Return the id of the oldest change still kept, or None if there are none."""
+    return db.session.execute(select(func.min(BlacklistChange.id))).scalar()
+
+
+def read_changes(cursor, limit):
+    """Return ``(changes, has_more)``: up to ``limit`` changes with ids past ``cursor``, oldest first."""
+    rows = db.session.execute(
+        select(BlacklistChange.__table__)
+        .where(BlacklistChange.id > cursor)
+        .order_by(BlacklistChange.id)
+        .limit(limit + 1)
+    ).fetchall()
+    return [_change(row) for row in rows[:limit]], len(rows) > limit
+
+
+def changes_after(cursor, *columns):
+    """Return ``(id, *columns)`` rows of the changes past ``cursor``, oldest first.
+
+    Used by in-process copies of the blocked set to catch up with other
+    workers' writes; unlike ``Blacklist.id``, change ids commit in order.
+    Returns None if changes past ``cursor`` may have been purged, in which
+    case the copy has to be rebuilt.
+    """
+    oldest = oldest_change_id()
+    if oldest is not None and oldest > cursor + 1:
+        return None
+    return db.session.execute(
+        select(BlacklistChange.id, *columns)
+        .where(BlacklistChange.id > cursor)
+        .order_by(BlacklistChange.id)
+    ).fetchall()
+
+
+def wait_for_changes(cursor, limit, wait=0.0, poll_interval=0.5, notifier=None):
+    """Like ``read_changes``, but wait up to ``wait`` seconds for a change if there is none yet.
+
+    Ends the current transaction of the session.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        version = notifier.version if notifier is not None else None
+        # a new transaction, so the read sees every commit notified before
+        # ``version``; between polls this also returns the connection to the pool
+        db.session.rollback()
+        changes, has_more = read_changes(cursor, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes, has_more
+        timeout = min(poll_interval, remaining)
+        if notifier is not None:
+            notifier.wait(version, timeout)
+        else:
+            time.sleep(timeout)
+
+
+def _change(row):
+    return {
+        'id': row.id,
+        'email': row.email,
+        'blocked': row.blocked,
+        'reason': row.blocked_reason,
+        'app_uuid': row.app_uuid,
+        'expires_at': _isoformat(row.expires_at),
+        'changed_at': _isoformat(row.changed_at),
+    }
+
+
+def _isoformat(value):
+    return None if value is None else value.isoformat()
+
+
+def purge_changes(retention_days=7):
+    """Delete changes older than ``retention_days``, except the newest one; return how many.
+
+    The newest change is kept so ids are not reused by databases that
+    restart their sequence from the highest id in the table.
+    """
+    table = BlacklistChange.__table__
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    newest = latest_change_id()
+    deleted = db.session.execute(
+        table.delete().where(table.c.changed_at < cutoff).where(table.c.id < newest)
+    ).rowcount
+    db.session.commit()
+    return deleted
+
+
+def init_app(app):
+    """Read the change feed settings and wake waiting requests on commits of ``app``."""
+    app.config.setdefault('CHANGES_PAGE_SIZE', env_int('CHANGES_PAGE_SIZE', 500))
+    app.config.setdefault('CHANGES_MAX_PAGE_SIZE', env_int('CHANGES_MAX_PAGE_SIZE', 5000))
+    app.config.setdefault('CHANGES_MAX_WAIT', env_float('CHANGES_MAX_WAIT', 30))
+    app.config.setdefault('CHANGES_POLL_INTERVAL', env_float('CHANGES_POLL_INTERVAL', 0.5))
+    app.config.setdefault('CHANGES_RETENTION_DAYS', env_int('CHANGES_RETENTION_DAYS', 7))
+    notifier = ChangeNotifier()
+    with app.app_context():
+        notifier.listen(db.engine)
+    app.extensions['change_notifier'] = notifier
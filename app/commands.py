@@ -0,0 +1,142 @@
+"""
+``flask`` commands for deploys, maintenance jobs and sidecars.
+
+Registered by ``create_app``, so they are available whichever module
+``FLASK_APP`` points at (``run.py`` locally, ``application.py`` in the image).
+"""
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import db
+from .models import rebuild_stats, rebuild_status
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create or upgrade the database schema; run once per deploy"""
+    from .schema import SCHEMA_VERSION, init_db
+    previous = init_db()
+    print(f'Database schema at version {SCHEMA_VERSION} (was {previous})')
+
+
+@click.command('rebuild-bloom')
+@with_appcontext
+def rebuild_bloom_command():
+    """Rebuild the blacklist Bloom filter"""
+    bloom = current_app.extensions.get('bloom_filter')
+    if bloom is None:
+        print('Bloom filter is disabled (BLOOM_FILTER_ENABLED)')
+        return
+    bloom.rebuild()
+    if bloom.path:
+        bloom.save()
+        print(f'Saved Bloom filter to {bloom.path}')
+    stats = bloom.stats()
+    print(
+        f"Rebuilt Bloom filter: {stats['count']} emails, {stats['num_bits']} bits, "
+        f"{stats['num_hashes']} hashes, estimated error rate {stats['estimated_error_rate']:.6f}"
+    )
+
+
+@click.command('backfill-status')
+@with_appcontext
+def backfill_status_command():
+    """Rebuild the current-status table from the blacklist history"""
+    count = rebuild_status()
+    print(f'Backfilled status for {count} emails')
+
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Rebuild the daily block counts from the blacklist history"""
+    count = rebuild_stats()
+    print(f'Rebuilt block counts for {count} groups')
+
+
+@click.command('migrate-email-key')
+@with_appcontext
+def migrate_email_key_command():
+    """Add, backfill and index the normalized email key"""
+    from .schema import migrate_email_key
+    updated = migrate_email_key()
+    print(f'Recomputed email_key for {updated} rows')
+
+
+@click.command('purge-idempotency-keys')
+@with_appcontext
+def purge_idempotency_keys_command():
+    """Delete expired Idempotency-Key responses"""
+    from .idempotency import purge_expired
+    deleted = purge_expired()
+    print(f'Deleted {deleted} expired idempotency keys')
+
+
+@click.command('purge-changes')
+@with_appcontext
+def purge_changes_command():
+    """Delete change feed entries older than CHANGES_RETENTION_DAYS"""
+    from .changes import purge_changes
+    deleted = purge_changes(current_app.config['CHANGES_RETENTION_DAYS'])
+    print(f'Deleted {deleted} change feed entries')
+
+
+@click.command('sweep-expired')
+@click.option('--interval', type=float, default=None, help='Sweep again every INTERVAL seconds.')
+@with_appcontext
+def sweep_expired_command(interval):
+    """Archive or delete expired blacklist entries in small batches"""
+    from .expiry import sweep_expired
+    config = current_app.config
+    while True:
+        started = time.monotonic()
+        swept = sweep_expired(
+            config['EXPIRY_SWEEP_BATCH_SIZE'], config['EXPIRY_SWEEP_MAX_BATCHES'],
+            config['EXPIRY_ARCHIVE'], config['EXPIRY_SWEEP_PAUSE'],
+        )
+        db.session.remove()
+        print(f'Swept {swept} expired entries in {time.monotonic() - started:.2f}s', flush=True)
+        if not interval:
+            return
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+@click.command('write-snapshot')
+@click.option('--interval', type=float, default=None, help='Rewrite the snapshot every INTERVAL seconds.')
+@with_appcontext
+def write_snapshot_command(interval):
+    """Write the memory-mapped snapshot of blocked emails to SNAPSHOT_PATH"""
+    from .snapshot import write_snapshot
+    path = current_app.config.get('SNAPSHOT_PATH')
+    if not path:
+        raise click.UsageError('SNAPSHOT_PATH is not set')
+    while True:
+        started = time.monotonic()
+        count = write_snapshot(path)
+        db.session.remove()
+        print(f'Wrote snapshot of {count} emails to {path} in {time.monotonic() - started:.2f}s', flush=True)
+        if not interval:
+            return
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+def init_app(app):
+    """Register the commands on ``app.cli``."""
+    for command in (
+        init_db_command,
+        rebuild_bloom_command,
+        backfill_status_command,
+        rebuild_stats_command,
+        migrate_email_key_command,
+        purge_idempotency_keys_command,
+        purge_changes_command,
+        sweep_expired_command,
+        write_snapshot_command,
+    ):
+        app.cli.add_command(command)
+    # kept for existing deploy scripts
+    app.cli.add_command(init_db_command, 'create-db')
@@ -0,0 +1,21 @@
+"""
+Helpers for reading settings from the environment.
+"""
+import os
+
+_TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in _TRUE_VALUES
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
@@ -0,0 +1,109 @@
+"""
+Engine and connection-pool configuration.
+
+Every gunicorn worker has its own pool, and each request thread holds at
+most one connection, so the pool is sized per worker from the thread count.
+The server sees at most ``workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)``
+connections.
+"""
+import os
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from . import db
+from .config import env_bool, env_int
+from .metrics import DB_POOL_CHECKOUT_WAIT
+from .querylog import record_pool_wait
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            DB_POOL_CHECKOUT_WAIT.observe(waited)
+            record_pool_wait(waited)
+
+
+def engine_options(database_url, config):
+    """Return ``create_engine`` options for ``database_url`` from ``config``."""
+    url = make_url(database_url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Flask-SQLAlchemy keeps a single shared connection for in-memory databases
+        return {}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if url.get_backend_name() == 'sqlite':
+        # pooled connections are handed between request threads
+        options['connect_args'] = {'check_same_thread': False}
+    elif url.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+
+def _sqlite_pragmas(config, in_memory):
+    pragmas = [
+        f"synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"mmap_size={config['SQLITE_MMAP_SIZE']}",
+    ]
+    if not in_memory:
+        pragmas.insert(0, f"journal_mode={config['SQLITE_JOURNAL_MODE']}")
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(f'PRAGMA {pragma}')
+        finally:
+            cursor.close()
+
+    return set_pragmas
+
+
+def init_app(app):
+    """Configure the engine of ``app``; call after ``db.init_app``."""
+    threads = env_int('GUNICORN_THREADS', 2)
+    app.config.setdefault('DB_POOL_SIZE', env_int('DB_POOL_SIZE', threads))
+    app.config.setdefault('DB_MAX_OVERFLOW', env_int('DB_MAX_OVERFLOW', 2))
+    app.config.setdefault('DB_POOL_TIMEOUT', env_int('DB_POOL_TIMEOUT', 10))
+    app.config.setdefault('DB_POOL_RECYCLE', env_int('DB_POOL_RECYCLE', 1800))
+    app.config.setdefault('DB_POOL_PRE_PING', env_bool('DB_POOL_PRE_PING', True))
+    app.config.setdefault('DB_STATEMENT_TIMEOUT_MS', env_int('DB_STATEMENT_TIMEOUT_MS', 30000))
+    app.config.setdefault('SQLITE_JOURNAL_MODE', os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'))
+    app.config.setdefault('SQLITE_SYNCHRONOUS', os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'))
+    app.config.setdefault('SQLITE_MMAP_SIZE', env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+    database_url = app.config['SQLALCHEMY_DATABASE_URI']
+    # explicitly configured options win over the defaults
+    options = engine_options(database_url, app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    with app.app_context():
+        _listen_pragmas(db.engine, app.config)
+
+
+def _listen_pragmas(engine, config):
+    if engine.url.get_backend_name() == 'sqlite':
+        in_memory = engine.url.database in (None, '', ':memory:')
+        event.listen(engine, 'connect', _sqlite_pragmas(config, in_memory))
+
+
+def create_read_engine(database_url, config):
+    """Return an engine for a read replica, pooled and tuned like the primary."""
+    engine = create_engine(database_url, **engine_options(database_url, config))
+    _listen_pragmas(engine, config)
+    return engine
@@ -0,0 +1,157 @@
+"""
+Sweeping of expired blacklist entries.
+
+Entries posted with ``expires_at`` stop blocking at that time whether or not
+they have been swept: lookups check the expiry stored on the status row.
+The sweeper then moves expired rows from ``blacklists`` to
+``blacklists_archive``, or deletes them with ``EXPIRY_ARCHIVE=false``, so the
+table and its indexes stay bounded under steady churn.
+
+Each batch of at most ``EXPIRY_SWEEP_BATCH_SIZE`` rows is one short
+transaction: the rows are found through the ``expires_at`` index, archived
+and deleted, and the status, daily stats and change feed of their emails
+are updated. On PostgreSQL, rows locked by a concurrent sweep are skipped,
+so every worker can sweep at once.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import select
+
+from . import db
+from .config import env_bool, env_float, env_int
+from .lookup import invalidate_keys
+from .metrics import EXPIRY_SWEEP_DURATION, EXPIRY_SWEEP_ROWS, EXPIRY_SWEPT
+from .models import Blacklist, BlacklistArchive, count_rows, record_changes, refresh_statuses
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_batch(batch_size=500, archive=True, now=None):
+    """Archive or delete up to ``batch_size`` expired rows in one transaction; return how many."""
+    table = Blacklist.__table__
+    now = now or datetime.utcnow()
+    query = select(table).where(table.c.expires_at <= now).order_by(table.c.expires_at).limit(batch_size)
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    try:
+        rows = [dict(row._mapping) for row in db.session.execute(query)]
+        if not rows:
+            db.session.rollback()
+            return 0
+        if archive:
+            db.session.execute(BlacklistArchive.__table__.insert(), [dict(row, archived_at=now) for row in rows])
+        db.session.execute(table.delete().where(table.c.id.in_([row['id'] for row in rows])))
+        connection = db.session.connection()
+        keys = list({row['email_key'] for row in rows})
+        # the next latest entry, if any, becomes the status of each email
+        refresh_statuses(connection, keys)
+        record_changes(connection, keys, removed={row['email_key']: row['email'] for row in rows})
+        count_rows(connection, removed=rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_keys(keys)
+    return len(rows)
+
+
+def sweep_expired(batch_size=500, max_batches=100, archive=True, pause=0.0):
+    """Sweep expired rows batch by batch until none are left or ``max_batches`` ran; return how many.
+
+    ``pause`` seconds between batches leave room for other writers.
+    """
+    started = time.perf_counter()
+    swept = 0
+    for batch in range(max_batches):
+        if batch and pause:
+            time.sleep(pause)
+        count = sweep_batch(batch_size, archive)
+        swept += count
+        if count < batch_size:
+            break
+    EXPIRY_SWEPT.labels('archived' if archive else 'deleted').inc(swept)
+    EXPIRY_SWEEP_ROWS.observe(swept)
+    EXPIRY_SWEEP_DURATION.observe(time.perf_counter() - started)
+    return swept
+
+
+class ExpirySweeper:
+    """Daemon thread calling ``sweep_expired`` every ``interval`` seconds in each process."""
+
+    def __init__(self, app, interval=60.0, batch_size=500, max_batches=100, archive=True, pause=0.0):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.archive = archive
+        self.pause = pause
+        self.runs = 0
+        self.swept = 0
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # threads do not survive a fork, so each worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='expiry-sweeper', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        """Sweep now; return the number of rows swept, or None if the sweep failed."""
+        with self.app.app_context():
+            try:
+                swept = sweep_expired(self.batch_size, self.max_batches, self.archive, self.pause)
+            except Exception:
+                logger.exception('Sweeping expired blacklist entries failed')
+                return None
+            finally:
+                db.session.remove()
+        self.runs += 1
+        self.swept += swept
+        return swept
+
+    def stop(self, timeout=30):
+        self._stopping.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def stats(self):
+        return {'interval': self.interval, 'runs': self.runs, 'swept': self.swept}
+
+
+def init_app(app):
+    """Read the sweep settings and start a sweeper per worker if ``EXPIRY_SWEEP_INTERVAL`` is set."""
+    app.config.setdefault('EXPIRY_SWEEP_INTERVAL', env_float('EXPIRY_SWEEP_INTERVAL', 0))
+    app.config.setdefault('EXPIRY_SWEEP_BATCH_SIZE', env_int('EXPIRY_SWEEP_BATCH_SIZE', 500))
+    app.config.setdefault('EXPIRY_SWEEP_MAX_BATCHES', env_int('EXPIRY_SWEEP_MAX_BATCHES', 100))
+    app.config.setdefault('EXPIRY_SWEEP_PAUSE', env_float('EXPIRY_SWEEP_PAUSE', 0))
+    app.config.setdefault('EXPIRY_ARCHIVE', env_bool('EXPIRY_ARCHIVE', True))
+    if app.config['EXPIRY_SWEEP_INTERVAL'] <= 0:
+        return
+    sweeper = ExpirySweeper(
+        app,
+        interval=app.config['EXPIRY_SWEEP_INTERVAL'],
+        batch_size=app.config['EXPIRY_SWEEP_BATCH_SIZE'],
+        max_batches=app.config['EXPIRY_SWEEP_MAX_BATCHES'],
+        archive=app.config['EXPIRY_ARCHIVE'],
+        pause=app.config['EXPIRY_SWEEP_PAUSE'],
+    )
+    app.extensions['expiry_sweeper'] = sweeper
+    # started by the first request, so a preloaded app starts one per worker
+    app.before_request(sweeper.ensure_started)
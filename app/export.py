@@ -0,0 +1,69 @@
+"""
+Streaming export of the blacklist as NDJSON or CSV.
+"""
+import csv
+import io
+import json
+import zlib
+
+from .models import Blacklist
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_chunks(since=None, chunk_size=1000):
+    """Yield lists of at most ``chunk_size`` ``Blacklist`` rows in id order.
+
+    ``yield_per`` fetches through a server-side cursor where the driver
+    supports one, so memory use does not depend on the table size.
+    """
+    query = Blacklist.query.order_by(Blacklist.id)
+    if since is not None:
+        query = query.filter(Blacklist.created_at >= since)
+    chunk = []
+    for row in query.yield_per(chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _ndjson_lines(chunks, schema):
+    for chunk in chunks:
+        yield ''.join(json.dumps(item) + '\n' for item in schema.dump(chunk))
+
+
+def _csv_lines(chunks, schema):
+    buf = io.StringIO()
+    writer = None
+    for chunk in chunks:
+        items = schema.dump(chunk)
+        if writer is None:
+            writer = csv.DictWriter(buf, fieldnames=list(items[0]))
+            writer.writeheader()
+        writer.writerows(items)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def generate_export(fmt, since=None, chunk_size=1000, compress=False):
+    """Yield the encoded export body, chunk by chunk."""
+    from .schemas import BlacklistSchema
+    schema = BlacklistSchema(many=True)
+    serialize = _ndjson_lines if fmt == 'ndjson' else _csv_lines
+    pieces = (piece.encode('utf-8') for piece in serialize(iter_chunks(since, chunk_size), schema))
+    if not compress:
+        yield from pieces
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,120 @@
+"""
+``Idempotency-Key`` support for POST endpoints.
+
+The first request with a key claims it with a single ``INSERT ... ON
+CONFLICT`` and stores its response. Retries with the same key and body are
+answered from that row without writing anything else, so a retry costs one
+primary key read however often it is repeated. Keys expire after
+``IDEMPOTENCY_KEY_TTL`` seconds.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import IdempotencyKey
+from .normalize import EMAIL_KEY_SIZE
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _digest(*parts):
+    return hashlib.blake2b(b'\0'.join(parts), digest_size=EMAIL_KEY_SIZE).digest()
+
+
+def claim(key, request_hash, ttl):
+    """Reserve ``key`` in the current transaction; return False if it is held by another request."""
+    now = datetime.utcnow()
+    table = IdempotencyKey.__table__
+    values = {'key': key, 'request_hash': request_hash, 'status_code': None, 'response': None,
+              'expires_at': now + timedelta(seconds=ttl)}
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(db.engine.dialect.name)
+    if dialect is None:
+        db.session.execute(table.delete().where(table.c.key == key, table.c.expires_at <= now))
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), values)
+        except IntegrityError:
+            return False
+        return True
+    stmt = dialect.insert(table)
+    # an expired key is taken over in place
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.key],
+        set_={column: stmt.excluded[column] for column in values if column != 'key'},
+        where=table.c.expires_at <= now,
+    )
+    return db.session.execute(stmt, values).rowcount == 1
+
+
+def record(key, body, status_code):
+    """Store the response for a claimed key; committed with the caller's transaction."""
+    table = IdempotencyKey.__table__
+    db.session.execute(
+        table.update().where(table.c.key == key).values(status_code=status_code, response=json.dumps(body))
+    )
+
+
+def purge_expired(batch_size=10000):
+    """Delete expired keys in batches; return the number deleted."""
+    table = IdempotencyKey.__table__
+    deleted = 0
+    while True:
+        keys = [row.key for row in db.session.execute(
+            select(table.c.key)
+            .where(table.c.expires_at <= datetime.utcnow())
+            .limit(batch_size)
+        )]
+        if not keys:
+            return deleted
+        db.session.execute(table.delete().where(table.c.key.in_(keys)))
+        db.session.commit()
+        deleted += len(keys)
+
+
+def idempotent(handler):
+    """Run ``handler`` at most once per ``Idempotency-Key`` and replay its response to retries.
+
+    ``handler`` returns a Flask-RESTful ``(body, status)`` or ``(body, status,
+    headers)`` tuple and may commit. Without the header it is simply called.
+    Responses with a 5xx status are not stored, so the client may retry them.
+    """
+    value = request.headers.get(HEADER)
+    if value is None:
+        return handler()
+    if not value or len(value) > MAX_KEY_LENGTH:
+        return {'msg': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}, 400
+
+    key = _digest(request.path.encode('utf-8'), value.encode('utf-8'))
+    request_hash = _digest(request.get_data())
+    if not claim(key, request_hash, current_app.config['IDEMPOTENCY_KEY_TTL']):
+        db.session.rollback()
+        return _replay(key, request_hash)
+
+    try:
+        result = handler()
+    except Exception:
+        db.session.rollback()
+        raise
+    body, status_code = result[0], result[1]
+    if status_code >= 500:
+        db.session.rollback()
+        return result
+    record(key, body, status_code)
+    db.session.commit()
+    return result
+
+
+def _replay(key, request_hash):
+    stored = db.session.get(IdempotencyKey, key)
+    if stored is not None and stored.request_hash != request_hash:
+        return {'msg': f'{HEADER} was already used for a different request'}, 422
+    if stored is None or stored.status_code is None:
+        return {'msg': f'A request with this {HEADER} is in progress'}, 409, {'Retry-After': '1'}
+    return json.loads(stored.response), stored.status_code, {'Idempotent-Replayed': 'true'}
@@ -0,0 +1,225 @@
+"""
+Validation and batched insertion of blacklist rows.
+"""
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import db
+from .lookup import announce_keys, invalidate_keys
+from .models import Blacklist, count_rows, upsert_status
+from .normalize import dedup_key, email_key
+from .patterns import is_pattern
+from .utils import parse_datetime
+
+MAX_EMAIL_LENGTH = 255
+MAX_APP_UUID_LENGTH = 255
+MAX_REASON_LENGTH = 1024
+
+_COPY_COLUMNS = (
+    'email', 'email_key', 'app_uuid', 'blocked_reason', 'ip_address', 'request_date', 'created_at', 'expires_at',
+)
+
+
+def parse_items(body, content_type):
+    """Split a JSON array or NDJSON request body into ``(items, errors)``.
+
+    NDJSON lines that are not valid JSON are reported as row errors instead
+    of failing the whole request. Raises ValueError if a JSON body is not an
+    array.
+    """
+    if 'ndjson' in (content_type or ''):
+        items, errors = [], []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                errors.append({'index': len(items), 'msg': 'invalid JSON'})
+                items.append(None)
+        return items, errors
+    items = json.loads(body or 'null')
+    if not isinstance(items, list):
+        raise ValueError('body must be a JSON array')
+    return items, []
+
+
+def validate_row(item, ip_address=None, now=None, patterns=False):
+    """Return ``(row, error)`` for one submitted entry; exactly one is None.
+
+    Domain patterns are rejected unless ``patterns`` is True.
+    """
+    if not isinstance(item, dict):
+        return None, 'entry must be a JSON object'
+    email = item.get('email')
+    if not email or not isinstance(email, str):
+        return None, 'email is required'
+    if len(email) > MAX_EMAIL_LENGTH:
+        return None, f'email must be at most {MAX_EMAIL_LENGTH} characters'
+    if not patterns and is_pattern(email):
+        return None, 'domain patterns must be posted to /blacklists'
+    app_uuid = item.get('app_uuid')
+    if app_uuid is not None and (not isinstance(app_uuid, str) or len(app_uuid) > MAX_APP_UUID_LENGTH):
+        return None, f'app_uuid must be a string of at most {MAX_APP_UUID_LENGTH} characters'
+    blocked_reason = item.get('blocked_reason')
+    if blocked_reason is not None and (
+            not isinstance(blocked_reason, str) or len(blocked_reason) > MAX_REASON_LENGTH):
+        return None, f'blocked_reason must be a string of at most {MAX_REASON_LENGTH} characters'
+    now = now or datetime.utcnow()
+    expires_at, error = parse_expires_at(item.get('expires_at'), now)
+    if error:
+        return None, error
+    return {
+        'email': email,
+        'email_key': email_key(email),
+        'app_uuid': app_uuid,
+        'blocked_reason': blocked_reason,
+        'ip_address': ip_address,
+        'request_date': now,
+        'created_at': now,
+        'expires_at': expires_at,
+    }, None
+
+
+def parse_expires_at(value, now=None):
+    """Return ``(expires_at, error)`` for an optional ISO 8601 ``expires_at`` value."""
+    if value is None:
+        return None, None
+    try:
+        expires_at = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        expires_at = None
+    if expires_at is None:
+        return None, 'expires_at must be an ISO 8601 timestamp'
+    if expires_at <= (now or datetime.utcnow()):
+        return None, 'expires_at must be in the future'
+    return expires_at, None
+
+
+def insert_rows(rows, chunk_size=1000):
+    """Insert validated rows in chunks within a single transaction.
+
+    PostgreSQL uses ``COPY FROM STDIN``; other databases use one
+    ``executemany`` per chunk.
+    """
+    if not rows:
+        return 0
+    if db.engine.dialect.name == 'postgresql':
+        insert_chunk = _copy_chunk
+    else:
+        insert_chunk = _executemany_chunk
+    announce_keys(row['email_key'] for row in rows)
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            insert_chunk(chunk)
+            upsert_status(db.session.connection(), chunk)
+        # last, so the shared stats rows stay locked for as short as possible
+        count_rows(db.session.connection(), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_keys(row['email_key'] for row in rows)
+    return len(rows)
+
+
+# columns an upsert overwrites on the existing entry for the same email and app
+_UPSERT_COLUMNS = ('email', 'blocked_reason', 'ip_address', 'request_date', 'created_at', 'expires_at')
+
+
+def upsert_row(row):
+    """Insert a validated row, or update the entry for the same email and app_uuid in place.
+
+    Only entries previously written with upsert are matched; plain history
+    rows are left as they are. The existing row keeps its id.
+    """
+    row = dict(row, dedup_key=dedup_key(row['email'], row['app_uuid']))
+    table = Blacklist.__table__
+    announce_keys([row['email_key']])
+    try:
+        dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(db.engine.dialect.name)
+        if dialect is None:
+            existing = Blacklist.query.filter_by(dedup_key=row['dedup_key']).first()
+            if existing is None:
+                db.session.add(Blacklist(**row))
+            else:
+                for column in _UPSERT_COLUMNS:
+                    setattr(existing, column, row[column])
+        else:
+            # the replaced values are needed to move the entry between stats groups
+            previous = _locked_entry(row['dedup_key'])
+            if previous is None:
+                inserted = db.session.execute(
+                    dialect.insert(table).on_conflict_do_nothing(index_elements=[table.c.dedup_key]), row,
+                ).rowcount
+                if not inserted:
+                    # a concurrent upsert inserted it first
+                    previous = _locked_entry(row['dedup_key'])
+            if previous is not None:
+                db.session.execute(
+                    table.update()
+                    .where(table.c.dedup_key == row['dedup_key'])
+                    .values({column: row[column] for column in _UPSERT_COLUMNS})
+                )
+            upsert_status(db.session.connection(), [row])
+            count_rows(db.session.connection(), [row], [previous._mapping] if previous is not None else ())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_keys([row['email_key']])
+
+
+def _locked_entry(key):
+    table = Blacklist.__table__
+    return db.session.execute(
+        select(table.c.app_uuid, table.c.blocked_reason, table.c.created_at)
+        .where(table.c.dedup_key == key)
+        .with_for_update()
+    ).first()
+
+
+def _executemany_chunk(rows):
+    db.session.execute(Blacklist.__table__.insert(), rows)
+
+
+def _copy_value(value):
+    """Format ``value`` as a CSV field for COPY: NULL unquoted, everything else quoted.
+
+    COPY reads an unquoted empty field as NULL, so an empty string has to be
+    quoted to stay an empty string.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, bytes):
+        value = '\\x' + value.hex()  # bytea hex format
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_csv(rows):
+    """Return ``rows`` as a CSV buffer for ``COPY ... FROM STDIN WITH (FORMAT csv)``."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(','.join(_copy_value(row[column]) for column in _COPY_COLUMNS))
+        buf.write('\n')
+    buf.seek(0)
+    return buf
+
+
+def _copy_chunk(rows):
+    buf = _copy_csv(rows)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {Blacklist.__tablename__} ({', '.join(_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buf,
+        )
+    finally:
+        cursor.close()
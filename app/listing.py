@@ -0,0 +1,61 @@
+"""
+Keyset pagination of blacklist entries for GET /blacklists.
+
+Pages are ordered newest first by ``(created_at, id)``. Instead of an
+``OFFSET``, which makes the database walk every skipped row, each page
+starts strictly after the last row of the previous one, so any page costs
+one index range scan of ``limit`` rows. The position is handed to clients
+as an opaque cursor.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from .models import Blacklist
+
+
+def encode_cursor(row):
+    """Return the cursor of the page that starts after ``row``."""
+    position = json.dumps([row.created_at.isoformat(), row.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id)`` from a cursor; raises ValueError if it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as exc:
+        raise ValueError('invalid cursor') from exc
+
+
+def list_page(limit, cursor=None, app_uuid=None, blocked_reason=None, since=None, until=None):
+    """Return ``(rows, next_cursor)`` for one page; ``next_cursor`` is None on the last page.
+
+    ``since`` is inclusive and ``until`` exclusive, both on ``created_at``.
+    """
+    query = Blacklist.query
+    if app_uuid is not None:
+        query = query.filter(Blacklist.app_uuid == app_uuid)
+    if blocked_reason is not None:
+        query = query.filter(Blacklist.blocked_reason == blocked_reason)
+    if since is not None:
+        query = query.filter(Blacklist.created_at >= since)
+    if until is not None:
+        query = query.filter(Blacklist.created_at < until)
+    if cursor is not None:
+        query = query.filter(tuple_(Blacklist.created_at, Blacklist.id) < decode_cursor(cursor))
+    # one extra row tells whether another page follows
+    rows = (
+        query.order_by(Blacklist.created_at.desc(), Blacklist.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
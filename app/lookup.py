@@ -0,0 +1,263 @@
+"""
+Resolution of blacklist lookups through the in-process fast paths and the database.
+
+Every layer is keyed by ``email_key``, the digest of the normalized email, so
+all spellings of an address share cache entries and status rows.
+"""
+from collections import namedtuple
+from datetime import datetime
+from functools import partial
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .cache import MISSING
+from .metrics import LOOKUP_FALLBACK, LOOKUP_SINGLEFLIGHT
+from .models import Blacklist, BlacklistStatus
+from .normalize import email_key
+from .resilience import CircuitOpen
+from .singleflight import FlightTimeout
+
+# stays below SQLite's default limit of 999 bound parameters
+IN_CLAUSE_CHUNK_SIZE = 500
+
+
+# Warning header values, RFC 7234 section 5.5
+RESPONSE_IS_STALE = '110 - "Response is Stale"'
+REVALIDATION_FAILED = '111 - "Revalidation Failed"'
+
+LookupOutcome = namedtuple('LookupOutcome', 'result cache age warning')
+LookupOutcome.__doc__ = """A lookup result and how it was obtained.
+
+``cache`` is ``HIT``, ``STALE``, ``MISS`` or ``FALLBACK`` when the lookup
+reached the cache, and None for answers from the in-memory fast paths.
+``age`` is the number of seconds since a cached result was read from the
+database, and ``warning`` a Warning header value for stale or fallback answers.
+"""
+
+
+class LookupUnavailable(Exception):
+    """Raised when the database cannot answer a lookup and ``LOOKUP_FAIL_MODE`` is ``error``."""
+
+    def __init__(self, retry_after=1.0):
+        super().__init__('blacklist lookups are unavailable')
+        self.retry_after = retry_after
+
+
+def resolve_email(email):
+    """Return the ``LookupOutcome`` for ``email``.
+
+    A cache entry past its ttl is returned as is while a background thread
+    refreshes it. If the database fails or the circuit breaker is open, a
+    stale entry is served if there is one, and otherwise the answer depends
+    on ``LOOKUP_FAIL_MODE``.
+    """
+    patterns = current_app.extensions.get('blacklist_patterns')
+    if patterns is not None:
+        result = patterns.match(email)
+        if result is not None:
+            return LookupOutcome(result, None, None, None)
+
+    key = email_key(email)
+    bloom = current_app.extensions.get('bloom_filter')
+    if bloom is not None and not bloom.might_contain(key):
+        return LookupOutcome((False, None), None, None, None)
+
+    snapshot = current_app.extensions.get('blacklist_snapshot')
+    if snapshot is not None:
+        result = snapshot.lookup(key)
+        if result is not MISSING:
+            return LookupOutcome(result, None, None, None)
+
+    cache = current_app.extensions['lookup_cache']
+    stale = None
+    # results cached from a lagging replica may predate the client's own write
+    entry = MISSING if db.session.info.get('read_your_writes') else cache.get_entry(key)
+    if entry is not MISSING:
+        result, age, fresh = entry
+        if fresh:
+            return LookupOutcome(result, 'HIT', age, None)
+        stale = LookupOutcome(result, 'STALE', age, RESPONSE_IS_STALE)
+        breaker = current_app.extensions.get('lookup_breaker')
+        if breaker is not None and breaker.is_open:
+            return _fallback(stale)
+        revalidator = current_app.extensions.get('lookup_revalidator')
+        if revalidator is not None:
+            revalidator.submit(key, partial(_query, key, cache))
+            return stale
+
+    try:
+        result = _query(key, cache)
+    except (CircuitOpen, FlightTimeout, SQLAlchemyError) as exc:
+        if isinstance(exc, SQLAlchemyError):
+            db.session.rollback()
+        return _fallback(stale, getattr(exc, 'retry_after', 1.0))
+    return LookupOutcome(result, 'MISS', None, None)
+
+
+def _query(key, cache):
+    """Read ``key`` from the database through the circuit breaker, sharing concurrent queries."""
+    load = partial(_load, key, cache)
+    breaker = current_app.extensions.get('lookup_breaker')
+    if breaker is not None:
+        load = partial(breaker.call, load)
+    flights = current_app.extensions.get('lookup_singleflight')
+    if flights is None:
+        return load()
+    # requests reading from the replica do not share results with those
+    # that must see their own writes on the primary
+    flight = (key, db.session.info.get('read_replica') is not None)
+    try:
+        result, shared = flights.do(flight, load)
+    except FlightTimeout:
+        LOOKUP_SINGLEFLIGHT.labels('timeout').inc()
+        raise
+    LOOKUP_SINGLEFLIGHT.labels('coalesced' if shared else 'query').inc()
+    return result
+
+
+def _load(key, cache):
+    """Resolve ``key`` from the status table and cache the result unless a write invalidated it meanwhile."""
+    generation = cache.generation(key)
+    status = db.session.get(BlacklistStatus, key)
+    result, ttl = _resolve(key, status and (status.blocked_reason, status.expires_at))
+    cache.set(key, result, ttl, generation)
+    return result
+
+
+def _fallback(stale, retry_after=1.0):
+    """Answer a lookup the database could not: from ``stale`` if given, else per ``LOOKUP_FAIL_MODE``."""
+    if stale is not None:
+        LOOKUP_FALLBACK.labels('stale').inc()
+        return stale._replace(warning=REVALIDATION_FAILED)
+    mode = current_app.config['LOOKUP_FAIL_MODE']
+    LOOKUP_FALLBACK.labels(mode).inc()
+    if mode == 'error':
+        raise LookupUnavailable(retry_after)
+    warning = f'199 - "Database unavailable; fail-{mode} answer"'
+    return LookupOutcome((mode == 'closed', None), 'FALLBACK', None, warning)
+
+
+def _resolve(key, entry):
+    """Return ``((blocked, reason), ttl)`` for the ``(blocked_reason, expires_at)`` status of ``key``.
+
+    ``ttl`` is the number of seconds until the result expires, or None if
+    it does not. If the latest entry has expired but not been swept yet,
+    the latest unexpired entry of the email decides.
+    """
+    if entry is None:
+        return (False, None), None
+    reason, expires_at = entry
+    if expires_at is None:
+        return (True, reason), None
+    now = datetime.utcnow()
+    if expires_at <= now:
+        entry = _active_entry(key, now)
+        if entry is None:
+            return (False, None), None
+        reason, expires_at = entry
+        if expires_at is None:
+            return (True, reason), None
+    return (True, reason), (expires_at - now).total_seconds()
+
+
+def _active_entry(key, now):
+    """Return ``(blocked_reason, expires_at)`` of the latest unexpired entry for ``key``, or None."""
+    return (
+        db.session.query(Blacklist.blocked_reason, Blacklist.expires_at)
+        .filter(Blacklist.email_key == key, or_(Blacklist.expires_at.is_(None), Blacklist.expires_at > now))
+        .order_by(Blacklist.created_at.desc(), Blacklist.id.desc())
+        .first()
+    )
+
+
+def lookup_emails(emails):
+    """Return ``{email: (blocked, reason)}`` for many emails at once.
+
+    Emails matched by a domain pattern, ruled out by the Bloom filter or
+    answered by the snapshot or the cache are resolved in memory; the rest are resolved with one primary key
+    ``IN`` query per chunk of ``IN_CLAUSE_CHUNK_SIZE`` keys.
+    """
+    patterns = current_app.extensions.get('blacklist_patterns')
+    bloom = current_app.extensions.get('bloom_filter')
+    snapshot = current_app.extensions.get('blacklist_snapshot')
+    cache = current_app.extensions['lookup_cache']
+    read_your_writes = db.session.info.get('read_your_writes', False)
+    matched = {}
+    keys = {}
+    results = {}
+    pending = []
+    for email in emails:
+        if email in keys or email in matched:
+            continue
+        if patterns is not None:
+            result = patterns.match(email)
+            if result is not None:
+                matched[email] = result
+                continue
+        key = keys[email] = email_key(email)
+        if key in results:
+            continue
+        if bloom is not None and not bloom.might_contain(key):
+            results[key] = (False, None)
+            continue
+        if snapshot is not None:
+            result = snapshot.lookup(key)
+            if result is not MISSING:
+                results[key] = result
+                continue
+        cached = MISSING if read_your_writes else cache.get(key)
+        if cached is MISSING:
+            results[key] = (False, None)
+            pending.append(key)
+        else:
+            results[key] = cached
+
+    ttls = {}
+    for start in range(0, len(pending), IN_CLAUSE_CHUNK_SIZE):
+        chunk = pending[start:start + IN_CLAUSE_CHUNK_SIZE]
+        generations = {key: cache.generation(key) for key in chunk}
+        for key, reason, expires_at in _latest_reasons(chunk):
+            results[key], ttls[key] = _resolve(key, (reason, expires_at))
+        for key in chunk:
+            cache.set(key, results[key], ttls.get(key), generations[key])
+    resolved = {email: results[key] for email, key in keys.items()}
+    resolved.update(matched)
+    return resolved
+
+
+def _latest_reasons(keys):
+    """Yield ``(email_key, blocked_reason, expires_at)`` for each blacklisted key."""
+    return db.session.query(
+        BlacklistStatus.email_key, BlacklistStatus.blocked_reason, BlacklistStatus.expires_at,
+    ).filter(BlacklistStatus.email_key.in_(keys))
+
+
+def invalidate_keys(keys):
+    """Drop cached results for email keys after they have been written."""
+    cache = current_app.extensions['lookup_cache']
+    flights = current_app.extensions.get('lookup_singleflight')
+    for key in keys:
+        cache.invalidate(key)
+        if flights is not None:
+            # a query started before the write must not answer lookups made after it
+            for from_replica in (False, True):
+                flights.forget((key, from_replica))
+    snapshot = current_app.extensions.get('blacklist_snapshot')
+    if snapshot is not None:
+        snapshot.expire()
+
+
+def announce_keys(keys):
+    """Add email keys about to be inserted outside the ORM to the Bloom filter.
+
+    Call this before committing so no lookup can see a committed row that
+    the filter still rules out; a rolled back insert only costs a false
+    positive.
+    """
+    bloom = current_app.extensions.get('bloom_filter')
+    if bloom is not None:
+        for key in keys:
+            bloom.add(key)
@@ -0,0 +1,194 @@
+"""
+Prometheus metrics for requests, database statements and the connection pool.
+
+Metrics are module-level so every app in the process shares them. Under
+gunicorn, set ``PROMETHEUS_MULTIPROC_DIR`` to an empty, writable directory
+before the workers start: each process then writes its samples to memory
+mapped files there and ``/metrics`` aggregates all of them.
+"""
+import os
+import time
+
+from flask import Response, current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+from . import db
+from .config import env_bool
+
+REQUEST_COUNT = Counter(
+    'blacklist_api_requests_total',
+    'HTTP requests by resource, method and status code.',
+    ['resource', 'method', 'status'],
+)
+REQUEST_LATENCY = Histogram(
+    'blacklist_api_request_duration_seconds',
+    'Time spent handling HTTP requests by resource and method.',
+    ['resource', 'method'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+DB_STATEMENT_LATENCY = Histogram(
+    'blacklist_api_db_statement_duration_seconds',
+    'Time spent executing database statements by statement type.',
+    ['operation'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1),
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    'blacklist_api_db_pool_checked_out',
+    'Database connections currently checked out of the pool.',
+    multiprocess_mode='livesum',
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'blacklist_api_db_pool_connections',
+    'Database connections currently open, idle or checked out.',
+    multiprocess_mode='livesum',
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    'blacklist_api_db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the pool.',
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10),
+)
+DB_READ_ROUTE = Counter(
+    'blacklist_api_db_read_route_total',
+    'Read-only requests by the database they were sent to and why.',
+    ['target', 'reason'],
+)
+DB_REPLICA_LAG = Gauge(
+    'blacklist_api_db_replica_lag_seconds',
+    'Age of the oldest write the read replica has not applied yet.',
+    multiprocess_mode='livemax',
+)
+EXPIRY_SWEPT = Counter(
+    'blacklist_api_expiry_swept_rows_total',
+    'Expired blacklist entries removed by the sweeper, by whether they were archived or deleted.',
+    ['action'],
+)
+EXPIRY_SWEEP_ROWS = Histogram(
+    'blacklist_api_expiry_sweep_rows',
+    'Expired blacklist entries removed per sweep run.',
+    buckets=(0, 1, 10, 100, 500, 1000, 5000, 10000, 50000),
+)
+EXPIRY_SWEEP_DURATION = Histogram(
+    'blacklist_api_expiry_sweep_duration_seconds',
+    'Time spent per sweep run.',
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+
+LOOKUP_CACHE = Counter(
+    'blacklist_api_lookup_cache_total',
+    'Lookup cache reads by result: fresh hit, stale hit or miss.',
+    ['result'],
+)
+LOOKUP_CACHE_EVICTIONS = Counter(
+    'blacklist_api_lookup_cache_evictions_total',
+    'Lookup cache entries evicted to stay within LOOKUP_CACHE_SIZE.',
+)
+BLOOM_FILTER = Counter(
+    'blacklist_api_bloom_filter_total',
+    'Lookups checked against the Bloom filter, by whether it answered them or the database was needed.',
+    ['outcome'],
+)
+
+LOOKUP_SINGLEFLIGHT = Counter(
+    'blacklist_api_lookup_singleflight_total',
+    'Lookups that missed the cache, by whether they queried the database, shared a concurrent '
+    'query or timed out waiting for it.',
+    ['outcome'],
+)
+
+LOOKUP_BREAKER_OPEN = Gauge(
+    'blacklist_api_lookup_breaker_open',
+    'Worker processes whose lookup circuit breaker is open.',
+    multiprocess_mode='livesum',
+)
+LOOKUP_FALLBACK = Counter(
+    'blacklist_api_lookup_fallback_total',
+    'Lookups answered without the database because it failed or the breaker was open, by answer: '
+    'stale cache entry, fail-open, fail-closed or error.',
+    ['answer'],
+)
+
+_OPERATIONS = frozenset(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'COPY', 'BEGIN', 'COMMIT', 'ROLLBACK'))
+
+
+def _resource_name(app, endpoint):
+    """Return the resource class (or view function) name serving ``endpoint``."""
+    if endpoint is None:
+        return 'unmatched'
+    view = app.view_functions.get(endpoint)
+    view_class = getattr(view, 'view_class', None)
+    return view_class.__name__ if view_class is not None else endpoint
+
+
+def _start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _record_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        resource = _resource_name(current_app, request.endpoint)
+        REQUEST_LATENCY.labels(resource, request.method).observe(time.perf_counter() - start)
+        REQUEST_COUNT.labels(resource, request.method, response.status_code).inc()
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_statement_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_statement_start'].pop()
+    words = statement.lstrip()[:8].upper().split(None, 1)
+    operation = words[0] if words and words[0] in _OPERATIONS else 'OTHER'
+    DB_STATEMENT_LATENCY.labels(operation).observe(elapsed)
+
+
+def _handle_error(context):
+    # after_cursor_execute is skipped for failed statements
+    starts = context.connection.info.get('metrics_statement_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    """Time statements and track pool usage on ``engine``."""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    event.listen(engine, 'connect', lambda *args: DB_POOL_CONNECTIONS.inc())
+    event.listen(engine, 'close', lambda *args: DB_POOL_CONNECTIONS.dec())
+    event.listen(engine, 'close_detached', lambda *args: DB_POOL_CONNECTIONS.dec())
+    event.listen(engine, 'checkout', lambda *args: DB_POOL_CHECKED_OUT.inc())
+    event.listen(engine, 'checkin', lambda *args: DB_POOL_CHECKED_OUT.dec())
+
+
+def metrics_view():
+    """Render every metric, aggregated across worker processes when enabled."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Register ``/metrics`` and the request and database instrumentation."""
+    app.config.setdefault('METRICS_ENABLED', env_bool('METRICS_ENABLED', True))
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    with app.app_context():
+        instrument_engine(db.engine)
@@ -1,17 +1,434 @@
 from . import db
+import hashlib
+from collections import Counter
 from datetime import datetime
+from sqlalchemy import event, func, inspect, literal, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import validates
+
+from .normalize import EMAIL_KEY_SIZE, email_key
+
+
+def _default_email_key(context):
+    return email_key(context.get_current_parameters()['email'])
 
 
 class Blacklist(db.Model):
     __tablename__ = 'blacklists'
+    # keyset pagination of GET /blacklists, newest first, optionally filtered
+    __table_args__ = (
+        db.Index('ix_blacklists_created_at_id', 'created_at', 'id'),
+        db.Index('ix_blacklists_app_uuid_created_at_id', 'app_uuid', 'created_at', 'id'),
+        db.Index('ix_blacklists_blocked_reason_created_at_id', 'blocked_reason', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(255), nullable=False, index=True)
+    email = db.Column(db.String(255), nullable=False)
+    # digest of the normalized email; the column lookups are indexed on
+    email_key = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), nullable=False, index=True,
+                          default=_default_email_key)
     app_uuid = db.Column(db.String(255), nullable=True)
     blocked_reason = db.Column(db.String(1024), nullable=True)
     ip_address = db.Column(db.String(45), nullable=True)  # IPv4 or IPv6
+    # digest of (email_key, app_uuid) for entries written with upsert; NULL for plain history rows
+    dedup_key = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), nullable=True, index=True, unique=True)
     request_date = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # the entry stops blocking at this time and is then swept; NULL blocks forever
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    @validates('email')
+    def _set_email_key(self, key, email):
+        self.email_key = email_key(email)
+        return email
 
     def __repr__(self):
         return f'<Blacklist {self.email}>'
 
+
+class BlacklistStatus(db.Model):
+    """Current status of each blacklisted email: its latest ``Blacklist`` row.
+
+    Kept in step with ``blacklists`` in the same transaction as every write,
+    so lookups are a primary key read instead of a sort over the history.
+    Rows are keyed by ``email_key``, so all spellings of an address share one.
+    """
+    __tablename__ = 'blacklist_status'
+    email_key = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), primary_key=True)
+    email = db.Column(db.String(255), nullable=False)  # as submitted in the latest entry
+    app_uuid = db.Column(db.String(255), nullable=True)
+    blocked_reason = db.Column(db.String(1024), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<BlacklistStatus {self.email}>'
+
+
+class BlacklistArchive(db.Model):
+    """Expired ``blacklists`` rows moved aside by the sweeper, with their original ids."""
+    __tablename__ = 'blacklists_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    email = db.Column(db.String(255), nullable=False)
+    email_key = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), nullable=False)
+    app_uuid = db.Column(db.String(255), nullable=True)
+    blocked_reason = db.Column(db.String(1024), nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    dedup_key = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), nullable=True)
+    request_date = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BlacklistArchive {self.email}>'
+
+
+class BlacklistChange(db.Model):
+    """One change of an email's status, read in ``id`` order by GET /blacklists/changes.
+
+    Written in the same transaction as the change, from the status row as it
+    stands after it: ``blocked`` is False once an email has no entries left,
+    e.g. after its last entry expired and was swept. Rows older than
+    ``CHANGES_RETENTION_DAYS`` are deleted by ``flask purge-changes``.
+    """
+    __tablename__ = 'blacklist_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    email_key = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), nullable=False)
+    email = db.Column(db.String(255), nullable=False)
+    blocked = db.Column(db.Boolean, nullable=False)
+    app_uuid = db.Column(db.String(255), nullable=True)
+    blocked_reason = db.Column(db.String(1024), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<BlacklistChange {self.id} {self.email}>'
+
+
+class BlacklistDailyStats(db.Model):
+    """Number of ``blacklists`` rows per creation day, ``app_uuid`` and ``blocked_reason``.
+
+    Maintained in the same transaction as every write, like
+    ``blacklist_status``, so GET /blacklists/stats reads one row per group
+    instead of counting the history. Rows are keyed by a digest of the group
+    because ``app_uuid`` and ``blocked_reason`` may be NULL.
+    """
+    __tablename__ = 'blacklist_daily_stats'
+    group_key = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    app_uuid = db.Column(db.String(255), nullable=True)
+    blocked_reason = db.Column(db.String(1024), nullable=True)
+    count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<BlacklistDailyStats {self.day} {self.app_uuid} {self.blocked_reason}: {self.count}>'
+
+
+class BlacklistPattern(db.Model):
+    """Blocks every address at a domain (``*@domain``) or its subdomains (``*@*.domain``)."""
+    __tablename__ = 'blacklist_patterns'
+    id = db.Column(db.Integer, primary_key=True)
+    pattern = db.Column(db.String(255), nullable=False)
+    domain = db.Column(db.String(255), nullable=False)
+    include_subdomains = db.Column(db.Boolean, nullable=False, default=False)
+    app_uuid = db.Column(db.String(255), nullable=True)
+    blocked_reason = db.Column(db.String(1024), nullable=True)
+    ip_address = db.Column(db.String(45), nullable=True)
+    request_date = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BlacklistPattern {self.pattern}>'
+
+
+class IdempotencyKey(db.Model):
+    """Outcome of a POST sent with an ``Idempotency-Key`` header, replayed to retries.
+
+    Keys and request bodies are stored as digests. ``status_code`` is NULL
+    while the first request is in progress. Expired rows are reclaimed by the
+    next request with the same key or deleted by ``flask purge-idempotency-keys``.
+    """
+    __tablename__ = 'idempotency_keys'
+    key = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), primary_key=True)
+    request_hash = db.Column(db.LargeBinary(EMAIL_KEY_SIZE), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)
+    response = db.Column(db.Text, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class SchemaVersion(db.Model):
+    """Schema versions applied by ``flask init-db``; the highest is current."""
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+_STATUS_COLUMNS = ('email_key', 'email', 'app_uuid', 'blocked_reason', 'updated_at', 'expires_at')
+
+
+def upsert_status(connection, rows):
+    """Record ``rows`` (dicts with Blacklist columns) as the latest status of their emails.
+
+    A row only replaces an existing status if it is at least as recent.
+    """
+    latest = {}
+    for row in rows:
+        current = latest.get(row['email_key'])
+        if current is None or current['created_at'] <= row['created_at']:
+            latest[row['email_key']] = row
+    if not latest:
+        return
+    values = [
+        {
+            'email_key': row['email_key'],
+            'email': row['email'],
+            'app_uuid': row.get('app_uuid'),
+            'blocked_reason': row.get('blocked_reason'),
+            'updated_at': row['created_at'],
+            'expires_at': row.get('expires_at'),
+        }
+        for row in latest.values()
+    ]
+    table = BlacklistStatus.__table__
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(connection.dialect.name)
+    if dialect is None:
+        for value in values:
+            _refresh_status(connection, value['email_key'])
+    else:
+        stmt = dialect.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.email_key],
+            set_={column: stmt.excluded[column] for column in _STATUS_COLUMNS[1:]},
+            where=table.c.updated_at <= stmt.excluded.updated_at,
+        )
+        connection.execute(stmt, values)
+    record_changes(connection, list(latest))
+
+
+# any constant works, as long as it is only used here
+_CHANGES_LOCK_ID = 0x626C6368
+
+
+def record_changes(connection, keys, removed=None):
+    """Append the current status of ``keys`` to ``blacklist_changes``.
+
+    ``removed`` maps email keys that may have lost their last entry to their
+    email; those without a status row are recorded as unblocked.
+    """
+    if not keys:
+        return
+    if connection.dialect.name == 'postgresql':
+        # ids are drawn from a sequence before commit, so without this a
+        # reader could see id 11 committed, move its cursor past it, and
+        # then miss id 10 committing later; held until commit
+        connection.execute(text('SELECT pg_advisory_xact_lock(:id)'), {'id': _CHANGES_LOCK_ID})
+    status = BlacklistStatus.__table__
+    changes = BlacklistChange.__table__
+    now = datetime.utcnow()
+    keys = sorted(keys)
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        connection.execute(changes.insert().from_select(
+            ['email_key', 'email', 'blocked', 'app_uuid', 'blocked_reason', 'expires_at', 'changed_at'],
+            select(
+                status.c.email_key, status.c.email, literal(True), status.c.app_uuid,
+                status.c.blocked_reason, status.c.expires_at, literal(now, db.DateTime),
+            ).where(status.c.email_key.in_(chunk)).order_by(status.c.email_key),
+        ))
+    if removed:
+        remaining = {
+            row.email_key for row in connection.execute(
+                select(status.c.email_key).where(status.c.email_key.in_(list(removed)))
+            )
+        }
+        unblocked = [
+            {'email_key': key, 'email': email, 'blocked': False, 'changed_at': now}
+            for key, email in sorted(removed.items())
+            if key not in remaining
+        ]
+        if unblocked:
+            connection.execute(changes.insert(), unblocked)
+    # read by app.changes to wake long-polling readers after the commit
+    connection.info['changes_recorded'] = True
+
+
+def _group_key(day, app_uuid, blocked_reason):
+    # NULL and '' are different groups, so each part is tagged as present or not
+    parts = [day.isoformat()] + ['' if value is None else f'={value}' for value in (app_uuid, blocked_reason)]
+    return hashlib.blake2b('\0'.join(parts).encode('utf-8'), digest_size=EMAIL_KEY_SIZE).digest()
+
+
+def count_rows(connection, added=(), removed=()):
+    """Add ``added`` to and subtract ``removed`` from the daily stats.
+
+    Both are iterables of dicts with Blacklist columns.
+    """
+    deltas = Counter()
+    for rows, sign in ((added, 1), (removed, -1)):
+        for row in rows:
+            deltas[(row['created_at'].date(), row.get('app_uuid'), row.get('blocked_reason'))] += sign
+    update_stats(connection, deltas)
+
+
+def update_stats(connection, deltas):
+    """Add ``{(day, app_uuid, blocked_reason): delta}`` to ``blacklist_daily_stats``."""
+    values = [
+        {'group_key': _group_key(*group), 'day': group[0], 'app_uuid': group[1],
+         'blocked_reason': group[2], 'count': delta}
+        for group, delta in deltas.items()
+        if delta
+    ]
+    if not values:
+        return
+    # a fixed order, so concurrent bulk inserts lock shared groups in the same order
+    values.sort(key=lambda value: value['group_key'])
+    table = BlacklistDailyStats.__table__
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(connection.dialect.name)
+    if dialect is None:
+        for value in values:
+            updated = connection.execute(
+                table.update()
+                .where(table.c.group_key == value['group_key'])
+                .values(count=table.c.count + value['count'])
+            ).rowcount
+            if not updated:
+                connection.execute(table.insert().values(**value))
+        return
+    stmt = dialect.insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.group_key],
+        set_={'count': table.c.count + stmt.excluded.count},
+    )
+    connection.execute(stmt, values)
+
+
+def rebuild_stats():
+    """Repopulate ``blacklist_daily_stats`` from the full history; return the group count."""
+    history = Blacklist.__table__
+    day = func.date(history.c.created_at, type_=db.Date)
+    groups = db.session.execute(
+        select(day, history.c.app_uuid, history.c.blocked_reason, func.count())
+        .group_by(day, history.c.app_uuid, history.c.blocked_reason)
+    ).fetchall()
+    db.session.execute(BlacklistDailyStats.__table__.delete())
+    update_stats(db.session.connection(), {tuple(group[:3]): group[3] for group in groups})
+    db.session.commit()
+    return len(groups)
+
+
+def stats_need_backfill():
+    """Return True if there is history but no stats rows, e.g. right after upgrading."""
+    has_history = db.session.query(Blacklist.id).limit(1).first() is not None
+    has_stats = db.session.query(BlacklistDailyStats.group_key).limit(1).first() is not None
+    return has_history and not has_stats
+
+
+def _latest_rows_query(keys=None):
+    """Select the latest ``Blacklist`` row per email as status columns, optionally for ``keys`` only."""
+    table = Blacklist.__table__
+    rank = func.row_number().over(
+        partition_by=table.c.email_key,
+        order_by=(table.c.created_at.desc(), table.c.id.desc()),
+    ).label('rank')
+    ranked = select(
+        table.c.email_key, table.c.email, table.c.app_uuid,
+        table.c.blocked_reason, table.c.created_at.label('updated_at'), table.c.expires_at, rank,
+    )
+    if keys is not None:
+        ranked = ranked.where(table.c.email_key.in_(keys))
+    ranked = ranked.subquery()
+    return select(
+        ranked.c.email_key, ranked.c.email, ranked.c.app_uuid, ranked.c.blocked_reason,
+        ranked.c.updated_at, ranked.c.expires_at,
+    ).where(ranked.c.rank == 1)
+
+
+def _refresh_status(connection, key):
+    """Recompute the status of one email key from its remaining history."""
+    status = BlacklistStatus.__table__
+    connection.execute(status.delete().where(status.c.email_key == key))
+    history = Blacklist.__table__
+    latest = connection.execute(
+        select(history.c.email, history.c.app_uuid, history.c.blocked_reason, history.c.created_at,
+               history.c.expires_at)
+        .where(history.c.email_key == key)
+        .order_by(history.c.created_at.desc(), history.c.id.desc())
+        .limit(1)
+    ).first()
+    if latest is not None:
+        connection.execute(status.insert().values(
+            email_key=key,
+            email=latest.email,
+            app_uuid=latest.app_uuid,
+            blocked_reason=latest.blocked_reason,
+            updated_at=latest.created_at,
+            expires_at=latest.expires_at,
+        ))
+
+
+def refresh_statuses(connection, keys):
+    """Recompute the status of many email keys at once, e.g. after deleting some of their rows."""
+    status = BlacklistStatus.__table__
+    connection.execute(status.delete().where(status.c.email_key.in_(keys)))
+    connection.execute(status.insert().from_select(list(_STATUS_COLUMNS), _latest_rows_query(keys)))
+
+
+def rebuild_status():
+    """Repopulate ``blacklist_status`` from the full history; return the row count."""
+    status = BlacklistStatus.__table__
+    db.session.execute(status.delete())
+    db.session.execute(status.insert().from_select(list(_STATUS_COLUMNS), _latest_rows_query()))
+    db.session.commit()
+    return db.session.query(func.count()).select_from(status).scalar()
+
+
+def status_needs_backfill():
+    """Return True if there is history but no status rows, e.g. right after upgrading."""
+    has_history = db.session.query(Blacklist.id).limit(1).first() is not None
+    has_status = db.session.query(BlacklistStatus.email_key).limit(1).first() is not None
+    return has_history and not has_status
+
+
+def _row(target):
+    return {
+        'email_key': target.email_key,
+        'email': target.email,
+        'app_uuid': target.app_uuid,
+        'blocked_reason': target.blocked_reason,
+        'created_at': target.created_at,
+        'expires_at': target.expires_at,
+    }
+
+
+@event.listens_for(Blacklist, 'after_insert')
+def _status_after_insert(mapper, connection, target):
+    row = _row(target)
+    upsert_status(connection, [row])
+    count_rows(connection, [row])
+
+
+@event.listens_for(Blacklist, 'after_update')
+def _status_after_update(mapper, connection, target):
+    state = inspect(target)
+    history = state.attrs.email_key.history
+    emails = {target.email_key: target.email}
+    if history.deleted:
+        # the entry moved to another address, which may have no entries left
+        emails[history.deleted[0]] = (state.attrs.email.history.deleted or [target.email])[0]
+    for key in emails:
+        _refresh_status(connection, key)
+    record_changes(connection, list(emails), removed=emails)
+    # the previous values are only known for attributes loaded before the change
+    previous = _row(target)
+    for column in ('app_uuid', 'blocked_reason', 'created_at'):
+        deleted = state.attrs[column].history.deleted
+        if deleted:
+            previous[column] = deleted[0]
+    count_rows(connection, [_row(target)], [previous])
+
+
+@event.listens_for(Blacklist, 'after_delete')
+def _status_after_delete(mapper, connection, target):
+    _refresh_status(connection, target.email_key)
+    record_changes(connection, [target.email_key], removed={target.email_key: target.email})
+    count_rows(connection, removed=[_row(target)])
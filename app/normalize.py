@@ -0,0 +1,50 @@
+"""
+Canonical form of email addresses and the fixed-width key derived from it.
+"""
+import hashlib
+
+from flask import current_app, has_app_context
+
+EMAIL_KEY_SIZE = 16
+
+# providers that ignore dots in the local part and anything after a '+'
+_DOT_PLUS_PROVIDERS = {
+    'gmail.com': 'gmail.com',
+    'googlemail.com': 'gmail.com',
+}
+
+
+def normalize_email(email, provider_rules=False):
+    """Return the canonical form of ``email``: trimmed and lower-cased.
+
+    With ``provider_rules``, addresses at providers that ignore dots and
+    ``+tag`` suffixes (Gmail) are reduced to their delivery address.
+    """
+    email = email.strip().lower()
+    if provider_rules:
+        local, sep, domain = email.rpartition('@')
+        canonical_domain = _DOT_PLUS_PROVIDERS.get(domain)
+        if sep and canonical_domain:
+            local = local.split('+', 1)[0].replace('.', '')
+            email = f'{local}@{canonical_domain}'
+    return email
+
+
+def email_key(email, provider_rules=None):
+    """Return the 16-byte digest of the canonical form of ``email``.
+
+    ``provider_rules`` defaults to the app's ``EMAIL_PROVIDER_RULES`` setting.
+    """
+    if provider_rules is None:
+        provider_rules = has_app_context() and current_app.config.get('EMAIL_PROVIDER_RULES', False)
+    canonical = normalize_email(email, provider_rules)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=EMAIL_KEY_SIZE).digest()
+
+
+def dedup_key(email, app_uuid):
+    """Return the 16-byte digest identifying one email per app for upserts.
+
+    A missing ``app_uuid`` is kept apart from an empty one.
+    """
+    app = b'\1' if app_uuid is None else b'\0' + app_uuid.encode('utf-8')
+    return hashlib.blake2b(email_key(email) + app, digest_size=EMAIL_KEY_SIZE).digest()
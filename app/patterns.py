@@ -0,0 +1,172 @@
+"""
+Domain and subdomain patterns (``*@domain``, ``*@*.domain``) matched with a
+trie of reversed domain labels.
+
+A lookup walks one node per label of the email's domain, so its cost does not
+depend on how many patterns exist. The trie is built at startup and caught up
+with patterns written by other processes by reading ids past its watermark at
+most once every ``refresh_interval`` seconds, or right after this worker
+writes one. Ids do not commit in order on PostgreSQL, so a pattern can
+commit below the watermark; each refresh also counts the table, which is
+small, and rebuilds the trie when the count differs from the patterns read.
+"""
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .config import env_float
+from .models import BlacklistPattern
+
+logger = logging.getLogger(__name__)
+
+_PATTERN_RE = re.compile(r'^\*@(\*\.)?((?:[a-z0-9-]+\.)*[a-z0-9-]+)$')
+
+
+def parse_pattern(value):
+    """Return ``(domain, include_subdomains)`` for a pattern, or None if ``value`` is not one."""
+    match = _PATTERN_RE.match(value.strip().lower())
+    if match is None:
+        return None
+    return match.group(2), match.group(1) is not None
+
+
+def is_pattern(value):
+    """Return True if ``value`` looks like a pattern rather than an email address."""
+    return value.lstrip().startswith('*')
+
+
+class _Node:
+    __slots__ = ('children', 'exact', 'subdomains')
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None
+        self.subdomains = None
+
+
+class DomainTrie:
+    """Trie keyed by domain labels from the top-level domain down."""
+
+    def __init__(self):
+        self._root = _Node()
+        self.size = 0
+
+    def add(self, domain, include_subdomains, value):
+        node = self._root
+        for label in reversed(domain.split('.')):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = _Node()
+            node = child
+        if include_subdomains:
+            node.subdomains = value
+        else:
+            node.exact = value
+        self.size += 1
+
+    def match(self, domain):
+        """Return the value of the most specific pattern matching ``domain``, or None."""
+        labels = domain.split('.')
+        node = self._root
+        found = None
+        for remaining in range(len(labels) - 1, -1, -1):
+            node = node.children.get(labels[remaining])
+            if node is None:
+                return found
+            if remaining and node.subdomains is not None:
+                found = node.subdomains
+        return node.exact if node.exact is not None else found
+
+
+class PatternIndex:
+    """``DomainTrie`` over ``BlacklistPattern`` kept in sync with the table."""
+
+    def __init__(self, refresh_interval=5.0):
+        self.refresh_interval = refresh_interval
+        self.watermark = 0
+        self._applied = 0
+        self._trie = DomainTrie()
+        self._last_refresh = time.monotonic()
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        """Rebuild the trie from every pattern in the table."""
+        trie = DomainTrie()
+        watermark = 0
+        for row in self._rows(0):
+            trie.add(row.domain, row.include_subdomains, (True, row.blocked_reason))
+            watermark = row.id
+        with self._lock:
+            self._trie = trie
+            self.watermark = watermark
+            self._applied = trie.size
+            self._last_refresh = time.monotonic()
+
+    @staticmethod
+    def _rows(after):
+        return (
+            db.session.query(
+                BlacklistPattern.id, BlacklistPattern.domain,
+                BlacklistPattern.include_subdomains, BlacklistPattern.blocked_reason,
+            )
+            .filter(BlacklistPattern.id > after)
+            .order_by(BlacklistPattern.id)
+            .yield_per(10000)
+        )
+
+    def refresh(self):
+        """Add patterns inserted past the watermark, or rebuild if one was missed.
+
+        If the database cannot be read, the trie is kept as it is until the
+        next refresh.
+        """
+        self._last_refresh = time.monotonic()
+        try:
+            self._refresh()
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.warning('Refreshing domain patterns failed; keeping the current ones', exc_info=True)
+
+    def _refresh(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            # later patterns for the same domain replace earlier ones
+            for row in self._rows(self.watermark):
+                self._trie.add(row.domain, row.include_subdomains, (True, row.blocked_reason))
+                self.watermark = row.id
+                self._applied += 1
+            missed = db.session.query(func.count(BlacklistPattern.id)).scalar() != self._applied
+        finally:
+            self._lock.release()
+        if missed:
+            self.rebuild()
+
+    def expire(self):
+        """Read new patterns on the next lookup, e.g. after this worker wrote one."""
+        self._last_refresh = float('-inf')
+
+    def match(self, email):
+        """Return ``(True, reason)`` if a pattern blocks ``email``'s domain, else None."""
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+        if not self._trie.size:
+            return None
+        domain = email.rpartition('@')[2].strip().lower()
+        return self._trie.match(domain) if domain else None
+
+    def stats(self):
+        return {'patterns': self._trie.size, 'watermark': self.watermark}
+
+
+def init_app(app):
+    """Load the pattern trie for ``app``; must run inside an app context."""
+    app.config.setdefault('PATTERN_REFRESH_INTERVAL', env_float('PATTERN_REFRESH_INTERVAL', 5))
+    index = PatternIndex(refresh_interval=app.config['PATTERN_REFRESH_INTERVAL'])
+    index.rebuild()
+    app.extensions['blacklist_patterns'] = index
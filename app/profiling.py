@@ -0,0 +1,241 @@
+"""
+Opt-in request profiling with cProfile.
+
+With ``PROFILING_ENABLED``, a WSGI middleware profiles a random
+``PROFILING_SAMPLE_RATE`` share of requests, plus any request whose
+``X-Profile`` header matches ``PROFILING_TOKEN``. The profile covers
+routing, authentication, queries, serialization and the response body.
+Each one is written to ``PROFILING_DIR`` in two forms:
+
+- ``.prof``: a pstats dump, for ``snakeviz`` or ``python -m pstats``
+- ``.collapsed``: folded stacks, for ``flamegraph.pl`` or speedscope
+
+Only the newest ``PROFILING_MAX_FILES`` profiles are kept. At most one
+request per process is profiled at a time. Other requests, including
+privileged ones arriving meanwhile, run unprofiled.
+
+``GET /debug/profiles`` lists the files and ``GET /debug/profiles/<name>``
+downloads one; both need the API bearer token. When profiling is disabled,
+neither the middleware nor the routes are installed.
+"""
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app, send_from_directory
+
+from .config import env_bool, env_float, env_int
+
+PROFILE_SUFFIXES = ('.prof', '.collapsed')
+# folded stacks deeper than this are cut, and paths below this share of a
+# function's time are dropped, so recursion cannot blow up the output
+_MAX_DEPTH = 64
+_MIN_SHARE = 1e-4
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name  # builtins such as <method 'execute' of 'sqlite3.Cursor' objects>
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def collapsed_stacks(stats):
+    """Return ``{'root;caller;callee': microseconds}`` derived from a ``pstats.Stats``.
+
+    cProfile records caller/callee pairs rather than full stacks, so the
+    time of a function called from several places is split between its
+    callers in proportion to the time each of them spent in it.
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+    folded = defaultdict(float)
+
+    def walk(func, path, share, depth):
+        _, _, self_time, total_time, _ = stats.stats[func]
+        path = f'{path};{_label(func)}' if path else _label(func)
+        folded[path] += self_time * share
+        if depth >= _MAX_DEPTH:
+            return
+        for child, edge_time in callees[func].items():
+            child_total = stats.stats[child][3]
+            child_share = edge_time * share / child_total if child_total else 0
+            if child_share >= _MIN_SHARE and child != func:
+                walk(child, path, min(child_share, 1.0), depth + 1)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            walk(func, '', 1.0, 0)
+    return {path: round(seconds * 1e6) for path, seconds in folded.items() if seconds * 1e6 >= 1}
+
+
+def _slug(path):
+    # keep email addresses in lookup URLs out of file names
+    segments = ['email' if '@' in segment else segment for segment in path.strip('/').split('/')]
+    return re.sub(r'[^A-Za-z0-9]+', '_', '_'.join(segments))[:60].strip('_') or 'root'
+
+
+class ProfileStore:
+    """Directory holding the newest ``max_files`` profiles."""
+
+    def __init__(self, directory, max_files=100):
+        self.directory = directory
+        self.max_files = max_files
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, profiler, method, path, elapsed):
+        """Write ``profiler`` as ``.prof`` and ``.collapsed`` files; return their common name."""
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{os.getpid()}-{method}-{_slug(path)}-{elapsed * 1000:.0f}ms"
+        stats = pstats.Stats(profiler)
+        stats.dump_stats(os.path.join(self.directory, name + '.prof'))
+        with open(os.path.join(self.directory, name + '.collapsed'), 'w') as fh:
+            for stack, micros in sorted(collapsed_stacks(stats).items()):
+                fh.write(f'{stack} {micros}\n')
+        self.prune()
+        return name
+
+    def files(self):
+        """Return profile files, newest first, as dicts for the listing endpoint."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(PROFILE_SUFFIXES):
+                stat = entry.stat()
+                entries.append({
+                    'name': entry.name,
+                    'size': stat.st_size,
+                    'modified': datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+                })
+        return sorted(entries, key=lambda entry: entry['name'], reverse=True)
+
+    def prune(self):
+        """Delete the oldest profiles beyond ``max_files``."""
+        # names start with a UTC timestamp, so they sort by age
+        names = sorted({os.path.splitext(entry['name'])[0] for entry in self.files()}, reverse=True)
+        for name in names[self.max_files:]:
+            for suffix in PROFILE_SUFFIXES:
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+
+class _ProfiledBody:
+    """Response iterable that stops the profiler once the body is consumed or closed."""
+
+    def __init__(self, body, finish):
+        self._body = body
+        self._finish = finish
+
+    def __iter__(self):
+        yield from self._body
+        self._done()
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._done()
+
+    def _done(self):
+        finish, self._finish = self._finish, None
+        if finish is not None:
+            finish()
+
+
+class ProfilingMiddleware:
+    """WSGI middleware profiling sampled or explicitly requested requests."""
+
+    def __init__(self, wsgi_app, store, sample_rate=0.0, token=None):
+        self.wsgi_app = wsgi_app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.token = token
+        self.profiled = 0
+        self._lock = threading.Lock()
+
+    def _wanted(self, environ):
+        header = environ.get('HTTP_X_PROFILE')
+        # WSGI decodes headers as latin-1 and compare_digest only takes ASCII strings
+        if header and self.token and hmac.compare_digest(header.encode('latin-1'), self.token.encode()):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self._wanted(environ) or not self._lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+
+        def finish():
+            profiler.disable()
+            try:
+                self.store.save(
+                    profiler, environ.get('REQUEST_METHOD', ''), environ.get('PATH_INFO', ''),
+                    time.perf_counter() - started,
+                )
+                self.profiled += 1
+            finally:
+                self._lock.release()
+
+        try:
+            profiler.enable()
+        except (RuntimeError, ValueError):
+            # another profiler or debugger owns the hook
+            self._lock.release()
+            return self.wsgi_app(environ, start_response)
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except BaseException:
+            finish()
+            raise
+        return _ProfiledBody(body, finish)
+
+
+def list_profiles():
+    from .resources.blacklist import _auth_ok
+    if not _auth_ok():
+        return {'msg': 'Missing or invalid token'}, 401
+    return {'profiles': current_app.extensions['profiler'].store.files()}, 200
+
+
+def download_profile(name):
+    from .resources.blacklist import _auth_ok
+    if not _auth_ok():
+        return {'msg': 'Missing or invalid token'}, 401
+    if not name.endswith(PROFILE_SUFFIXES):
+        return {'msg': 'not a profile'}, 404
+    return send_from_directory(current_app.extensions['profiler'].store.directory, name, as_attachment=True)
+
+
+def init_app(app):
+    """Install the profiling middleware and endpoints if ``PROFILING_ENABLED`` is set."""
+    app.config.setdefault('PROFILING_ENABLED', env_bool('PROFILING_ENABLED', False))
+    app.config.setdefault('PROFILING_SAMPLE_RATE', env_float('PROFILING_SAMPLE_RATE', 0.01))
+    app.config.setdefault('PROFILING_TOKEN', os.environ.get('PROFILING_TOKEN'))
+    app.config.setdefault('PROFILING_DIR', os.environ.get(
+        'PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'blacklist-profiles'),
+    ))
+    app.config.setdefault('PROFILING_MAX_FILES', env_int('PROFILING_MAX_FILES', 100))
+    if not app.config['PROFILING_ENABLED']:
+        return
+    middleware = ProfilingMiddleware(
+        app.wsgi_app,
+        ProfileStore(app.config['PROFILING_DIR'], app.config['PROFILING_MAX_FILES']),
+        sample_rate=app.config['PROFILING_SAMPLE_RATE'],
+        token=app.config['PROFILING_TOKEN'],
+    )
+    app.wsgi_app = middleware
+    app.extensions['profiler'] = middleware
+    app.add_url_rule('/debug/profiles', 'profiles', list_profiles)
+    app.add_url_rule('/debug/profiles/<path:name>', 'profile', download_profile)
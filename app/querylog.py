@@ -0,0 +1,178 @@
+"""
+Statement timing for logs: a slow query log and per-request query counts.
+
+Statements that run longer than ``SLOW_QUERY_THRESHOLD_MS`` are logged at
+WARNING on the ``app.querylog`` logger. Their parameters are reduced to
+their types, because they hold email addresses. With
+``SLOW_QUERY_EXPLAIN``, slow SELECTs are also logged with the database's
+plan for them.
+
+Every request accumulates its statement count, statement time and pool
+checkout wait. These are logged at DEBUG when the request ends and are
+added to ``app.logger`` records as ``query_count``, ``query_ms`` and
+``pool_wait_ms``.
+
+``QueryCounter`` counts statements on an engine for tests and benchmarks.
+"""
+import logging
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from . import db
+from .config import env_bool, env_float
+
+logger = logging.getLogger(__name__)
+
+_EXPLAIN_PREFIXES = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}
+
+
+def redact(parameters):
+    """Return ``parameters`` with every value replaced by its type name."""
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None:
+        return None
+    if isinstance(parameters, (bytes, str)):
+        return f'<{type(parameters).__name__}:{len(parameters)}>'
+    return f'<{type(parameters).__name__}>'
+
+
+def _new_stats():
+    return {'count': 0, 'seconds': 0.0, 'pool_wait': 0.0}
+
+
+def _request_stats():
+    if not has_request_context():
+        return None
+    stats = g.get('query_stats')
+    if stats is None:
+        stats = g.query_stats = _new_stats()
+    return stats
+
+
+def _start_request_stats():
+    # g outlives the request when an app context is already pushed
+    g.query_stats = _new_stats()
+
+
+def record_pool_wait(seconds):
+    """Add a pool checkout wait to the current request's stats."""
+    stats = _request_stats()
+    if stats is not None:
+        stats['pool_wait'] += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('querylog_start', []).append(time.perf_counter())
+
+
+def _statement_timer(threshold_ms, explain):
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['querylog_start'].pop()
+        stats = _request_stats()
+        if stats is not None:
+            stats['count'] += 1
+            stats['seconds'] += elapsed
+        if elapsed * 1000 >= threshold_ms:
+            _log_slow_query(conn, statement, parameters, executemany, elapsed, explain)
+
+    return after_cursor_execute
+
+
+def _log_slow_query(conn, statement, parameters, executemany, elapsed, explain):
+    logged = f'{len(parameters)} parameter sets' if executemany else redact(parameters)
+    plan = None
+    if explain and not executemany and statement.lstrip()[:6].upper() == 'SELECT':
+        plan = _explain(conn, statement, parameters)
+    logger.warning(
+        'Slow query (%.1f ms): %s; parameters: %s%s',
+        elapsed * 1000, ' '.join(statement.split()), logged, f'\nplan:\n{plan}' if plan else '',
+    )
+
+
+def _handle_error(context):
+    starts = context.connection.info.get('querylog_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def _explain(conn, statement, parameters):
+    prefix = _EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if prefix is None:
+        return None
+    # a raw DBAPI cursor, so the EXPLAIN itself is not timed or logged
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except Exception as exc:  # the plan is best effort; the slow query was already run
+        return f'EXPLAIN failed: {exc}'
+    finally:
+        cursor.close()
+
+
+def instrument_engine(engine, threshold_ms, explain=False):
+    """Time statements on ``engine`` for the slow query log and request stats."""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _statement_timer(threshold_ms, explain))
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+class _RequestStatsFilter(logging.Filter):
+    def filter(self, record):
+        stats = _request_stats() or _new_stats()
+        record.query_count = stats['count']
+        record.query_ms = round(stats['seconds'] * 1000, 3)
+        record.pool_wait_ms = round(stats['pool_wait'] * 1000, 3)
+        return True
+
+
+def _log_request_stats(response):
+    stats = g.pop('query_stats', None)
+    if stats is not None and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            '%s %s %s: %d queries in %.1f ms, %.1f ms waiting for a connection',
+            request.method, request.path, response.status_code,
+            stats['count'], stats['seconds'] * 1000, stats['pool_wait'] * 1000,
+        )
+    return response
+
+
+class QueryCounter:
+    """Context manager recording the statements executed on ``engine`` while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+def init_app(app):
+    """Register statement timing on the engine of ``app``."""
+    app.config.setdefault('QUERY_LOG_ENABLED', env_bool('QUERY_LOG_ENABLED', True))
+    app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', env_float('SLOW_QUERY_THRESHOLD_MS', 200))
+    app.config.setdefault('SLOW_QUERY_EXPLAIN', env_bool('SLOW_QUERY_EXPLAIN', False))
+    if not app.config['QUERY_LOG_ENABLED']:
+        return
+    with app.app_context():
+        instrument_engine(db.engine, app.config['SLOW_QUERY_THRESHOLD_MS'], app.config['SLOW_QUERY_EXPLAIN'])
+    app.before_request(_start_request_stats)
+    app.after_request(_log_request_stats)
+    app.logger.addFilter(_RequestStatsFilter())
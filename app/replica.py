@@ -0,0 +1,161 @@
+"""
+Read/write routing between the primary database and a read replica.
+
+With ``DATABASE_READ_URL`` set, read-only endpoints call ``use_replica()``,
+which sends the request's queries to the replica unless:
+
+- the client wrote within the last ``READ_YOUR_WRITES_WINDOW`` seconds,
+  tracked by a cookie set on its write responses, so it sees its own writes;
+  its lookups also skip the lookup cache, which may hold replica answers
+- the replica is further behind than ``REPLICA_MAX_LAG`` seconds, or could
+  not be reached
+
+Lag is the age of the oldest ``blacklists`` row on the primary that the
+replica does not have yet. It is measured at most once every
+``REPLICA_LAG_CHECK_INTERVAL`` seconds per worker, so it works the same for
+PostgreSQL streaming replicas and for two SQLite files.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, g, request
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .config import env_float
+from .database import create_read_engine
+from .metrics import DB_READ_ROUTE, DB_REPLICA_LAG
+from .models import Blacklist
+
+logger = logging.getLogger(__name__)
+
+WRITE_COOKIE = 'blacklist_last_write'
+
+
+class ReplicaMonitor:
+    """Tracks how far the replica is behind the primary."""
+
+    def __init__(self, engine, primary_engine, max_lag=5.0, check_interval=1.0):
+        self.engine = engine
+        self.primary_engine = primary_engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # None until measured or while the replica is unreachable
+        self.lag = None
+        self._last_check = float('-inf')
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Measure the replica lag in seconds; None if it could not be measured."""
+        self._last_check = time.monotonic()
+        if not self._lock.acquire(blocking=False):
+            return self.lag
+        try:
+            table = Blacklist.__table__
+            with self.engine.connect() as conn:
+                applied = conn.execute(select(func.max(table.c.id))).scalar() or 0
+            with self.primary_engine.connect() as conn:
+                oldest = conn.execute(
+                    select(func.min(table.c.created_at)).where(table.c.id > applied)
+                ).scalar()
+            self.lag = 0.0 if oldest is None else max(0.0, (datetime.utcnow() - oldest).total_seconds())
+            DB_REPLICA_LAG.set(self.lag)
+        except SQLAlchemyError as exc:
+            if self.lag is not None:
+                logger.warning('Read replica is unavailable, reading from the primary: %s', exc)
+            self.lag = None
+        finally:
+            self._lock.release()
+        return self.lag
+
+    def available(self):
+        """Return True if the replica is reachable and within ``max_lag``."""
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.check()
+        lag = self.lag
+        return lag is not None and lag <= self.max_lag
+
+    def stats(self):
+        return {'lag': self.lag, 'max_lag': self.max_lag}
+
+
+def _wrote_recently():
+    value = request.cookies.get(WRITE_COOKIE)
+    if not value:
+        return False
+    try:
+        written_at = float(value)
+    except ValueError:
+        return False
+    return time.time() - written_at < current_app.config['READ_YOUR_WRITES_WINDOW']
+
+
+def use_replica():
+    """Route the current request's reads to the replica if it is safe; return True if routed."""
+    monitor = current_app.extensions.get('read_replica')
+    if monitor is None:
+        return False
+    if _wrote_recently():
+        DB_READ_ROUTE.labels('primary', 'recent_write').inc()
+        # lookups must not answer from results cached off the replica either
+        db.session.info['read_your_writes'] = True
+        return False
+    if not monitor.available():
+        DB_READ_ROUTE.labels('primary', 'replica_lag' if monitor.lag is not None else 'replica_down').inc()
+        return False
+    DB_READ_ROUTE.labels('replica', 'ok').inc()
+    db.session.info['read_replica'] = monitor.engine
+    return True
+
+
+def note_write():
+    """Send this client's reads to the primary for the read-your-writes window."""
+    g.replica_wrote = True
+
+
+def _set_write_cookie(response):
+    if g.pop('replica_wrote', False) and response.status_code < 500:
+        response.set_cookie(
+            WRITE_COOKIE, f'{time.time():.3f}',
+            max_age=max(1, int(current_app.config['READ_YOUR_WRITES_WINDOW'])), httponly=True,
+        )
+    return response
+
+
+def _stop_routing(exc):
+    db.session.info.pop('read_replica', None)
+    db.session.info.pop('read_your_writes', None)
+
+
+def init_app(app):
+    """Configure the read replica of ``app`` if ``DATABASE_READ_URL`` is set."""
+    app.config.setdefault('DATABASE_READ_URL', os.environ.get('DATABASE_READ_URL'))
+    app.config.setdefault('READ_YOUR_WRITES_WINDOW', env_float('READ_YOUR_WRITES_WINDOW', 5))
+    app.config.setdefault('REPLICA_MAX_LAG', env_float('REPLICA_MAX_LAG', 5))
+    app.config.setdefault('REPLICA_LAG_CHECK_INTERVAL', env_float('REPLICA_LAG_CHECK_INTERVAL', 1))
+    if not app.config['DATABASE_READ_URL']:
+        return
+    engine = create_read_engine(app.config['DATABASE_READ_URL'], app.config)
+    if app.config.get('METRICS_ENABLED'):
+        from .metrics import instrument_engine
+        instrument_engine(engine)
+    if app.config.get('QUERY_LOG_ENABLED'):
+        from . import querylog
+        querylog.instrument_engine(
+            engine, app.config['SLOW_QUERY_THRESHOLD_MS'], app.config['SLOW_QUERY_EXPLAIN'],
+        )
+    with app.app_context():
+        primary_engine = db.engine
+    app.extensions['read_replica'] = ReplicaMonitor(
+        engine,
+        primary_engine,
+        max_lag=app.config['REPLICA_MAX_LAG'],
+        check_interval=app.config['REPLICA_LAG_CHECK_INTERVAL'],
+    )
+    app.after_request(_set_write_cookie)
+    # the session outlives the request when an app context is already pushed
+    app.teardown_request(_stop_routing)
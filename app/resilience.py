@@ -0,0 +1,201 @@
+"""
+Keeping lookups answering while the database is slow or down.
+
+``CircuitBreaker`` counts consecutive failed or slow database lookups. After
+``LOOKUP_BREAKER_FAILURES`` of them it opens and lookups stop querying the
+database for ``LOOKUP_BREAKER_RESET_TIMEOUT`` seconds; then a single trial
+query decides whether it closes again. While it is open, lookups are
+answered from the cache, stale entries included, and otherwise according to
+``LOOKUP_FAIL_MODE``: ``open`` answers not blocked, ``closed`` answers
+blocked and ``error`` (the default) answers 503.
+
+``Revalidator`` refreshes stale cache entries in background threads, so the
+request that finds one is answered at once with the stale result.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .config import env_float, env_int
+from .metrics import LOOKUP_BREAKER_OPEN
+
+logger = logging.getLogger(__name__)
+
+FAIL_MODES = ('error', 'open', 'closed')
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling the database while the breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'circuit open, retry in {retry_after:.1f}s')
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency for a while after ``failures`` consecutive failures.
+
+    A call counts as failed if it raises one of ``errors`` or takes longer
+    than ``slow_call`` seconds; the result of a slow call is still returned.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failures=5, reset_timeout=10.0, slow_call=1.0, errors=(Exception,),
+                 clock=time.monotonic):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.slow_call = slow_call
+        self.errors = errors
+        self._clock = clock
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.rejected = 0
+
+    def _allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            elapsed = self._clock() - self._opened_at
+            if self.state == self.OPEN and elapsed >= self.reset_timeout:
+                # let one trial call through
+                self.state = self.HALF_OPEN
+                return
+            self.rejected += 1
+            raise CircuitOpen(max(0.0, self.reset_timeout - elapsed))
+
+    def _record(self, failed):
+        with self._lock:
+            if not failed:
+                if self.state != self.CLOSED:
+                    LOOKUP_BREAKER_OPEN.dec()
+                self.state = self.CLOSED
+                self._consecutive = 0
+                return
+            self._consecutive += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self._consecutive >= self.failures
+            ):
+                if self.state == self.CLOSED:
+                    LOOKUP_BREAKER_OPEN.inc()
+                    self.trips += 1
+                    logger.warning('Lookup circuit breaker opened after %d failed queries', self._consecutive)
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+
+    @property
+    def is_open(self):
+        """True while calls are rejected, i.e. open and not yet due for a trial."""
+        with self._lock:
+            return self.state != self.CLOSED and (
+                self.state == self.HALF_OPEN or self._clock() - self._opened_at < self.reset_timeout
+            )
+
+    def call(self, fn):
+        """Return ``fn()``, or raise ``CircuitOpen`` without calling it while the breaker is open."""
+        self._allow()
+        started = time.perf_counter()
+        try:
+            value = fn()
+        except self.errors:
+            self._record(True)
+            raise
+        except BaseException:
+            # not a failure of the dependency; do not leave a trial hanging
+            self._record(False)
+            raise
+        self._record(time.perf_counter() - started > self.slow_call)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self._consecutive,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
+
+
+class Revalidator:
+    """Runs refreshes of stale lookup results in background threads, one at a time per key."""
+
+    def __init__(self, app, threads=2, max_pending=1000):
+        self.app = app
+        self.threads = threads
+        self.max_pending = max_pending
+        self._pending = set()
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.refreshed = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def submit(self, key, refresh):
+        """Run ``refresh()`` in an app context unless ``key`` is already being refreshed; return True if queued."""
+        with self._lock:
+            if key in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            # threads do not survive a fork, so each worker starts its own
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='lookup-revalidate')
+                self._pid = os.getpid()
+            self._pending.add(key)
+        self._executor.submit(self._run, key, refresh)
+        return True
+
+    def _run(self, key, refresh):
+        try:
+            with self.app.app_context():
+                try:
+                    refresh()
+                    self.refreshed += 1
+                except Exception:
+                    self.failed += 1
+                    logger.warning('Refreshing a stale lookup result failed', exc_info=True)
+                finally:
+                    db.session.remove()
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'refreshed': self.refreshed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+            }
+
+
+def init_app(app):
+    """Attach the lookup circuit breaker and revalidator to ``app``."""
+    app.config.setdefault('LOOKUP_BREAKER_FAILURES', env_int('LOOKUP_BREAKER_FAILURES', 5))
+    app.config.setdefault('LOOKUP_BREAKER_RESET_TIMEOUT', env_float('LOOKUP_BREAKER_RESET_TIMEOUT', 10))
+    app.config.setdefault('LOOKUP_BREAKER_SLOW_CALL', env_float('LOOKUP_BREAKER_SLOW_CALL', 1))
+    app.config.setdefault('LOOKUP_FAIL_MODE', os.environ.get('LOOKUP_FAIL_MODE', 'error'))
+    app.config.setdefault('LOOKUP_REVALIDATE_THREADS', env_int('LOOKUP_REVALIDATE_THREADS', 2))
+    if app.config['LOOKUP_FAIL_MODE'] not in FAIL_MODES:
+        raise ValueError(f"LOOKUP_FAIL_MODE must be one of {', '.join(FAIL_MODES)}")
+    if app.config['LOOKUP_BREAKER_FAILURES'] > 0:
+        app.extensions['lookup_breaker'] = CircuitBreaker(
+            failures=app.config['LOOKUP_BREAKER_FAILURES'],
+            reset_timeout=app.config['LOOKUP_BREAKER_RESET_TIMEOUT'],
+            slow_call=app.config['LOOKUP_BREAKER_SLOW_CALL'],
+            errors=(SQLAlchemyError,),
+        )
+    if app.config['LOOKUP_REVALIDATE_THREADS'] > 0:
+        app.extensions['lookup_revalidator'] = Revalidator(app, threads=app.config['LOOKUP_REVALIDATE_THREADS'])
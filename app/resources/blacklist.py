@@ -1,10 +1,20 @@
-from flask import request, current_app
+import math
+from datetime import date, datetime
+
+from flask import Response, request, current_app, stream_with_context
 from flask_restful import Resource
 from .. import db
-from ..models import Blacklist
-from ..schemas import BlacklistSchema
-
-blacklist_schema = BlacklistSchema()
+from ..changes import latest_change_id, oldest_change_id, wait_for_changes
+from ..export import EXPORT_FORMATS, generate_export
+from ..idempotency import idempotent
+from ..ingest import insert_rows, parse_items, upsert_row, validate_row
+from ..listing import decode_cursor, list_page
+from ..lookup import LookupUnavailable, invalidate_keys, lookup_emails, resolve_email
+from ..models import Blacklist, BlacklistPattern
+from ..patterns import is_pattern, parse_pattern
+from ..replica import note_write, use_replica
+from ..stats import GROUP_BY_COLUMNS, block_counts
+from ..utils import parse_datetime
 
 
 def _auth_ok():
@@ -19,39 +29,276 @@ def _auth_ok():
     return token == expected
 
 
+def _client_ip():
+    """Return the originating client IP address of the request."""
+    # Capturar la IP del cliente
+    ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
+    if ip_address and ',' in ip_address:
+        # Si hay múltiples IPs (proxy chain), tomar la primera
+        ip_address = ip_address.split(',')[0].strip()
+    return ip_address
+
+
 class BlacklistResource(Resource):
+    def get(self):
+        if not _auth_ok():
+            return {'msg': 'Missing or invalid token'}, 401
+        max_limit = current_app.config['LIST_MAX_PAGE_SIZE']
+        try:
+            limit = int(request.args.get('limit', current_app.config['LIST_PAGE_SIZE']))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= max_limit:
+            return {'msg': f'limit must be between 1 and {max_limit}'}, 400
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError:
+                return {'msg': 'invalid cursor'}, 400
+        dates = {}
+        for name in ('since', 'until'):
+            if request.args.get(name):
+                try:
+                    dates[name] = parse_datetime(request.args[name])
+                except ValueError:
+                    return {'msg': f'{name} must be an ISO 8601 timestamp'}, 400
+
+        use_replica()
+        rows, next_cursor = list_page(
+            limit,
+            cursor=cursor or None,
+            app_uuid=request.args.get('app_uuid'),
+            blocked_reason=request.args.get('blocked_reason'),
+            **dates,
+        )
+        from ..schemas import BlacklistSchema
+        return {'items': BlacklistSchema(many=True).dump(rows), 'next_cursor': next_cursor}, 200
+
     def post(self):
         if not _auth_ok():
             return {'msg': 'Missing or invalid token'}, 401
+        note_write()
+        return idempotent(self._create)
+
+    def _create(self):
         data = request.get_json() or {}
-        email = data.get('email')
-        if not email:
-            return {'msg': 'email is required'}, 400
-        app_uuid = data.get('app_uuid')
-        blocked_reason = data.get('blocked_reason')
-        
-        # Capturar la IP del cliente
-        ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
-        if ip_address and ',' in ip_address:
-            # Si hay múltiples IPs (proxy chain), tomar la primera
-            ip_address = ip_address.split(',')[0].strip()
-        
+        row, error = validate_row(data, _client_ip(), patterns=True)
+        if error:
+            return {'msg': error}, 400
+
+        if is_pattern(row['email']):
+            if row['expires_at'] is not None:
+                return {'msg': 'expires_at is not supported for domain patterns'}, 400
+            return _add_pattern(row['email'], row['app_uuid'], row['blocked_reason'], row['ip_address'])
+
+        if data.get('upsert') is True:
+            upsert_row(row)
+            return {'msg': 'Email added to blacklist'}, 201
+
+        writer = current_app.extensions.get('write_behind')
+        if writer is not None:
+            if not writer.submit(row):
+                return {'msg': 'Write queue is full, retry later'}, 503, {'Retry-After': '1'}
+            return {'msg': 'Email accepted for blacklist'}, 202
+
         bl = Blacklist(
-            email=email, 
-            app_uuid=app_uuid, 
-            blocked_reason=blocked_reason,
-            ip_address=ip_address
+            email=row['email'],
+            app_uuid=row['app_uuid'],
+            blocked_reason=row['blocked_reason'],
+            ip_address=row['ip_address'],
+            expires_at=row['expires_at'],
         )
         db.session.add(bl)
         db.session.commit()
+        invalidate_keys([bl.email_key])
         return {'msg': 'Email added to blacklist'}, 201
 
 
+def _add_pattern(pattern, app_uuid, blocked_reason, ip_address):
+    """Store a ``*@domain`` or ``*@*.domain`` pattern submitted to POST /blacklists."""
+    parsed = parse_pattern(pattern)
+    if parsed is None:
+        return {'msg': 'pattern must look like *@domain or *@*.domain'}, 400
+    domain, include_subdomains = parsed
+    db.session.add(BlacklistPattern(
+        pattern=pattern.strip().lower(),
+        domain=domain,
+        include_subdomains=include_subdomains,
+        app_uuid=app_uuid,
+        blocked_reason=blocked_reason,
+        ip_address=ip_address,
+    ))
+    db.session.commit()
+    patterns = current_app.extensions.get('blacklist_patterns')
+    if patterns is not None:
+        patterns.expire()
+    return {'msg': 'Pattern added to blacklist'}, 201
+
+
+class BlacklistBulkResource(Resource):
+    def post(self):
+        if not _auth_ok():
+            return {'msg': 'Missing or invalid token'}, 401
+        note_write()
+        return idempotent(self._create)
+
+    def _create(self):
+        try:
+            items, errors = parse_items(request.get_data(as_text=True), request.content_type)
+        except ValueError:
+            return {'msg': 'body must be a JSON array or NDJSON'}, 400
+        max_rows = current_app.config['BULK_MAX_ROWS']
+        if len(items) > max_rows:
+            return {'msg': f'at most {max_rows} entries per request'}, 413
+
+        ip_address = _client_ip()
+        now = datetime.utcnow()
+        failed = {error['index'] for error in errors}
+        rows = []
+        for index, item in enumerate(items):
+            if index in failed:
+                continue
+            row, error = validate_row(item, ip_address, now)
+            if error:
+                errors.append({'index': index, 'msg': error})
+            else:
+                rows.append(row)
+        errors.sort(key=lambda error: error['index'])
+
+        if not rows:
+            return {'msg': 'no valid entries', 'inserted': 0, 'errors': errors}, 400
+        inserted = insert_rows(rows, current_app.config['BULK_INSERT_CHUNK_SIZE'])
+        return {'msg': 'Emails added to blacklist', 'inserted': inserted, 'errors': errors}, 201
+
+
+class BlacklistExportResource(Resource):
+    def get(self):
+        if not _auth_ok():
+            return {'msg': 'Missing or invalid token'}, 401
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return {'msg': f"format must be one of {', '.join(EXPORT_FORMATS)}"}, 400
+        since = request.args.get('since')
+        if since:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                return {'msg': 'since must be an ISO 8601 timestamp'}, 400
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+        use_replica()
+        # changes after this id may or may not be in the export; reading the
+        # feed from here on applies each of them at least once
+        changes_cursor = latest_change_id()
+        body = generate_export(fmt, since or None, current_app.config['EXPORT_CHUNK_SIZE'], compress)
+        response = Response(stream_with_context(body), mimetype=EXPORT_FORMATS[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename=blacklist.{fmt}'
+        response.headers['X-Changes-Cursor'] = str(changes_cursor)
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+
+class BlacklistStatsResource(Resource):
+    def get(self):
+        if not _auth_ok():
+            return {'msg': 'Missing or invalid token'}, 401
+        group_by = request.args.get('group_by', ','.join(GROUP_BY_COLUMNS))
+        group_by = [name.strip() for name in group_by.split(',') if name.strip()]
+        if any(name not in GROUP_BY_COLUMNS for name in group_by) or len(set(group_by)) != len(group_by):
+            return {'msg': f"group_by must be a list of {', '.join(GROUP_BY_COLUMNS)}"}, 400
+        dates = {}
+        for name in ('since', 'until'):
+            if request.args.get(name):
+                try:
+                    dates[name] = date.fromisoformat(request.args[name])
+                except ValueError:
+                    return {'msg': f'{name} must be an ISO 8601 date'}, 400
+
+        use_replica()
+        groups, total = block_counts(
+            group_by,
+            app_uuid=request.args.get('app_uuid'),
+            blocked_reason=request.args.get('blocked_reason'),
+            **dates,
+        )
+        return {'groups': groups, 'total': total}, 200
+
+
+class BlacklistChangesResource(Resource):
+    def get(self):
+        if not _auth_ok():
+            return {'msg': 'Missing or invalid token'}, 401
+        config = current_app.config
+        try:
+            cursor = int(request.args.get('cursor', 0))
+        except ValueError:
+            cursor = -1
+        if cursor < 0:
+            return {'msg': 'invalid cursor'}, 400
+        max_limit = config['CHANGES_MAX_PAGE_SIZE']
+        try:
+            limit = int(request.args.get('limit', config['CHANGES_PAGE_SIZE']))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= max_limit:
+            return {'msg': f'limit must be between 1 and {max_limit}'}, 400
+        max_wait = config['CHANGES_MAX_WAIT']
+        try:
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            wait = -1
+        if not 0 <= wait <= max_wait:
+            return {'msg': f'wait must be between 0 and {max_wait} seconds'}, 400
+
+        # read from the primary: a replica could skip past changes it has not applied yet
+        oldest = oldest_change_id()
+        if oldest is not None and cursor < oldest - 1:
+            return {'msg': 'cursor is older than the retained changes; re-sync from /blacklists/export'}, 410
+        changes, has_more = wait_for_changes(
+            cursor, limit, wait, config['CHANGES_POLL_INTERVAL'], current_app.extensions.get('change_notifier'),
+        )
+        next_cursor = changes[-1]['id'] if changes else cursor
+        return {'changes': changes, 'next_cursor': next_cursor, 'has_more': has_more}, 200
+
+
 class BlacklistLookupResource(Resource):
     def get(self, email):
         if not _auth_ok():
             return {'msg': 'Missing or invalid token'}, 401
-        bl = Blacklist.query.filter_by(email=email).order_by(Blacklist.created_at.desc()).first()
-        if not bl:
-            return {'blocked': False, 'reason': None}, 200
-        return {'blocked': True, 'reason': bl.blocked_reason}, 200
+        use_replica()
+        try:
+            outcome = resolve_email(email)
+        except LookupUnavailable as exc:
+            return {'msg': 'Lookup unavailable, retry later'}, 503, {'Retry-After': str(math.ceil(exc.retry_after))}
+        blocked, reason = outcome.result
+        headers = {}
+        if outcome.cache is not None:
+            headers['X-Cache'] = outcome.cache
+        if outcome.age is not None:
+            headers['Age'] = str(int(outcome.age))
+        if outcome.warning is not None:
+            headers['Warning'] = outcome.warning
+        return {'blocked': blocked, 'reason': reason}, 200, headers
+
+
+class BlacklistBatchLookupResource(Resource):
+    def post(self):
+        if not _auth_ok():
+            return {'msg': 'Missing or invalid token'}, 401
+        data = request.get_json(silent=True)
+        emails = data.get('emails') if isinstance(data, dict) else None
+        if not isinstance(emails, list) or not all(isinstance(email, str) and email for email in emails):
+            return {'msg': 'emails must be a list of email strings'}, 400
+        max_emails = current_app.config['LOOKUP_BATCH_MAX_EMAILS']
+        if len(emails) > max_emails:
+            return {'msg': f'at most {max_emails} emails per request'}, 413
+        use_replica()
+        results = lookup_emails(emails)
+        return {
+            'results': {
+                email: {'blocked': blocked, 'reason': reason}
+                for email, (blocked, reason) in results.items()
+            }
+        }, 200
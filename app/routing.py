@@ -0,0 +1,26 @@
+"""
+Session that can send a request's reads to a read replica.
+
+Kept free of app imports because ``app/__init__.py`` builds ``db`` from it;
+the routing decision itself lives in ``app.replica``.
+"""
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+
+
+class RoutingSession(SignallingSession):
+    """Session whose queries go to ``info['read_replica']`` when it is set.
+
+    Flushes and INSERT/UPDATE/DELETE statements always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('read_replica')
+        if replica is not None and not self._flushing and not getattr(clause, 'is_dml', False):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
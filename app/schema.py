@@ -0,0 +1,213 @@
+"""
+Schema initialization and migrations for databases created by earlier versions of the app.
+
+The schema is created or upgraded once per deploy by ``flask init-db``, which
+records ``SCHEMA_VERSION`` in the ``schema_version`` table. Workers only read
+that version at startup.
+"""
+from sqlalchemy import bindparam, func, inspect, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .models import (
+    Blacklist, BlacklistStatus, SchemaVersion, rebuild_stats, rebuild_status, stats_need_backfill,
+    status_needs_backfill,
+)
+from .normalize import dedup_key, email_key
+
+# bump when the schema changes or init_db gains a step that older databases need
+# 2: blacklist_patterns
+# 3: composite indexes for GET /blacklists
+# 4: blacklists.dedup_key, idempotency_keys
+# 5: blacklist_daily_stats
+# 6: expires_at on blacklists and blacklist_status, blacklists_archive
+# 7: blacklist_changes
+# 8: dedup_key keeps a missing app_uuid apart from an empty one
+SCHEMA_VERSION = 8
+
+
+def current_schema_version():
+    """Return the schema version recorded in the database, or None if there is none."""
+    try:
+        return db.session.query(func.max(SchemaVersion.version)).scalar()
+    except SQLAlchemyError:
+        # schema_version does not exist yet
+        db.session.rollback()
+        return None
+
+
+def init_db():
+    """Create missing tables and bring the schema up to ``SCHEMA_VERSION``.
+
+    Every step is idempotent, so this is safe on new, unversioned and
+    current databases alike. Returns the version found before running.
+    """
+    previous = current_schema_version()
+    db.create_all()
+    # create_all skips columns added to tables that already exist; the
+    # migrations below read them
+    add_missing_columns()
+    # add email_key to tables created before it existed
+    if email_key_migration_needed():
+        migrate_email_key()
+    elif previous is not None and previous < 8:
+        # recomputes the dedup keys of upserts without an app_uuid
+        migrate_email_key()
+    # likewise for indexes
+    create_missing_indexes()
+    # populate blacklist_status the first time it is deployed
+    if status_needs_backfill():
+        rebuild_status()
+    # and blacklist_daily_stats
+    if stats_need_backfill():
+        rebuild_stats()
+    if previous is None or previous < SCHEMA_VERSION:
+        db.session.add(SchemaVersion(version=SCHEMA_VERSION))
+        db.session.commit()
+    return previous
+
+
+def check_schema(app):
+    """Return True once the database schema is current for ``app``.
+
+    Costs a single query when the schema is current. Otherwise the schema is
+    initialized if ``DB_AUTO_INIT`` is set; if it is not, False is returned
+    so the app still starts (``flask init-db`` needs it) but reports itself
+    unhealthy. A newer schema is accepted so old workers keep running during
+    a deploy.
+    """
+    version = current_schema_version()
+    if version is not None and version >= SCHEMA_VERSION:
+        return True
+    if not app.config['DB_AUTO_INIT']:
+        app.logger.error(
+            'Database schema is at version %s, expected %s; run `flask init-db`', version, SCHEMA_VERSION
+        )
+        return False
+    init_db()
+    return True
+
+
+def add_missing_columns():
+    """Add nullable columns declared on the models that existing tables lack."""
+    engine = db.engine
+    inspector = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def create_missing_indexes():
+    """Create indexes declared on the models that the database does not have yet."""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+
+
+def email_key_migration_needed():
+    columns = {column['name'] for column in inspect(db.engine).get_columns('blacklists')}
+    return 'email_key' not in columns
+
+
+def migrate_email_key(batch_size=10000):
+    """Add and backfill ``blacklists.email_key`` and re-key ``blacklist_status``.
+
+    Safe to run more than once: each step is skipped once it is done. Also
+    used after changing ``EMAIL_PROVIDER_RULES`` to recompute every key,
+    ``dedup_key`` of upserted rows included. Returns the number of history
+    rows whose key was (re)computed.
+    """
+    engine = db.engine
+    table = Blacklist.__table__
+    if email_key_migration_needed():
+        column_type = table.c.email_key.type.compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN email_key {column_type}'))
+
+    update = (
+        table.update()
+        .where(table.c.id == bindparam('row_id'))
+        .values(email_key=bindparam('new_key'))
+    )
+    last_id = 0
+    updated = 0
+    rekeyed_upserts = []
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.email, table.c.app_uuid, table.c.email_key, table.c.dedup_key)
+            .where(table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        changed = [
+            {'row_id': row.id, 'new_key': email_key(row.email)}
+            for row in rows
+            if row.email_key != email_key(row.email)
+        ]
+        if changed:
+            db.session.execute(update, changed)
+            db.session.commit()
+            updated += len(changed)
+        for row in rows:
+            if row.dedup_key is not None:
+                key = dedup_key(row.email, row.app_uuid)
+                if key != row.dedup_key:
+                    rekeyed_upserts.append((row.id, key))
+        last_id = rows[-1].id
+    if rekeyed_upserts:
+        _rekey_upserts(rekeyed_upserts)
+
+    indexes = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+    email_key_index = next(index for index in table.indexes if index.columns.keys() == ['email_key'])
+    if email_key_index.name not in indexes:
+        email_key_index.create(engine)
+    # the wide index on the raw email column is replaced by the key index
+    if 'ix_blacklists_email' in indexes:
+        with engine.begin() as conn:
+            conn.execute(text('DROP INDEX ix_blacklists_email'))
+
+    status = BlacklistStatus.__table__
+    status_columns = {column['name'] for column in inspect(engine).get_columns(status.name)}
+    rekeyed = 'email_key' not in status_columns
+    if rekeyed:
+        status.drop(engine)
+        status.create(engine)
+    if updated or rekeyed:
+        rebuild_status()
+    return updated
+
+
+def _rekey_upserts(rows):
+    """Set the new ``dedup_key`` of each ``(id, key)`` in ``rows``, oldest first.
+
+    Rules can map several upserted rows to one key. The newest of them
+    keeps it and the others become plain history rows.
+    """
+    table = Blacklist.__table__
+    ids = [row_id for row_id, _ in rows]
+    # the old keys are released first, so a row can take a key another one is leaving
+    for start in range(0, len(ids), 500):
+        db.session.execute(
+            table.update().where(table.c.id.in_(ids[start:start + 500])).values(dedup_key=None)
+        )
+    for row_id, key in rows:
+        newer = db.session.execute(
+            select(table.c.id).where(table.c.dedup_key == key, table.c.id > row_id).limit(1)
+        ).first()
+        if newer is not None:
+            continue
+        db.session.execute(
+            table.update().where(table.c.dedup_key == key, table.c.id < row_id).values(dedup_key=None)
+        )
+        db.session.execute(table.update().where(table.c.id == row_id).values(dedup_key=key))
+    db.session.commit()
@@ -1,4 +1,3 @@
-from . import ma
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
 from .models import Blacklist
 
@@ -7,5 +6,6 @@ class BlacklistSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = Blacklist
         load_instance = True
+        exclude = ('email_key', 'dedup_key')
 
 
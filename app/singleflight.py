@@ -0,0 +1,110 @@
+"""
+Coalescing of concurrent identical calls within a process.
+
+When many threads of a worker miss the lookup cache for the same email at
+once, e.g. during an abuse wave, only the first runs the database query;
+the others wait for its result instead of sending the same query. A failure
+of the query is raised in every waiting thread.
+"""
+import threading
+
+from .config import env_bool, env_float
+
+
+class FlightTimeout(TimeoutError):
+    """Raised in a thread that waited longer than the timeout for a shared call."""
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its outcome with concurrent callers."""
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def do(self, key, fn):
+        """Return ``(fn(), shared)``, running ``fn`` only if no call for ``key`` is in flight.
+
+        ``shared`` is True if the value came from another thread's call. Waits
+        at most ``timeout`` seconds for that call, then raises ``FlightTimeout``.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise FlightTimeout(f'shared call for {key!r} did not finish within {self.timeout}s')
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as exc:
+            call.error = exc
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                # a later forget() may already have replaced the call
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    def forget(self, key):
+        """Make the next caller for ``key`` start a new call, e.g. after the data behind it changed.
+
+        Threads already waiting still get the outcome of the running call.
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def __len__(self):
+        return len(self._calls)
+
+    def stats(self):
+        """Return a snapshot of the counters."""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+            }
+
+
+def init_app(app):
+    """Coalesce concurrent database lookups of ``app`` unless ``LOOKUP_SINGLEFLIGHT`` is off."""
+    app.config.setdefault('LOOKUP_SINGLEFLIGHT', env_bool('LOOKUP_SINGLEFLIGHT', True))
+    app.config.setdefault('LOOKUP_SINGLEFLIGHT_TIMEOUT', env_float('LOOKUP_SINGLEFLIGHT_TIMEOUT', 5))
+    if not app.config['LOOKUP_SINGLEFLIGHT']:
+        return
+    app.extensions['lookup_singleflight'] = SingleFlight(timeout=app.config['LOOKUP_SINGLEFLIGHT_TIMEOUT'])
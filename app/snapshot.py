@@ -0,0 +1,276 @@
+"""
+Memory-mapped snapshot of the blocked set, shared by every worker on a host.
+
+``flask write-snapshot --interval N`` periodically writes the current status table to
+``SNAPSHOT_PATH`` as a sorted array of email keys with a reason index per key.
+Workers map the file read-only, so the page cache holds one copy for all of
+them, and answer lookups with a binary search. Changes committed after the
+snapshot (``blacklist_changes`` ids past its watermark) are kept in a small
+per-worker delta that is read from the database at most once every
+``refresh_interval`` seconds, or right after this worker writes. Change ids
+commit in order, unlike ``Blacklist.id``, so the delta cannot skip a row
+that committed after one with a higher id.
+
+File layout (little-endian)::
+
+    header
+    keys        count * EMAIL_KEY_SIZE bytes, sorted
+    reason_ids  count * uint32, NO_REASON for a null reason
+    expires     count * float64, UTC epoch seconds, NEVER for no expiry
+    offsets     (reason_count + 1) * uint64 into the reasons blob
+    reasons     distinct reasons, UTF-8, concatenated
+
+Entries past their expiry are answered as ``MISSING``, so the lookup falls
+through to the database, which knows whether an older entry still applies.
+"""
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import timezone
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .cache import MISSING
+from .changes import changes_after, latest_change_id
+from .config import env_float
+from .models import BlacklistChange, BlacklistStatus
+from .normalize import EMAIL_KEY_SIZE
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('<4sHHQQQd')
+_EXPIRY = struct.Struct('<d')
+_MAGIC = b'BLSN'
+_VERSION = 3
+NO_REASON = 0xFFFFFFFF
+NEVER = 0.0
+
+
+def _epoch(expires_at):
+    return NEVER if expires_at is None else expires_at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _le_bytes(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_snapshot(path):
+    """Atomically write the current blocked set to ``path``; return the number of emails."""
+    # read first, so changes committed while reading are applied again by the delta
+    watermark = latest_change_id()
+    reason_ids = {}
+    entries = []
+    statuses = db.session.query(
+        BlacklistStatus.email_key, BlacklistStatus.blocked_reason, BlacklistStatus.expires_at,
+    ).yield_per(10000)
+    for key, reason, expires_at in statuses:
+        reason_id = NO_REASON if reason is None else reason_ids.setdefault(reason, len(reason_ids))
+        entries.append((key, reason_id, _epoch(expires_at)))
+    db.session.commit()
+    entries.sort()
+
+    offsets = array('Q', [0])
+    blob = []
+    for reason in reason_ids:
+        encoded = reason.encode('utf-8')
+        blob.append(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        fh.write(_HEADER.pack(
+            _MAGIC, _VERSION, EMAIL_KEY_SIZE, len(entries), len(reason_ids), watermark, time.time(),
+        ))
+        fh.write(b''.join(key for key, _, _ in entries))
+        fh.write(_le_bytes(array('I', (reason_id for _, reason_id, _ in entries))))
+        fh.write(_le_bytes(array('d', (expires for _, _, expires in entries))))
+        fh.write(_le_bytes(offsets))
+        fh.write(b''.join(blob))
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+class BlacklistSnapshot:
+    """Read side of the snapshot file plus the delta of newer changes."""
+
+    def __init__(self, path, refresh_interval=5.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.count = 0
+        self.watermark = 0
+        self.built_at = None
+        # (mapping, count, reason_ids, expires_start, reasons), swapped as one on reload
+        self._state = None
+        self._mtime = None
+        self._delta = {}
+        self._delta_watermark = 0
+        self._last_refresh = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._state is not None
+
+    def load(self):
+        """Map the snapshot at ``path``; return True if a valid snapshot was loaded."""
+        try:
+            with open(self.path, 'rb') as fh:
+                mtime = os.fstat(fh.fileno()).st_mtime
+                mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        try:
+            magic, version, key_size, count, reason_count, watermark, built_at = \
+                _HEADER.unpack_from(mapped)
+        except struct.error:
+            mapped.close()
+            return False
+        if magic != _MAGIC or version != _VERSION or key_size != EMAIL_KEY_SIZE:
+            mapped.close()
+            return False
+
+        keys_end = _HEADER.size + count * EMAIL_KEY_SIZE
+        ids_end = keys_end + count * 4
+        expires_end = ids_end + count * _EXPIRY.size
+        offsets_end = expires_end + (reason_count + 1) * 8
+        reason_ids = array('I', mapped[keys_end:ids_end])
+        offsets = array('Q', mapped[expires_end:offsets_end])
+        if sys.byteorder != 'little':
+            reason_ids.byteswap()
+            offsets.byteswap()
+        reasons = [
+            mapped[offsets_end + offsets[i]:offsets_end + offsets[i + 1]].decode('utf-8')
+            for i in range(reason_count)
+        ]
+        with self._lock:
+            # the previous mapping is released once no lookup references it
+            self._state = (mapped, count, reason_ids, ids_end, reasons)
+            self._mtime = mtime
+            self.count = count
+            self.watermark = watermark
+            self.built_at = built_at
+            # rows up to the watermark are now in the snapshot itself
+            self._delta = {key: entry for key, entry in self._delta.items() if entry[0] > watermark}
+            self._delta_watermark = max(self._delta_watermark, watermark)
+        return True
+
+    @staticmethod
+    def _search(mapped, count, key):
+        """Return the index of ``key`` in the sorted key array, or -1."""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = _HEADER.size + mid * EMAIL_KEY_SIZE
+            probe = mapped[start:start + EMAIL_KEY_SIZE]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def lookup(self, key):
+        """Return ``(blocked, reason)`` for ``key``, or ``MISSING`` without a snapshot or past its expiry."""
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+        state = self._state
+        if state is None:
+            return MISSING
+        entry = self._delta.get(key)
+        if entry is not None:
+            _, blocked, reason, expires = entry
+            if not blocked:
+                return False, None
+            if expires != NEVER and expires <= time.time():
+                return MISSING
+            return True, reason
+        mapped, count, reason_ids, expires_start, reasons = state
+        index = self._search(mapped, count, key)
+        if index < 0:
+            return False, None
+        # read in place rather than copied, since most entries never expire
+        expires = _EXPIRY.unpack_from(mapped, expires_start + index * _EXPIRY.size)[0]
+        if expires != NEVER and expires <= time.time():
+            return MISSING
+        reason_id = reason_ids[index]
+        return True, None if reason_id == NO_REASON else reasons[reason_id]
+
+    def refresh(self):
+        """Map a newer snapshot file and read changes past the watermark.
+
+        If the database cannot be read, the snapshot and delta are kept as
+        they are until the next refresh.
+        """
+        self._last_refresh = time.monotonic()
+        try:
+            self._refresh()
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.warning('Refreshing the blacklist snapshot delta failed; keeping the current one', exc_info=True)
+
+    def _refresh(self):
+        try:
+            changed = os.stat(self.path).st_mtime != self._mtime
+        except OSError:
+            changed = False
+        if changed:
+            self.load()
+        if self._state is None or not self._lock.acquire(blocking=False):
+            return
+        try:
+            changes = changes_after(
+                self._delta_watermark, BlacklistChange.email_key, BlacklistChange.blocked,
+                BlacklistChange.blocked_reason, BlacklistChange.expires_at,
+            )
+            if changes is None:
+                # lookups use the database until a newer snapshot is written
+                logger.warning('Changes since the blacklist snapshot were purged; ignoring %s', self.path)
+                self._state = None
+                self._delta = {}
+                return
+            for change_id, key, blocked, reason, expires_at in changes:
+                self._delta[key] = (change_id, blocked, reason, _epoch(expires_at))
+                self._delta_watermark = change_id
+        finally:
+            self._lock.release()
+
+    def expire(self):
+        """Read the delta on the next lookup, e.g. after this worker wrote rows."""
+        self._last_refresh = float('-inf')
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'count': self.count,
+            'watermark': self.watermark,
+            'built_at': self.built_at,
+            'delta': len(self._delta),
+            'delta_watermark': self._delta_watermark,
+        }
+
+
+def init_app(app):
+    """Map the snapshot for ``app`` if ``SNAPSHOT_PATH`` is set; must run inside an app context."""
+    app.config.setdefault('SNAPSHOT_PATH', os.environ.get('SNAPSHOT_PATH'))
+    app.config.setdefault('SNAPSHOT_REFRESH_INTERVAL', env_float('SNAPSHOT_REFRESH_INTERVAL', 5))
+    if not app.config['SNAPSHOT_PATH']:
+        return
+    snapshot = BlacklistSnapshot(
+        app.config['SNAPSHOT_PATH'],
+        refresh_interval=app.config['SNAPSHOT_REFRESH_INTERVAL'],
+    )
+    if snapshot.load():
+        snapshot.refresh()
+    else:
+        # lookups use the database until the snapshot job has written the file
+        app.logger.warning('No blacklist snapshot at %s yet', snapshot.path)
+    app.extensions['blacklist_snapshot'] = snapshot
@@ -0,0 +1,42 @@
+"""
+Block counts for GET /blacklists/stats, read from ``blacklist_daily_stats``.
+
+The rollup has one row per creation day, ``app_uuid`` and
+``blocked_reason``, so a query costs O(groups) whatever the size of the
+history. Coarser groupings are sums over those rows.
+"""
+from sqlalchemy import func, select
+
+from . import db
+from .models import BlacklistDailyStats
+
+GROUP_BY_COLUMNS = ('day', 'app_uuid', 'blocked_reason')
+
+
+def block_counts(group_by=GROUP_BY_COLUMNS, app_uuid=None, blocked_reason=None, since=None, until=None):
+    """Return ``(groups, total)``: entry counts per ``group_by`` columns and their sum.
+
+    ``since`` is inclusive and ``until`` exclusive, both dates. Groups whose
+    entries were all deleted are left out.
+    """
+    table = BlacklistDailyStats.__table__
+    columns = [table.c[name] for name in group_by]
+    count = func.sum(table.c.count).label('count')
+    query = select(*columns, count)
+    if app_uuid is not None:
+        query = query.where(table.c.app_uuid == app_uuid)
+    if blocked_reason is not None:
+        query = query.where(table.c.blocked_reason == blocked_reason)
+    if since is not None:
+        query = query.where(table.c.day >= since)
+    if until is not None:
+        query = query.where(table.c.day < until)
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+    groups = []
+    for row in db.session.execute(query.having(count > 0)):
+        group = dict(row._mapping)
+        if 'day' in group:
+            group['day'] = group['day'].isoformat()
+        groups.append(group)
+    return groups, sum(group['count'] for group in groups)
@@ -0,0 +1,18 @@
+"""
+Small helpers shared by the API resources.
+"""
+from datetime import datetime, timezone
+
+
+def parse_datetime(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime.
+
+    Timestamps are stored as naive UTC, so aware values are converted and
+    naive ones are taken as UTC. Raises ValueError on malformed input.
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
@@ -0,0 +1,283 @@
+"""
+Write-behind mode for POST /blacklists: accepted entries are spooled to disk,
+queued in memory and inserted in batches by a background thread.
+"""
+import atexit
+import contextlib
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from . import db
+from .config import env_bool, env_float, env_int
+from .ingest import insert_rows
+from .normalize import email_key
+
+logger = logging.getLogger(__name__)
+
+_DATETIME_FIELDS = ('request_date', 'created_at', 'expires_at')
+
+
+def _dump_row(row):
+    # email_key is derived from email and recomputed on load
+    return json.dumps({
+        key: value.isoformat() if key in _DATETIME_FIELDS and value else value
+        for key, value in row.items()
+        if key != 'email_key'
+    })
+
+
+def _load_row(line):
+    row = json.loads(line)
+    for key in _DATETIME_FIELDS:
+        if row.get(key):
+            row[key] = datetime.fromisoformat(row[key])
+    row['email_key'] = email_key(row['email'])
+    return row
+
+
+def _offset_path(path):
+    return f'{path}.offset'
+
+
+def _read_offset(path):
+    try:
+        with open(_offset_path(path), encoding='utf-8') as fh:
+            return int(fh.read() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+class _Segment:
+    __slots__ = ('path', 'file', 'rows', 'pending')
+
+    def __init__(self, path, file):
+        self.path = path
+        self.file = file
+        self.rows = 0
+        self.pending = 0
+
+
+class WriteBehindWriter:
+    """Bounded in-process queue of blacklist rows flushed by a writer thread.
+
+    Every accepted row is first appended to a per-process spool segment. A
+    new segment is started every ``batch_size`` rows. After each committed
+    batch, the offset up to which a segment's rows are committed is
+    recorded next to it, and a segment is deleted once all its rows are committed.
+    Segments left behind by crashed processes are replayed from their
+    recorded offset by the next writer that starts, so accepted entries are
+    inserted at least once and committed batches are not inserted again.
+    """
+
+    def __init__(self, app, max_queue=10000, batch_size=500, flush_interval=0.5,
+                 spool_dir=None, fsync=True):
+        self.app = app
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_dir = spool_dir
+        self.fsync = fsync
+        self.flushed = 0
+        self.failed_flushes = 0
+        self._queue = queue.Queue()
+        self._unflushed = 0
+        # spool segments of this process that still have uncommitted rows, by path
+        self._segments = {}
+        self._spool = None
+        self._spool_path = None
+        self._spool_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, row):
+        """Accept ``row`` for writing; return False if the queue is full."""
+        self._ensure_started()
+        with self._spool_lock:
+            if self._unflushed >= self.max_queue:
+                return False
+            segment = self._spool
+            segment.file.write(_dump_row(row) + '\n')
+            segment.file.flush()
+            if self.fsync:
+                os.fsync(segment.file.fileno())
+            segment.rows += 1
+            segment.pending += 1
+            self._unflushed += 1
+            # queued in spool order, so committed offsets only grow
+            self._queue.put((row, segment, segment.file.tell()))
+            if segment.rows >= self.batch_size:
+                self._open_spool()
+        return True
+
+    def pending(self):
+        return self._unflushed
+
+    def _ensure_started(self):
+        # the thread and spool file belong to the process that created them
+        if self._pid == os.getpid():
+            return
+        with self._spool_lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._queue = queue.Queue()
+            self._unflushed = 0
+            self._segments = {}
+            self._stopping.clear()
+            self._open_spool()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _open_spool(self):
+        import fcntl
+        path = os.path.join(self.spool_dir, f'spool-{os.getpid()}-{time.time_ns()}.ndjson')
+        spool = open(f'{path}.new', 'a', encoding='utf-8')
+        # held until the segment is deleted; an unlocked spool file is an orphan.
+        # Locking before the rename keeps other writers from claiming it.
+        fcntl.flock(spool.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(f'{path}.new', path)
+        self._spool = self._segments[path] = _Segment(path, spool)
+        self._spool_path = path
+
+    def _commit_offset(self, segment, offset):
+        # the caller holds the spool lock
+        if segment.pending == 0 and segment is not self._spool:
+            self._remove_segment(segment)
+            return
+        path = _offset_path(segment.path)
+        with open(f'{path}.new', 'w', encoding='utf-8') as fh:
+            fh.write(str(offset))
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+        os.replace(f'{path}.new', path)
+
+    def _remove_segment(self, segment):
+        # the spool file goes first: without it a leftover offset file is ignored
+        os.remove(segment.path)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(_offset_path(segment.path))
+        segment.file.close()
+        del self._segments[segment.path]
+
+    def _run(self):
+        self._replay_orphans()
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch and not self._flush(batch):
+                break
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:  # woken up by stop()
+                break
+            batch.append(item)
+        return batch
+
+    def _flush(self, batch):
+        """Insert ``batch``, retrying with backoff; return False if stopped first.
+
+        Rows that could not be written stay in the spool file and are
+        replayed by the next writer.
+        """
+        delay = self.flush_interval
+        rows = [row for row, _, _ in batch]
+        while True:
+            try:
+                with self.app.app_context():
+                    insert_rows(rows, self.app.config['BULK_INSERT_CHUNK_SIZE'])
+                    db.session.remove()
+                break
+            except Exception:
+                self.failed_flushes += 1
+                logger.exception('write-behind flush of %d rows failed, retrying', len(batch))
+                if self._stopping.wait(delay):
+                    return False
+                delay = min(delay * 2, 30)
+        self.flushed += len(batch)
+        committed = {}
+        with self._spool_lock:
+            self._unflushed -= len(batch)
+            for _, segment, offset in batch:
+                segment.pending -= 1
+                committed[segment] = offset
+            for segment, offset in committed.items():
+                self._commit_offset(segment, offset)
+        return True
+
+    def _replay_orphans(self):
+        import fcntl
+        for path in glob.glob(os.path.join(self.spool_dir, 'spool-*.ndjson')):
+            if path in self._segments:
+                continue
+            try:
+                with open(path, 'r+', encoding='utf-8') as orphan:
+                    fcntl.flock(orphan.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    # rows before the offset were committed by the crashed process
+                    orphan.seek(_read_offset(path))
+                    with self.app.app_context():
+                        rows = [_load_row(line) for line in orphan if line.strip()]
+                        if rows:
+                            insert_rows(rows, self.app.config['BULK_INSERT_CHUNK_SIZE'])
+                            logger.info('replayed %d write-behind rows from %s', len(rows), path)
+                        db.session.remove()
+                    os.remove(path)
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(_offset_path(path))
+            except BlockingIOError:
+                continue  # still owned by a live process
+            except Exception:
+                logger.exception('could not replay write-behind spool %s', path)
+
+    def stop(self, timeout=30):
+        """Drain the queue and stop the writer thread."""
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        self._stopping.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+        with self._spool_lock:
+            if self._unflushed == 0 and not self._thread.is_alive():
+                for segment in list(self._segments.values()):
+                    self._remove_segment(segment)
+                self._pid = None
+
+
+def init_app(app):
+    app.config.setdefault('WRITE_BEHIND_ENABLED', env_bool('WRITE_BEHIND_ENABLED', False))
+    app.config.setdefault('WRITE_BEHIND_MAX_QUEUE', env_int('WRITE_BEHIND_MAX_QUEUE', 10000))
+    app.config.setdefault('WRITE_BEHIND_BATCH_SIZE', env_int('WRITE_BEHIND_BATCH_SIZE', 500))
+    app.config.setdefault('WRITE_BEHIND_FLUSH_INTERVAL', env_float('WRITE_BEHIND_FLUSH_INTERVAL', 0.5))
+    app.config.setdefault(
+        'WRITE_BEHIND_SPOOL_DIR',
+        os.environ.get('WRITE_BEHIND_SPOOL_DIR') or os.path.join(app.instance_path, 'spool'),
+    )
+    app.config.setdefault('WRITE_BEHIND_FSYNC', env_bool('WRITE_BEHIND_FSYNC', True))
+    if not app.config['WRITE_BEHIND_ENABLED']:
+        return
+    app.extensions['write_behind'] = WriteBehindWriter(
+        app,
+        max_queue=app.config['WRITE_BEHIND_MAX_QUEUE'],
+        batch_size=app.config['WRITE_BEHIND_BATCH_SIZE'],
+        flush_interval=app.config['WRITE_BEHIND_FLUSH_INTERVAL'],
+        spool_dir=app.config['WRITE_BEHIND_SPOOL_DIR'],
+        fsync=app.config['WRITE_BEHIND_FSYNC'],
+    )
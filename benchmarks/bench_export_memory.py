@@ -0,0 +1,83 @@
+"""
+Measure peak Python memory of GET /blacklists/export as the table grows, to
+check that the streaming export runs in constant memory.
+
+Usage:
+    python benchmarks/bench_export_memory.py --sizes 100000 1000000 2000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app, db  # noqa: E402
+from app.models import Blacklist  # noqa: E402
+
+SEED_CHUNK = 50000
+
+
+def grow_table(current, target):
+    """Insert rows until the table holds ``target`` rows."""
+    now = datetime.utcnow()
+    while current < target:
+        count = min(SEED_CHUNK, target - current)
+        db.session.execute(Blacklist.__table__.insert(), [
+            {
+                'email': f'user{current + i}@example.com',
+                'app_uuid': 'bench',
+                'blocked_reason': 'benchmark',
+                'request_date': now,
+                'created_at': now,
+            }
+            for i in range(count)
+        ])
+        db.session.commit()
+        current += count
+    return current
+
+
+def measure_export(client, headers, fmt, compress):
+    url = f'/blacklists/export?format={fmt}' + ('&gzip=true' if compress else '')
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(url, headers=headers, buffered=False)
+    total = 0
+    for piece in response.response:
+        total += len(piece)
+    response.close()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000, 2000000])
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        os.environ['STATIC_BEARER_TOKEN'] = 'bench-token'
+        os.environ['BLOOM_FILTER_ENABLED'] = 'false'
+        app = create_app()
+        client = app.test_client()
+        headers = {'Authorization': 'Bearer bench-token'}
+        rows = 0
+        print(f"{'rows':>10} {'bytes':>14} {'seconds':>9} {'peak MiB':>9}")
+        for size in sorted(args.sizes):
+            with app.app_context():
+                rows = grow_table(rows, size)
+            total, elapsed, peak = measure_export(client, headers, args.format, args.gzip)
+            print(f'{rows:>10} {total:>14} {elapsed:>9.1f} {peak / 2 ** 20:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Simulate a database outage under lookup load, with and without
+stale-while-revalidate and the circuit breaker.
+
+Clients look up a fixed set of emails for the whole run. During the outage
+phase every lookup query hangs for ``--outage-delay`` seconds and then fails,
+like connections to a database that is failing over. Reports latency,
+status codes and the ``X-Cache`` of the answers per phase.
+
+Usage:
+    python benchmarks/bench_lookup_failover.py --clients 16 --outage 10 --outage-delay 2
+    python benchmarks/bench_lookup_failover.py --fail-mode open
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import Blacklist, rebuild_status  # noqa: E402
+from app.normalize import email_key  # noqa: E402
+
+TOKEN = 'bench-token'
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))] * 1000, 3)
+
+
+def seed(rows):
+    now = datetime.utcnow()
+    db.session.execute(Blacklist.__table__.insert(), [
+        {'email': f'user{i}@example.com', 'email_key': email_key(f'user{i}@example.com'),
+         'blocked_reason': 'spam', 'created_at': now, 'request_date': now}
+        for i in range(0, rows, 2)
+    ])
+    db.session.commit()
+    rebuild_status()
+
+
+def run(resilient, args):
+    os.environ['LOOKUP_CACHE_STALE_TTL'] = '300' if resilient else '0'
+    os.environ['LOOKUP_BREAKER_FAILURES'] = '5' if resilient else '0'
+    app = create_app()
+    outage = threading.Event()
+
+    @event.listens_for(db.get_engine(app), 'before_cursor_execute')
+    def fail_during_outage(conn, cursor, statement, parameters, context, executemany):
+        if outage.is_set() and 'FROM blacklist_status' in statement:
+            time.sleep(args.outage_delay)
+            raise OperationalError(statement, parameters, Exception('could not connect to server'))
+
+    phases = [('before', args.healthy), ('outage', args.outage), ('after', args.healthy)]
+    samples = {name: [] for name, _ in phases}
+    statuses = {name: Counter() for name, _ in phases}
+    sources = {name: Counter() for name, _ in phases}
+    current = [phases[0][0]]
+    stopping = threading.Event()
+    lock = threading.Lock()
+    headers = {'Authorization': f'Bearer {TOKEN}'}
+
+    def worker(offset):
+        client = app.test_client()
+        n = offset
+        while not stopping.is_set():
+            phase = current[0]
+            started = time.perf_counter()
+            response = client.get(f'/blacklists/user{n % args.emails}@example.com', headers=headers)
+            elapsed = time.perf_counter() - started
+            n += args.clients
+            with lock:
+                samples[phase].append(elapsed)
+                statuses[phase][response.status_code] += 1
+                sources[phase][response.headers.get('X-Cache', 'none')] += 1
+
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        futures = [pool.submit(worker, offset) for offset in range(args.clients)]
+        for name, seconds in phases:
+            current[0] = name
+            if name == 'outage':
+                outage.set()
+            elif outage.is_set():
+                outage.clear()
+            time.sleep(seconds)
+        stopping.set()
+        for future in futures:
+            future.result()
+
+    breaker = app.extensions.get('lookup_breaker')
+    return {
+        'resilient': resilient,
+        'breaker': breaker.stats() if breaker is not None else None,
+        'phases': {
+            name: {
+                'requests': len(samples[name]),
+                'p50_ms': percentile(samples[name], 50),
+                'p99_ms': percentile(samples[name], 99),
+                'status': {str(code): count for code, count in sorted(statuses[name].items())},
+                'x_cache': dict(sorted(sources[name].items())),
+            }
+            for name, _ in phases
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--emails', type=int, default=200)
+    parser.add_argument('--healthy', type=float, default=5, help='seconds before and after the outage')
+    parser.add_argument('--outage', type=float, default=10)
+    parser.add_argument('--outage-delay', type=float, default=2, help='seconds each query hangs before failing')
+    parser.add_argument('--cache-ttl', type=float, default=1)
+    parser.add_argument('--reset-timeout', type=float, default=2, help='LOOKUP_BREAKER_RESET_TIMEOUT')
+    parser.add_argument('--fail-mode', choices=('error', 'open', 'closed'), default='error')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        os.environ['STATIC_BEARER_TOKEN'] = TOKEN
+        os.environ['BLOOM_FILTER_ENABLED'] = 'false'
+        os.environ['QUERY_LOG_ENABLED'] = 'false'
+        os.environ['LOOKUP_CACHE_TTL'] = str(args.cache_ttl)
+        os.environ['LOOKUP_FAIL_MODE'] = args.fail_mode
+        os.environ['LOOKUP_BREAKER_RESET_TIMEOUT'] = str(args.reset_timeout)
+        os.environ['DB_POOL_SIZE'] = str(args.clients)
+        app = create_app()
+        with app.app_context():
+            seed(args.emails)
+            db.session.remove()
+        results = []
+        for resilient in (False, True):
+            results.append(run(resilient, args))
+            print(results[-1], file=sys.stderr)
+
+    print(json.dumps({
+        'clients': args.clients, 'emails': args.emails, 'cache_ttl': args.cache_ttl,
+        'outage_delay': args.outage_delay, 'fail_mode': args.fail_mode, 'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
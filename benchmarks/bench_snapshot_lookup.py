@@ -0,0 +1,97 @@
+"""
+Compare lookups served by the memory-mapped snapshot with the status table,
+and the snapshot's size with a per-worker dict holding the same data.
+
+Usage:
+    python benchmarks/bench_snapshot_lookup.py --rows 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app, db  # noqa: E402
+from app.models import Blacklist, BlacklistStatus, rebuild_status  # noqa: E402
+from app.normalize import email_key  # noqa: E402
+from app.snapshot import BlacklistSnapshot, write_snapshot  # noqa: E402
+
+REASONS = ['spam', 'abuse', 'fraud', 'bounce', None]
+SEED_CHUNK = 50000
+
+
+def seed(rows):
+    now = datetime.utcnow()
+    db.session.execute(BlacklistStatus.__table__.delete())
+    db.session.execute(Blacklist.__table__.delete())
+    for start in range(0, rows, SEED_CHUNK):
+        db.session.execute(Blacklist.__table__.insert(), [
+            {'email': f'user{i}@example.com', 'email_key': email_key(f'user{i}@example.com'),
+             'blocked_reason': REASONS[i % len(REASONS)], 'created_at': now, 'request_date': now}
+            for i in range(start, min(rows, start + SEED_CHUNK))
+        ])
+    db.session.commit()
+    rebuild_status()
+
+
+def median_us(lookup, keys):
+    samples = []
+    for key in keys:
+        start = time.perf_counter()
+        lookup(key)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def dict_size(rows):
+    """Bytes allocated by a dict of every key to its reason, as a per-worker cache would hold."""
+    tracemalloc.start()
+    cache = {
+        email_key(f'user{i}@example.com'): (True, REASONS[i % len(REASONS)])
+        for i in range(rows)
+    }
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del cache
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        os.environ['BLOOM_FILTER_ENABLED'] = 'false'
+        path = os.path.join(tmp, 'blacklist.snapshot')
+        app = create_app()
+        print(f"{'rows':>9} {'status p50 (us)':>16} {'snapshot p50 (us)':>18} "
+              f"{'snapshot (MiB)':>15} {'dict (MiB)':>11}")
+        with app.app_context():
+            for rows in args.rows:
+                seed(rows)
+                write_snapshot(path)
+                snapshot = BlacklistSnapshot(path, refresh_interval=3600)
+                snapshot.load()
+
+                rng = random.Random(1)
+                keys = [
+                    email_key(f'user{rng.randrange(rows * 2)}@example.com') for _ in range(args.lookups)
+                ]
+                status = median_us(lambda key: db.session.get(BlacklistStatus, key), keys)
+                db.session.remove()
+                mapped = median_us(snapshot.lookup, keys)
+                print(f'{rows:>9} {status:>16.1f} {mapped:>18.1f} '
+                      f'{os.path.getsize(path) / 2 ** 20:>15.1f} {dict_size(rows) / 2 ** 20:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare lookup latency of the history scan against the current-status table
+as the number of history rows per email grows.
+
+Usage:
+    python benchmarks/bench_status_lookup.py --depths 1 10 100 1000 5000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app, db  # noqa: E402
+from app.models import Blacklist, BlacklistStatus, rebuild_status  # noqa: E402
+from app.normalize import email_key  # noqa: E402
+
+
+def seed(emails, depth):
+    """Insert ``depth`` history rows for each email with increasing timestamps."""
+    start = datetime(2020, 1, 1)
+    rows = [
+        {
+            'email': email,
+            'blocked_reason': f'reason {i}',
+            'created_at': start + timedelta(seconds=i),
+            'request_date': start + timedelta(seconds=i),
+        }
+        for email in emails
+        for i in range(depth)
+    ]
+    db.session.execute(Blacklist.__table__.delete())
+    db.session.execute(Blacklist.__table__.insert(), rows)
+    db.session.commit()
+    rebuild_status()
+
+
+def time_lookups(lookup, emails, repeat):
+    samples = []
+    for _ in range(repeat):
+        for email in emails:
+            start = time.perf_counter()
+            lookup(email)
+            samples.append(time.perf_counter() - start)
+            db.session.remove()
+    return statistics.median(samples) * 1e6
+
+
+def history_lookup(email):
+    return Blacklist.query.filter_by(email_key=email_key(email)).order_by(Blacklist.created_at.desc()).first()
+
+
+def status_lookup(email):
+    return db.session.get(BlacklistStatus, email_key(email))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 10, 100, 1000, 5000])
+    parser.add_argument('--emails', type=int, default=20, help='distinct emails per depth')
+    parser.add_argument('--repeat', type=int, default=20, help='lookups per email')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "bench.db")}'
+        os.environ['BLOOM_FILTER_ENABLED'] = 'false'
+        app = create_app()
+        emails = [f'user{i}@example.com' for i in range(args.emails)]
+        print(f"{'rows/email':>10} {'history p50 (us)':>18} {'status p50 (us)':>17}")
+        with app.app_context():
+            for depth in args.depths:
+                seed(emails, depth)
+                history = time_lookups(history_lookup, emails, args.repeat)
+                status = time_lookups(status_lookup, emails, args.repeat)
+                print(f'{depth:>10} {history:>18.1f} {status:>17.1f}')
+
+
+if __name__ == '__main__':
+    main()
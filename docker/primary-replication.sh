@@ -0,0 +1,5 @@
+#!/bin/bash
+# Runs once when the primary's data directory is created: allow the
+# replica in docker-compose.replica.yml to stream WAL.
+set -e
+echo "host replication ${POSTGRES_USER} all md5" >> "$PGDATA/pg_hba.conf"
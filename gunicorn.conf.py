@@ -0,0 +1,136 @@
+"""
+gunicorn configuration, sized from the CPU and memory limits of the container.
+
+Every setting can be overridden from the environment:
+- GUNICORN_WORKER_CLASS: sync, gthread (default) or gevent
+- WEB_CONCURRENCY: number of worker processes
+- GUNICORN_THREADS: threads per gthread worker; also sizes the DB pool
+- GUNICORN_WORKER_CONNECTIONS: concurrent requests per gevent worker
+- GUNICORN_WORKER_MEMORY_MB: memory budgeted per worker (default 96)
+- GUNICORN_PRELOAD: load the app once in the master before forking
+- GUNICORN_TIMEOUT, PORT
+"""
+import math
+import os
+import shutil
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def _read(path):
+    try:
+        with open(path) as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    """Return the CPU quota of the container in CPUs, or None if unlimited."""
+    value = _read(os.path.join(root, 'cpu.max'))  # cgroup v2: "<quota> <period>"
+    if value:
+        quota, _, period = value.partition(' ')
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    quota = _read(os.path.join(root, 'cpu', 'cpu.cfs_quota_us'))  # cgroup v1
+    period = _read(os.path.join(root, 'cpu', 'cpu.cfs_period_us'))
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit(root=CGROUP_ROOT):
+    """Return the memory limit of the container in bytes, or None if unlimited."""
+    value = _read(os.path.join(root, 'memory.max'))  # cgroup v2
+    if value is None:
+        value = _read(os.path.join(root, 'memory', 'memory.limit_in_bytes'))  # cgroup v1
+    if not value or value == 'max':
+        return None
+    limit = int(value)
+    # cgroup v1 reports "unlimited" as a huge page-aligned number
+    return limit if limit < 1 << 60 else None
+
+
+def available_cpus(root=CGROUP_ROOT):
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit(root)
+    return min(cpus, quota) if quota else cpus
+
+
+def default_workers(cpus, memory_limit, worker_memory):
+    """Return ``2 * cpus + 1`` workers, capped by what fits in 80% of memory."""
+    workers = max(1, math.floor(2 * cpus) + 1)
+    if memory_limit:
+        workers = min(workers, max(1, int(memory_limit * 0.8) // worker_memory))
+    return workers
+
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY') or default_workers(
+    available_cpus(),
+    cgroup_memory_limit(),
+    int(os.environ.get('GUNICORN_WORKER_MEMORY_MB', 96)) * 1024 * 1024,
+))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+# requests one worker serves at once, read by app.database to size its pool
+if worker_class == 'gevent':
+    os.environ.setdefault('DB_POOL_SIZE', '10')
+os.environ['GUNICORN_THREADS'] = str(threads)
+
+# gevent patches the standard library after the fork, which is too late for
+# modules a preloaded app has already imported
+preload_app = os.environ.get('GUNICORN_PRELOAD', str(worker_class != 'gevent')).lower() in (
+    '1', 'true', 'yes', 'on',
+)
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# heartbeat files on tmpfs instead of the container's overlay filesystem
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# samples left by a previous run would be summed into /metrics; this runs
+# when the config is loaded, before a preloaded app creates its own files
+_multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if _multiproc_dir:
+    shutil.rmtree(_multiproc_dir, ignore_errors=True)
+    os.makedirs(_multiproc_dir, exist_ok=True)
+
+
+def when_ready(server):
+    if preload_app:
+        # close the connections the master opened while loading the app so
+        # no worker inherits them
+        from app import db
+        with server.app.wsgi().app_context():
+            db.engine.dispose()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        # drop any pooled connection inherited from the master without
+        # closing it, which would close the socket the master still owns
+        from app import db
+        with server.app.wsgi().app_context():
+            db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            worker.log.warning('psycogreen is not installed; PostgreSQL queries will block the gevent worker')
+        else:
+            patch_psycopg()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -1,9 +1,11 @@
 """
 Test configuration and fixtures for Flask Blacklist API tests.
 """
+from contextlib import contextmanager
 import pytest
 from app import create_app, db
 from app.models import Blacklist
+from app.querylog import QueryCounter
 
 
 @pytest.fixture
@@ -33,6 +35,19 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def assert_max_queries(app):
+    """Return a context manager failing the test if its block runs more than ``limit`` statements."""
+    @contextmanager
+    def check(limit):
+        with QueryCounter(db.engine) as counter:
+            yield counter
+        assert counter.count <= limit, (
+            f'{counter.count} queries, budget {limit}:\n' + '\n'.join(counter.statements)
+        )
+    return check
+
+
 @pytest.fixture
 def auth_headers():
     """Return valid authorization headers."""
@@ -114,6 +114,25 @@ class TestBlacklistEndpoints:
         
         assert response.status_code == 400
     
+    @pytest.mark.parametrize('data, msg', [
+        ({'email': 123}, 'email is required'),
+        ({'email': 'a' * 250 + '@example.com'}, 'email must be at most 255 characters'),
+        ({'email': 'test@example.com', 'app_uuid': 123}, 'app_uuid must be a string'),
+        ({'email': 'test@example.com', 'blocked_reason': ['spam']}, 'blocked_reason must be a string'),
+        ({'email': '*@example.com', 'app_uuid': 123}, 'app_uuid must be a string'),
+        (['test@example.com'], 'entry must be a JSON object'),
+    ])
+    def test_add_blacklist_invalid_fields(self, client, auth_headers, data, msg):
+        """Test that malformed fields are rejected like in bulk and upsert requests."""
+        response = client.post(
+            '/blacklists',
+            data=json.dumps(data),
+            headers=auth_headers
+        )
+
+        assert response.status_code == 400
+        assert response.json['msg'].startswith(msg)
+
     # GET /blacklists/<email> tests
     
     def test_check_blacklist_found(self, client, auth_headers, sample_blacklist):
@@ -0,0 +1,159 @@
+"""
+Unit tests for the blacklist Bloom filter.
+"""
+import json
+import pytest
+from app import db
+from app.bloom import BlacklistFilter, BloomFilter
+from app.changes import purge_changes
+from app.models import Blacklist
+from app.normalize import email_key
+
+
+class TestBloomFilter:
+    """Test cases for the BloomFilter class."""
+
+    def test_added_items_are_members(self):
+        """Test that there are no false negatives."""
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        emails = [f'user{i}@example.com'.encode() for i in range(1000)]
+        for email in emails:
+            bloom.add(email)
+        assert all(email in bloom for email in emails)
+
+    def test_false_positive_rate_close_to_target(self):
+        """Test that the observed false-positive rate respects the target."""
+        bloom = BloomFilter(capacity=2000, error_rate=0.01)
+        for i in range(2000):
+            bloom.add(f'user{i}@example.com'.encode())
+        false_positives = sum(f'other{i}@example.com'.encode() in bloom for i in range(10000))
+        assert false_positives / 10000 < 0.02
+
+    def test_sizing_follows_error_rate(self):
+        """Test that a lower error rate uses more bits and hashes."""
+        loose = BloomFilter(capacity=1000, error_rate=0.1)
+        strict = BloomFilter(capacity=1000, error_rate=0.0001)
+        assert strict.num_bits > loose.num_bits
+        assert strict.num_hashes > loose.num_hashes
+
+    def test_saturated(self):
+        """Test that the filter reports when it holds more than its capacity."""
+        bloom = BloomFilter(capacity=2, error_rate=0.01)
+        for item in (b'a', b'b'):
+            bloom.add(item)
+        assert not bloom.saturated
+        bloom.add(b'c')
+        assert bloom.saturated
+
+
+class TestBlacklistFilter:
+    """Test the Bloom filter kept in sync with the blacklist table."""
+
+    def test_built_at_startup(self, app):
+        """Test that the filter is attached to the app and built."""
+        bloom = app.extensions['bloom_filter']
+        assert bloom.error_rate == app.config['BLOOM_FILTER_ERROR_RATE']
+
+    def test_inserted_rows_are_added(self, app, sample_blacklist):
+        """Test that ORM inserts update the filter immediately."""
+        bloom = app.extensions['bloom_filter']
+        assert bloom.might_contain(email_key('blocked1@example.com'))
+
+    def test_refresh_picks_up_rows_past_watermark(self, app):
+        """Test that rows written by another process are caught up on refresh."""
+        bloom = BlacklistFilter(min_capacity=100, refresh_interval=0)
+        bloom.rebuild()
+        db.session.add(Blacklist(email='other@example.com'))
+        db.session.commit()
+
+        assert bloom.might_contain(email_key('other@example.com'))
+        assert bloom.watermark > 0
+
+    def test_refresh_picks_up_rows_committed_out_of_id_order(self, app):
+        """Test that a row committed after one with a higher id is not skipped."""
+        bloom = BlacklistFilter(min_capacity=100, refresh_interval=0)
+        bloom.rebuild()
+        db.session.add(Blacklist(id=11, email='later@example.com'))
+        db.session.commit()
+        bloom.refresh()
+        # a transaction that drew id 10 before id 11 was drawn commits last
+        db.session.add(Blacklist(id=10, email='earlier@example.com'))
+        db.session.commit()
+
+        assert bloom.might_contain(email_key('earlier@example.com'))
+
+    def test_rebuilt_when_changes_were_purged(self, app):
+        """Test that the filter is rebuilt if changes past its watermark are gone."""
+        bloom = BlacklistFilter(min_capacity=100, refresh_interval=0)
+        bloom.rebuild()
+        for i in range(3):
+            db.session.add(Blacklist(email=f'user{i}@example.com'))
+            db.session.commit()
+        purge_changes(retention_days=-1)
+
+        assert all(bloom.might_contain(email_key(f'user{i}@example.com')) for i in range(3))
+
+    def test_rebuild_grows_saturated_filter(self, app):
+        """Test that a saturated filter is rebuilt with more capacity."""
+        bloom = BlacklistFilter(min_capacity=2, refresh_interval=0)
+        bloom.rebuild()
+        for i in range(3):
+            db.session.add(Blacklist(email=f'user{i}@example.com'))
+        db.session.commit()
+
+        bloom.refresh()
+        assert bloom.stats()['capacity'] == 6
+        assert all(bloom.might_contain(email_key(f'user{i}@example.com')) for i in range(3))
+
+    def test_save_and_load(self, app, tmp_path):
+        """Test that a saved filter round-trips through its file."""
+        path = str(tmp_path / 'blacklist.bloom')
+        db.session.add(Blacklist(email='saved@example.com'))
+        db.session.commit()
+        bloom = BlacklistFilter(min_capacity=100, path=path)
+        bloom.rebuild()
+        bloom.save()
+
+        loaded = BlacklistFilter(min_capacity=100, path=path)
+        assert loaded.load()
+        assert loaded.watermark == bloom.watermark
+        assert loaded.might_contain(email_key('saved@example.com'))
+
+    def test_load_missing_file(self, app, tmp_path):
+        """Test that loading a missing file reports failure."""
+        bloom = BlacklistFilter(path=str(tmp_path / 'missing.bloom'))
+        assert not bloom.load()
+
+
+class TestBloomFilterLookups:
+    """Test the Bloom filter on the lookup endpoint."""
+
+    def test_definite_miss_skips_database(self, client, auth_headers, app):
+        """Test that an unknown email is answered by the filter."""
+        response = client.get('/blacklists/unknown@example.com', headers=auth_headers)
+
+        assert response.json == {'blocked': False, 'reason': None}
+        stats = app.extensions['bloom_filter'].stats()
+        assert stats['filter_hits'] == 1
+        assert stats['db_fallbacks'] == 0
+        assert app.extensions['lookup_cache'].stats()['misses'] == 0
+
+    def test_posted_email_falls_back_to_database(self, client, auth_headers, app):
+        """Test that a posted email is looked up in the database."""
+        client.post(
+            '/blacklists',
+            data=json.dumps({'email': 'posted@example.com', 'blocked_reason': 'spam'}),
+            headers=auth_headers
+        )
+        response = client.get('/blacklists/posted@example.com', headers=auth_headers)
+
+        assert response.json == {'blocked': True, 'reason': 'spam'}
+        assert app.extensions['bloom_filter'].stats()['db_fallbacks'] == 1
+
+    def test_disabled(self, monkeypatch):
+        """Test that the filter can be turned off."""
+        from app import create_app
+        monkeypatch.setenv('DATABASE_URL', 'sqlite:///:memory:')
+        monkeypatch.setenv('BLOOM_FILTER_ENABLED', 'false')
+        app = create_app()
+        assert 'bloom_filter' not in app.extensions
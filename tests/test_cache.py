@@ -0,0 +1,167 @@
+"""
+Unit tests for the blacklist lookup cache.
+"""
+import json
+import pytest
+from app import db
+from app.cache import LookupCache, MISSING
+from app.models import Blacklist
+
+
+class FakeClock:
+    """Manually advanced clock for TTL tests."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLookupCache:
+    """Test cases for the LookupCache class."""
+
+    def test_miss_then_hit(self):
+        """Test that a stored value is returned and counted as a hit."""
+        cache = LookupCache(maxsize=10, ttl=60)
+        assert cache.get('a@example.com') is MISSING
+        cache.set('a@example.com', (True, 'spam'))
+        assert cache.get('a@example.com') == (True, 'spam')
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+
+    def test_negative_results_are_cached(self):
+        """Test that 'not blocked' results are cached too."""
+        cache = LookupCache(maxsize=10, ttl=60)
+        cache.set('clean@example.com', (False, None))
+        assert cache.get('clean@example.com') == (False, None)
+
+    def test_entries_expire_after_ttl(self):
+        """Test that entries older than the TTL are treated as misses."""
+        clock = FakeClock()
+        cache = LookupCache(maxsize=10, ttl=5, clock=clock)
+        cache.set('a@example.com', (True, 'spam'))
+        clock.now = 4.9
+        assert cache.get('a@example.com') == (True, 'spam')
+        clock.now = 5.0
+        assert cache.get('a@example.com') is MISSING
+        assert len(cache) == 0
+
+    def test_shorter_entry_ttl(self):
+        """Test that an entry can expire before the cache TTL, but not after it."""
+        clock = FakeClock()
+        cache = LookupCache(maxsize=10, ttl=5, clock=clock)
+        cache.set('expiring@example.com', (True, 'spam'), ttl=1)
+        cache.set('capped@example.com', (True, 'spam'), ttl=60)
+        clock.now = 1.0
+        assert cache.get('expiring@example.com') is MISSING
+        assert cache.get('capped@example.com') == (True, 'spam')
+        clock.now = 5.0
+        assert cache.get('capped@example.com') is MISSING
+
+    def test_stale_entries(self):
+        """Test that expired entries are returned marked stale until ``stale_ttl`` passes."""
+        clock = FakeClock()
+        cache = LookupCache(maxsize=10, ttl=5, stale_ttl=10, clock=clock)
+        cache.set('a@example.com', (True, 'spam'))
+        clock.now = 2.0
+        assert cache.get_entry('a@example.com') == ((True, 'spam'), 2.0, True)
+        clock.now = 6.0
+        assert cache.get('a@example.com') is MISSING
+        assert cache.get_entry('a@example.com') == ((True, 'spam'), 6.0, False)
+        clock.now = 15.0
+        assert cache.get_entry('a@example.com') is MISSING
+        assert len(cache) == 0
+        assert cache.stats()['stale_hits'] == 1
+
+    def test_shorter_entry_ttl_is_never_stale(self):
+        """Test that a result expiring with its entry is not served past that."""
+        clock = FakeClock()
+        cache = LookupCache(maxsize=10, ttl=5, stale_ttl=10, clock=clock)
+        cache.set('expiring@example.com', (True, 'spam'), ttl=1)
+        clock.now = 1.0
+        assert cache.get_entry('expiring@example.com') is MISSING
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted when full."""
+        cache = LookupCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is MISSING
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.stats()['evictions'] == 1
+
+    def test_invalidate(self):
+        """Test that invalidating a key removes it."""
+        cache = LookupCache(maxsize=10, ttl=60)
+        cache.set('a', 1)
+        cache.invalidate('a')
+        cache.invalidate('never-set')
+        assert cache.get('a') is MISSING
+
+    def test_set_after_invalidate_is_dropped(self):
+        """Test that a value read before an invalidation is not cached after it."""
+        cache = LookupCache(maxsize=10, ttl=60)
+        generation = cache.generation('a')
+        cache.invalidate('a')
+        cache.set('a', 1, generation=generation)
+        assert cache.get('a') is MISSING
+        cache.set('a', 2, generation=cache.generation('a'))
+        assert cache.get('a') == 2
+
+    def test_generations_are_bounded(self):
+        """Test that forgetting old generations never lets an outdated value in."""
+        cache = LookupCache(maxsize=2, ttl=60)
+        generation = cache.generation('a')
+        cache.invalidate('a')
+        cache.invalidate('b')
+        cache.invalidate('c')
+        assert len(cache._generations) == 2
+        cache.set('a', 1, generation=generation)
+        assert cache.get('a') is MISSING
+
+    def test_zero_size_disables_cache(self):
+        """Test that a cache of size zero never stores anything."""
+        cache = LookupCache(maxsize=0, ttl=60)
+        cache.set('a', 1)
+        assert cache.get('a') is MISSING
+
+
+class TestLookupCacheIntegration:
+    """Test the cache wired into the lookup endpoint."""
+
+    def test_cache_configured_from_app_config(self, app):
+        """Test that the cache is sized from the app config."""
+        cache = app.extensions['lookup_cache']
+        assert cache.maxsize == app.config['LOOKUP_CACHE_SIZE']
+        assert cache.ttl == app.config['LOOKUP_CACHE_TTL']
+
+    def test_repeated_lookup_served_from_cache(self, client, auth_headers, app, sample_blacklist):
+        """Test that a second lookup is a cache hit, not a DB query."""
+        client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+        # Remove the row behind the cache's back; the cached answer must win
+        Blacklist.query.filter_by(email='blocked1@example.com').delete()
+        db.session.commit()
+
+        response = client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+        assert response.json['blocked'] is True
+        assert app.extensions['lookup_cache'].stats()['hits'] == 1
+
+    def test_post_invalidates_cached_negative(self, client, auth_headers):
+        """Test that adding an email invalidates a cached 'not blocked'."""
+        response = client.get('/blacklists/late@example.com', headers=auth_headers)
+        assert response.json['blocked'] is False
+
+        client.post(
+            '/blacklists',
+            data=json.dumps({'email': 'late@example.com', 'blocked_reason': 'spam'}),
+            headers=auth_headers
+        )
+
+        response = client.get('/blacklists/late@example.com', headers=auth_headers)
+        assert response.json['blocked'] is True
+        assert response.json['reason'] == 'spam'
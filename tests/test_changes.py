@@ -0,0 +1,180 @@
+"""
+Unit tests for the change feed and GET /blacklists/changes.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from app import create_app, db
+from app.changes import ChangeNotifier, purge_changes
+from app.expiry import sweep_batch
+from app.ingest import insert_rows, upsert_row, validate_row
+from app.models import Blacklist, BlacklistChange
+
+
+def changes(client, auth_headers, query=''):
+    response = client.get(f'/blacklists/changes?{query}', headers=auth_headers)
+    assert response.status_code == 200
+    return response.json
+
+
+def summary(feed):
+    return [(change['email'], change['blocked'], change['reason']) for change in feed['changes']]
+
+
+def add(email, reason=None, expires_in=None):
+    entry = Blacklist(
+        email=email,
+        blocked_reason=reason,
+        expires_at=None if expires_in is None else datetime.utcnow() + timedelta(seconds=expires_in),
+    )
+    db.session.add(entry)
+    db.session.commit()
+    return entry
+
+
+class TestRecording:
+    """Test cases for recording changes with every write."""
+
+    def test_post(self, client, auth_headers):
+        """Test that a posted entry is one change with its status."""
+        client.post('/blacklists', data=json.dumps({
+            'email': 'user@example.com', 'app_uuid': 'app-1', 'blocked_reason': 'spam',
+        }), headers=auth_headers)
+        feed = changes(client, auth_headers)
+        assert feed['changes'] == [{
+            'id': feed['next_cursor'],
+            'email': 'user@example.com',
+            'blocked': True,
+            'reason': 'spam',
+            'app_uuid': 'app-1',
+            'expires_at': None,
+            'changed_at': feed['changes'][0]['changed_at'],
+        }]
+        assert feed['has_more'] is False
+
+    def test_bulk_and_upsert(self, app, client, auth_headers):
+        """Test that bulk inserts and upserts record the resulting status of each email."""
+        rows = [validate_row({'email': f'user{i}@example.com'})[0] for i in range(3)]
+        insert_rows(rows, chunk_size=2)
+        upsert_row(validate_row({'email': 'user0@example.com', 'blocked_reason': 'fraud'})[0])
+        recorded = summary(changes(client, auth_headers))
+        # within one write, changes are in email_key order
+        assert sorted(recorded[:3]) == [(f'user{i}@example.com', True, None) for i in range(3)]
+        assert recorded[3:] == [('user0@example.com', True, 'fraud')]
+
+    def test_delete_unblocks_last_entry(self, app, client, auth_headers):
+        """Test that deleting an email's only entry records it as unblocked."""
+        db.session.delete(add('user@example.com', 'spam'))
+        db.session.commit()
+        assert summary(changes(client, auth_headers))[-1] == ('user@example.com', False, None)
+
+    def test_delete_falls_back_to_older_entry(self, app, client, auth_headers):
+        """Test that deleting the latest entry records the one that applies now."""
+        add('user@example.com', 'permanent')
+        db.session.delete(add('user@example.com', 'temporary'))
+        db.session.commit()
+        assert summary(changes(client, auth_headers))[-1] == ('user@example.com', True, 'permanent')
+
+    def test_sweep_records_unblocks(self, app, client, auth_headers):
+        """Test that sweeping an email's last expired entry records it as unblocked."""
+        add('gone@example.com', 'spam', expires_in=-1)
+        assert sweep_batch() == 1
+        assert summary(changes(client, auth_headers)) == [
+            ('gone@example.com', True, 'spam'), ('gone@example.com', False, None),
+        ]
+
+    def test_rolled_back_writes_are_not_recorded(self, app):
+        """Test that changes share the transaction of the write."""
+        db.session.add(Blacklist(email='user@example.com'))
+        db.session.flush()
+        db.session.rollback()
+        assert BlacklistChange.query.count() == 0
+
+
+class TestChangesEndpoint:
+    """Test cases for reading the feed."""
+
+    def test_requires_auth(self, client):
+        """Test that the endpoint needs the bearer token."""
+        assert client.get('/blacklists/changes').status_code == 401
+
+    def test_pages_follow_the_cursor(self, app, client, auth_headers):
+        """Test that consecutive pages return every change once, in order."""
+        insert_rows([validate_row({'email': f'user{i}@example.com'})[0] for i in range(5)])
+        seen = []
+        cursor = 0
+        while True:
+            feed = changes(client, auth_headers, f'cursor={cursor}&limit=2')
+            seen += [change['email'] for change in feed['changes']]
+            cursor = feed['next_cursor']
+            if not feed['has_more']:
+                break
+        assert sorted(seen) == [f'user{i}@example.com' for i in range(5)]
+        assert changes(client, auth_headers, f'cursor={cursor}') == {
+            'changes': [], 'next_cursor': cursor, 'has_more': False,
+        }
+
+    @pytest.mark.parametrize('query', ['cursor=abc', 'cursor=-1', 'limit=0', 'limit=5001', 'wait=31', 'wait=x'])
+    def test_invalid_parameters(self, client, auth_headers, query):
+        """Test that malformed cursors, limits and waits are rejected."""
+        assert client.get(f'/blacklists/changes?{query}', headers=auth_headers).status_code == 400
+
+    def test_purged_cursor_is_gone(self, app, client, auth_headers):
+        """Test that a cursor behind the retained changes gets 410."""
+        for i in range(3):
+            add(f'user{i}@example.com')
+        BlacklistChange.query.update({'changed_at': datetime.utcnow() - timedelta(days=30)})
+        db.session.commit()
+        assert purge_changes(retention_days=7) == 2
+        assert client.get('/blacklists/changes?cursor=0', headers=auth_headers).status_code == 410
+        latest = BlacklistChange.query.one().id
+        assert changes(client, auth_headers, f'cursor={latest - 1}')['next_cursor'] == latest
+
+    def test_wait_times_out(self, client, auth_headers):
+        """Test that a long poll without changes returns an empty page after ``wait``."""
+        started = time.monotonic()
+        feed = changes(client, auth_headers, 'wait=0.2')
+        assert feed['changes'] == []
+        assert time.monotonic() - started >= 0.2
+
+    def test_export_reports_cursor(self, client, auth_headers, sample_blacklist):
+        """Test that exports carry the change id to resume the feed from."""
+        response = client.get('/blacklists/export', headers=auth_headers)
+        latest = BlacklistChange.query.order_by(BlacklistChange.id.desc()).first()
+        assert int(response.headers['X-Changes-Cursor']) == latest.id
+
+
+class TestLongPoll:
+    """Test cases for waking waiting requests."""
+
+    def test_notifier(self):
+        """Test that waiters wake on a notification and time out without one."""
+        notifier = ChangeNotifier()
+        assert notifier.wait(notifier.version, 0.01) is False
+        version = notifier.version
+        threading.Timer(0.05, notifier.notify).start()
+        assert notifier.wait(version, 5) is True
+
+    def test_commit_wakes_waiting_request(self, monkeypatch, tmp_path):
+        """Test that a commit in this process answers a waiting request before the next poll."""
+        monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path / "changes.db"}')
+        monkeypatch.setenv('STATIC_BEARER_TOKEN', 'test-token')
+        monkeypatch.setenv('CHANGES_POLL_INTERVAL', '30')
+        app = create_app()
+
+        def write():
+            with app.app_context():
+                add('late@example.com')
+                db.session.remove()
+
+        timer = threading.Timer(0.2, write)
+        timer.start()
+        started = time.monotonic()
+        response = app.test_client().get(
+            '/blacklists/changes?wait=10', headers={'Authorization': 'Bearer test-token'},
+        )
+        timer.join()
+        assert [change['email'] for change in response.json['changes']] == ['late@example.com']
+        assert time.monotonic() - started < 5
@@ -0,0 +1,82 @@
+"""
+Unit tests for engine and connection-pool configuration.
+"""
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+
+from app import create_app, db
+from app.database import TimedQueuePool, engine_options
+
+CONFIG = {
+    'DB_POOL_SIZE': 4,
+    'DB_MAX_OVERFLOW': 2,
+    'DB_POOL_TIMEOUT': 10,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+    'DB_STATEMENT_TIMEOUT_MS': 5000,
+}
+
+
+class TestEngineOptions:
+    """Test cases for the options passed to create_engine."""
+
+    def test_postgresql(self):
+        """Test pool sizing and the server-side statement timeout."""
+        options = engine_options('postgresql://user:pass@db/blacklist', CONFIG)
+        assert options['poolclass'] is TimedQueuePool
+        assert options['pool_size'] == 4
+        assert options['max_overflow'] == 2
+        assert options['pool_pre_ping'] is True
+        assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+
+    def test_statement_timeout_disabled(self):
+        """Test that a zero timeout leaves the server default."""
+        options = engine_options('postgresql://user:pass@db/blacklist', dict(CONFIG, DB_STATEMENT_TIMEOUT_MS=0))
+        assert 'connect_args' not in options
+
+    def test_sqlite_file_is_pooled(self):
+        """Test that file databases share pooled connections between threads."""
+        options = engine_options('sqlite:///dev.db', CONFIG)
+        assert options['poolclass'] is TimedQueuePool
+        assert options['connect_args'] == {'check_same_thread': False}
+
+    def test_sqlite_memory_untouched(self):
+        """Test that in-memory databases keep Flask-SQLAlchemy's single connection."""
+        assert engine_options('sqlite:///:memory:', CONFIG) == {}
+
+    def test_explicit_engine_options_win(self, monkeypatch):
+        """Test that SQLALCHEMY_ENGINE_OPTIONS from a config object are kept."""
+        class Config:
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+            SQLALCHEMY_TRACK_MODIFICATIONS = False
+            SQLALCHEMY_ENGINE_OPTIONS = {'echo': False}
+
+        app = create_app(Config)
+        assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {'echo': False}
+
+
+class TestSqlitePragmas:
+    """Test cases for the pragmas applied to SQLite connections."""
+
+    @pytest.fixture
+    def file_app(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'pragmas.db'}")
+        app = create_app()
+        with app.app_context():
+            yield app
+            db.session.remove()
+            db.engine.dispose()
+
+    def test_wal_and_synchronous(self, file_app):
+        """Test that file databases run in WAL mode with synchronous=NORMAL."""
+        assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert db.session.execute(text('PRAGMA synchronous')).scalar() == 1
+        assert db.session.execute(text('PRAGMA mmap_size')).scalar() == file_app.config['SQLITE_MMAP_SIZE']
+
+    def test_checkout_wait_is_recorded(self, file_app):
+        """Test that the pool records how long checkouts waited."""
+        before = REGISTRY.get_sample_value('blacklist_api_db_pool_checkout_wait_seconds_count') or 0
+        with db.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+        assert REGISTRY.get_sample_value('blacklist_api_db_pool_checkout_wait_seconds_count') > before
@@ -0,0 +1,173 @@
+"""
+Unit tests for expiring blacklist entries and the sweeper.
+"""
+import json
+from datetime import datetime, timedelta
+import pytest
+from app import create_app, db
+from app.expiry import ExpirySweeper, sweep_batch, sweep_expired
+from app.metrics import EXPIRY_SWEPT
+from app.models import Blacklist, BlacklistArchive, BlacklistDailyStats, BlacklistStatus
+from app.normalize import email_key
+
+
+def add(email, reason=None, expires_in=None, created_ago=0):
+    """Add an entry directly, bypassing the check that expiry lies in the future."""
+    now = datetime.utcnow()
+    entry = Blacklist(
+        email=email,
+        blocked_reason=reason,
+        created_at=now - timedelta(seconds=created_ago),
+        expires_at=None if expires_in is None else now + timedelta(seconds=expires_in),
+    )
+    db.session.add(entry)
+    db.session.commit()
+    return entry
+
+
+def lookup(client, auth_headers, email):
+    return client.get(f'/blacklists/{email}', headers=auth_headers).json
+
+
+class TestPostExpiry:
+    """Test cases for posting entries with ``expires_at``."""
+
+    def test_post_with_expiry(self, client, auth_headers):
+        """Test that an entry expiring in the future blocks and stores its expiry."""
+        expires_at = (datetime.utcnow() + timedelta(hours=1)).replace(microsecond=0)
+        response = client.post('/blacklists', data=json.dumps({
+            'email': 'temp@example.com', 'blocked_reason': 'cooldown', 'expires_at': expires_at.isoformat() + 'Z',
+        }), headers=auth_headers)
+        assert response.status_code == 201
+        assert Blacklist.query.one().expires_at == expires_at
+        assert db.session.get(BlacklistStatus, email_key('temp@example.com')).expires_at == expires_at
+        assert lookup(client, auth_headers, 'temp@example.com') == {'blocked': True, 'reason': 'cooldown'}
+
+    @pytest.mark.parametrize('expires_at, msg', [
+        ('tomorrow', 'expires_at must be an ISO 8601 timestamp'),
+        (12345, 'expires_at must be an ISO 8601 timestamp'),
+        ('2000-01-01T00:00:00Z', 'expires_at must be in the future'),
+    ])
+    def test_invalid_expiry(self, client, auth_headers, expires_at, msg):
+        """Test that malformed and past expiries are rejected on every write path."""
+        for body in (
+            {'email': 'temp@example.com', 'expires_at': expires_at},
+            {'email': 'temp@example.com', 'expires_at': expires_at, 'upsert': True},
+        ):
+            response = client.post('/blacklists', data=json.dumps(body), headers=auth_headers)
+            assert response.status_code == 400
+            assert response.json['msg'] == msg
+        response = client.post('/blacklists/bulk', data=json.dumps([
+            {'email': 'ok@example.com'}, {'email': 'temp@example.com', 'expires_at': expires_at},
+        ]), headers=auth_headers)
+        assert response.json['errors'] == [{'index': 1, 'msg': msg}]
+
+    def test_patterns_cannot_expire(self, client, auth_headers):
+        """Test that expiring domain patterns are rejected rather than stored forever."""
+        response = client.post('/blacklists', data=json.dumps({
+            'email': '*@example.com', 'expires_at': '2999-01-01T00:00:00',
+        }), headers=auth_headers)
+        assert response.status_code == 400
+
+
+class TestExpiredLookups:
+    """Test cases for lookups of expired but not yet swept entries."""
+
+    def test_expired_entry_does_not_block(self, client, auth_headers):
+        """Test that an expired entry no longer blocks."""
+        add('gone@example.com', 'spam', expires_in=-1)
+        assert lookup(client, auth_headers, 'gone@example.com') == {'blocked': False, 'reason': None}
+
+    def test_falls_back_to_older_active_entry(self, client, auth_headers):
+        """Test that the latest unexpired entry applies once a newer one expires."""
+        add('user@example.com', 'permanent', created_ago=60)
+        add('user@example.com', 'temporary', expires_in=-1)
+        assert lookup(client, auth_headers, 'user@example.com') == {'blocked': True, 'reason': 'permanent'}
+        response = client.post(
+            '/blacklists/lookup', data=json.dumps({'emails': ['user@example.com']}), headers=auth_headers,
+        )
+        assert response.json['results']['user@example.com'] == {'blocked': True, 'reason': 'permanent'}
+
+    def test_cache_does_not_outlive_expiry(self, app, client, auth_headers):
+        """Test that a cached result expires with its entry."""
+        add('soon@example.com', 'spam', expires_in=30)
+        assert lookup(client, auth_headers, 'soon@example.com')['blocked'] is True
+        cache = app.extensions['lookup_cache']
+        _, cached_until, stale_until, _ = cache._data[email_key('soon@example.com')]
+        assert cached_until - cache._clock() <= 30
+        assert stale_until == cached_until
+
+
+class TestSweeper:
+    """Test cases for archiving expired entries."""
+
+    def test_sweep_archives_and_updates_status_and_stats(self, app):
+        """Test that expired rows move to the archive and the email's older entry becomes current."""
+        add('user@example.com', 'permanent', created_ago=60)
+        expired = add('user@example.com', 'temporary', expires_in=-1)
+        expired_id = expired.id
+        add('active@example.com', 'spam', expires_in=3600)
+
+        assert sweep_batch() == 1
+        assert [row.email for row in Blacklist.query.order_by(Blacklist.id)] == [
+            'user@example.com', 'active@example.com',
+        ]
+        archived = BlacklistArchive.query.one()
+        assert (archived.id, archived.blocked_reason) == (expired_id, 'temporary')
+        assert db.session.get(BlacklistStatus, email_key('user@example.com')).blocked_reason == 'permanent'
+        assert {row.blocked_reason: row.count for row in BlacklistDailyStats.query} == {
+            'permanent': 1, 'temporary': 0, 'spam': 1,
+        }
+
+    def test_sweep_without_archive(self, app):
+        """Test that rows are only deleted with archiving disabled, and status rows of gone emails removed."""
+        add('gone@example.com', expires_in=-1)
+        assert sweep_batch(archive=False) == 1
+        assert Blacklist.query.count() == 0
+        assert BlacklistArchive.query.count() == 0
+        assert BlacklistStatus.query.count() == 0
+
+    def test_sweep_runs_in_batches(self, app):
+        """Test that a run sweeps batch by batch until nothing has expired."""
+        for i in range(7):
+            add(f'user{i}@example.com', expires_in=-1)
+        before = EXPIRY_SWEPT.labels('archived')._value.get()
+        assert sweep_expired(batch_size=3) == 7
+        assert EXPIRY_SWEPT.labels('archived')._value.get() - before == 7
+        assert Blacklist.query.count() == 0
+
+    def test_max_batches_bounds_a_run(self, app):
+        """Test that one run stops after ``max_batches`` batches."""
+        for i in range(7):
+            add(f'user{i}@example.com', expires_in=-1)
+        assert sweep_expired(batch_size=2, max_batches=2) == 4
+        assert Blacklist.query.count() == 3
+
+    def test_swept_email_no_longer_cached(self, app, client, auth_headers):
+        """Test that sweeping drops the cached results of this worker."""
+        add('user@example.com', 'permanent', created_ago=60)
+        add('user@example.com', 'temporary', expires_in=-1)
+        lookup(client, auth_headers, 'user@example.com')
+        sweep_batch()
+        assert len(app.extensions['lookup_cache']) == 0
+
+
+class TestExpirySweeper:
+    """Test cases for the background sweeper."""
+
+    def test_disabled_by_default(self, app):
+        """Test that no sweeper runs unless an interval is configured."""
+        assert 'expiry_sweeper' not in app.extensions
+
+    def test_run_once(self, monkeypatch, tmp_path):
+        """Test that a configured sweeper sweeps in its own app context."""
+        monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path / "expiry.db"}')
+        monkeypatch.setenv('EXPIRY_SWEEP_INTERVAL', '3600')
+        app = create_app()
+        sweeper = app.extensions['expiry_sweeper']
+        assert isinstance(sweeper, ExpirySweeper)
+        with app.app_context():
+            add('gone@example.com', expires_in=-1)
+            db.session.remove()
+        assert sweeper.run_once() == 1
+        assert sweeper.stats()['swept'] == 1
@@ -0,0 +1,88 @@
+"""
+Unit tests for the blacklist export endpoint.
+"""
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+import pytest
+from app import db
+from app.export import iter_chunks
+from app.models import Blacklist
+
+
+@pytest.fixture
+def dated_entries(app):
+    """Create entries with known creation dates."""
+    for day in range(1, 6):
+        db.session.add(Blacklist(
+            email=f'day{day}@example.com',
+            blocked_reason=f'reason {day}',
+            created_at=datetime(2024, 1, day)
+        ))
+    db.session.commit()
+
+
+class TestIterChunks:
+    """Test cases for chunked reading of the table."""
+
+    def test_chunks_are_bounded(self, app, dated_entries):
+        """Test that rows are yielded in id order in bounded chunks."""
+        chunks = list(iter_chunks(chunk_size=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert [row.email for chunk in chunks for row in chunk][0] == 'day1@example.com'
+
+
+class TestExportEndpoint:
+    """Test cases for GET /blacklists/export."""
+
+    def test_export_ndjson(self, client, auth_headers, dated_entries):
+        """Test exporting every entry as NDJSON."""
+        response = client.get('/blacklists/export', headers=auth_headers)
+
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == 'application/x-ndjson'
+        items = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert [item['email'] for item in items] == [f'day{day}@example.com' for day in range(1, 6)]
+        assert items[0]['blocked_reason'] == 'reason 1'
+
+    def test_export_csv(self, client, auth_headers, dated_entries, app):
+        """Test exporting as CSV with a single header row across chunks."""
+        app.config['EXPORT_CHUNK_SIZE'] = 2
+        response = client.get('/blacklists/export?format=csv', headers=auth_headers)
+
+        assert response.mimetype == 'text/csv'
+        rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+        assert len(rows) == 5
+        assert rows[4]['email'] == 'day5@example.com'
+
+    def test_export_since(self, client, auth_headers, dated_entries):
+        """Test filtering the export by creation date."""
+        response = client.get('/blacklists/export?since=2024-01-04T00:00:00Z', headers=auth_headers)
+        emails = [json.loads(line)['email'] for line in response.data.decode().splitlines()]
+        assert emails == ['day4@example.com', 'day5@example.com']
+
+    def test_export_gzip(self, client, auth_headers, dated_entries):
+        """Test gzip-compressing the export."""
+        response = client.get('/blacklists/export?gzip=true', headers=auth_headers)
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        lines = gzip.decompress(response.data).decode().splitlines()
+        assert len(lines) == 5
+
+    def test_export_empty_table(self, client, auth_headers):
+        """Test exporting an empty table."""
+        response = client.get('/blacklists/export?format=csv', headers=auth_headers)
+        assert response.status_code == 200
+        assert response.data == b''
+
+    def test_export_invalid_parameters(self, client, auth_headers):
+        """Test that unknown formats and bad dates are rejected."""
+        assert client.get('/blacklists/export?format=xml', headers=auth_headers).status_code == 400
+        assert client.get('/blacklists/export?since=yesterday', headers=auth_headers).status_code == 400
+
+    def test_export_requires_token(self, client):
+        """Test that the export requires authentication."""
+        assert client.get('/blacklists/export').status_code == 401
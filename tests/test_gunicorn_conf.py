@@ -0,0 +1,93 @@
+"""
+Unit tests for the worker sizing in gunicorn.conf.py.
+"""
+import importlib.util
+import os
+import pytest
+
+CONF_PATH = os.path.join(os.path.dirname(__file__), '..', 'gunicorn.conf.py')
+
+
+@pytest.fixture
+def load_conf(monkeypatch):
+    """Return a loader that executes gunicorn.conf.py with the given environment."""
+    def load(**env):
+        # the module exports GUNICORN_THREADS; let monkeypatch restore it
+        monkeypatch.setenv('GUNICORN_THREADS', os.environ.get('GUNICORN_THREADS', '4'))
+        monkeypatch.delenv('PROMETHEUS_MULTIPROC_DIR', raising=False)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        spec = importlib.util.spec_from_file_location('gunicorn_conf', CONF_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
+
+
+def write(root, path, value):
+    full = root / path
+    full.parent.mkdir(parents=True, exist_ok=True)
+    full.write_text(value)
+
+
+class TestCgroupLimits:
+    """Test cases for reading container limits."""
+
+    def test_cgroup_v2(self, load_conf, tmp_path):
+        """Test the unified hierarchy's cpu.max and memory.max."""
+        conf = load_conf()
+        write(tmp_path, 'cpu.max', '25600 100000\n')
+        write(tmp_path, 'memory.max', '536870912\n')
+        assert conf.cgroup_cpu_limit(str(tmp_path)) == pytest.approx(0.256)
+        assert conf.cgroup_memory_limit(str(tmp_path)) == 512 * 1024 * 1024
+
+    def test_cgroup_v2_unlimited(self, load_conf, tmp_path):
+        """Test that 'max' means no limit."""
+        conf = load_conf()
+        write(tmp_path, 'cpu.max', 'max 100000\n')
+        write(tmp_path, 'memory.max', 'max\n')
+        assert conf.cgroup_cpu_limit(str(tmp_path)) is None
+        assert conf.cgroup_memory_limit(str(tmp_path)) is None
+
+    def test_cgroup_v1(self, load_conf, tmp_path):
+        """Test the legacy CFS quota and memory limit files."""
+        conf = load_conf()
+        write(tmp_path, 'cpu/cpu.cfs_quota_us', '200000\n')
+        write(tmp_path, 'cpu/cpu.cfs_period_us', '100000\n')
+        write(tmp_path, 'memory/memory.limit_in_bytes', '9223372036854771712\n')
+        assert conf.cgroup_cpu_limit(str(tmp_path)) == 2
+        assert conf.cgroup_memory_limit(str(tmp_path)) is None
+
+    def test_no_cgroup(self, load_conf, tmp_path):
+        """Test hosts without cgroup files."""
+        conf = load_conf()
+        assert conf.cgroup_cpu_limit(str(tmp_path)) is None
+        assert conf.available_cpus(str(tmp_path)) >= 1
+
+
+class TestWorkerSizing:
+    """Test cases for the derived gunicorn settings."""
+
+    def test_default_workers(self, load_conf):
+        """Test 2 * CPUs + 1 capped by memory."""
+        conf = load_conf()
+        mib = 1024 * 1024
+        assert conf.default_workers(0.25, 512 * mib, 96 * mib) == 1
+        assert conf.default_workers(2, None, 96 * mib) == 5
+        assert conf.default_workers(4, 512 * mib, 96 * mib) == 4
+
+    def test_gthread(self, load_conf):
+        """Test the default worker class preloads and exports its thread count."""
+        conf = load_conf(WEB_CONCURRENCY='3', GUNICORN_THREADS='8')
+        assert conf.worker_class == 'gthread'
+        assert conf.workers == 3
+        assert conf.threads == 8
+        assert conf.preload_app
+        assert os.environ['GUNICORN_THREADS'] == '8'
+
+    def test_gevent_does_not_preload(self, load_conf):
+        """Test that gevent workers load the app after monkey patching."""
+        conf = load_conf(GUNICORN_WORKER_CLASS='gevent', DB_POOL_SIZE='20')
+        assert conf.threads == 1
+        assert not conf.preload_app
+        assert os.environ['DB_POOL_SIZE'] == '20'
@@ -0,0 +1,144 @@
+"""
+Unit tests for Idempotency-Key handling and upserts.
+"""
+import json
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.idempotency import _digest, purge_expired
+from app.models import Blacklist, BlacklistStatus, IdempotencyKey
+
+
+def post(client, headers, body, key=None, path='/blacklists'):
+    if key is not None:
+        headers = dict(headers, **{'Idempotency-Key': key})
+    return client.post(path, data=json.dumps(body), headers=headers)
+
+
+class TestIdempotencyKey:
+    """Test cases for replaying responses to retried requests."""
+
+    def test_retry_is_replayed(self, client, auth_headers):
+        """Test that a retry returns the first response without inserting again."""
+        body = {'email': 'retry@example.com', 'blocked_reason': 'spam'}
+        first = post(client, auth_headers, body, key='abc')
+        second = post(client, auth_headers, body, key='abc')
+
+        assert first.status_code == second.status_code == 201
+        assert second.json == first.json
+        assert second.headers['Idempotent-Replayed'] == 'true'
+        assert 'Idempotent-Replayed' not in first.headers
+        assert Blacklist.query.count() == 1
+        assert IdempotencyKey.query.count() == 1
+
+    def test_without_header(self, client, auth_headers):
+        """Test that requests without a key keep appending history."""
+        body = {'email': 'retry@example.com'}
+        post(client, auth_headers, body)
+        post(client, auth_headers, body)
+        assert Blacklist.query.count() == 2
+        assert IdempotencyKey.query.count() == 0
+
+    def test_key_reused_for_different_body(self, client, auth_headers):
+        """Test that a key cannot be reused for another request."""
+        post(client, auth_headers, {'email': 'a@example.com'}, key='abc')
+        response = post(client, auth_headers, {'email': 'b@example.com'}, key='abc')
+        assert response.status_code == 422
+        assert Blacklist.query.count() == 1
+
+    def test_client_errors_are_replayed(self, client, auth_headers):
+        """Test that a rejected request is answered the same way on retry."""
+        assert post(client, auth_headers, {}, key='abc').status_code == 400
+        response = post(client, auth_headers, {}, key='abc')
+        assert response.status_code == 400
+        assert response.headers['Idempotent-Replayed'] == 'true'
+
+    def test_server_errors_are_not_stored(self, client, auth_headers, app):
+        """Test that a 503 from the write-behind queue leaves the key free for a retry."""
+        class FullWriter:
+            def submit(self, row):
+                return False
+        app.extensions['write_behind'] = FullWriter()
+        assert post(client, auth_headers, {'email': 'a@example.com'}, key='abc').status_code == 503
+        del app.extensions['write_behind']
+
+        assert post(client, auth_headers, {'email': 'a@example.com'}, key='abc').status_code == 201
+        assert Blacklist.query.count() == 1
+
+    def test_in_progress(self, client, auth_headers, app):
+        """Test that a retry racing the first request is told to retry later."""
+        db.session.add(IdempotencyKey(
+            key=_digest(b'/blacklists', b'abc'),
+            request_hash=_digest(json.dumps({'email': 'a@example.com'}).encode()),
+            expires_at=datetime.utcnow() + timedelta(hours=1),
+        ))
+        db.session.commit()
+
+        response = post(client, auth_headers, {'email': 'a@example.com'}, key='abc')
+        assert response.status_code == 409
+        assert response.headers['Retry-After'] == '1'
+
+    def test_expired_key_is_reclaimed(self, client, auth_headers, app):
+        """Test that an expired key runs the request again."""
+        app.config['IDEMPOTENCY_KEY_TTL'] = -1
+        post(client, auth_headers, {'email': 'a@example.com'}, key='abc')
+        response = post(client, auth_headers, {'email': 'a@example.com'}, key='abc')
+        assert 'Idempotent-Replayed' not in response.headers
+        assert Blacklist.query.count() == 2
+        assert IdempotencyKey.query.count() == 1
+
+    def test_purge_expired(self, client, auth_headers, app):
+        """Test deleting expired keys."""
+        post(client, auth_headers, {'email': 'a@example.com'}, key='fresh')
+        app.config['IDEMPOTENCY_KEY_TTL'] = -1
+        post(client, auth_headers, {'email': 'b@example.com'}, key='old')
+        assert purge_expired(batch_size=1) == 1
+        assert IdempotencyKey.query.count() == 1
+
+    def test_bulk(self, client, auth_headers):
+        """Test that bulk requests are idempotent too."""
+        body = [{'email': 'a@example.com'}, {'email': 'b@example.com'}]
+        post(client, auth_headers, body, key='abc', path='/blacklists/bulk')
+        response = post(client, auth_headers, body, key='abc', path='/blacklists/bulk')
+        assert response.json['inserted'] == 2
+        assert Blacklist.query.count() == 2
+
+    def test_key_too_long(self, client, auth_headers):
+        """Test that oversized keys are rejected."""
+        assert post(client, auth_headers, {'email': 'a@example.com'}, key='k' * 256).status_code == 400
+
+
+class TestUpsert:
+    """Test cases for updating the entry of an email and app in place."""
+
+    def test_updates_existing_entry(self, client, auth_headers):
+        """Test that repeated upserts keep a single row with the latest values."""
+        post(client, auth_headers, {'email': 'a@example.com', 'app_uuid': 'app-1',
+                                    'blocked_reason': 'spam', 'upsert': True})
+        response = post(client, auth_headers, {'email': 'A@Example.com', 'app_uuid': 'app-1',
+                                               'blocked_reason': 'fraud', 'upsert': True})
+
+        assert response.status_code == 201
+        rows = Blacklist.query.all()
+        assert [(row.email, row.blocked_reason) for row in rows] == [('A@Example.com', 'fraud')]
+        assert BlacklistStatus.query.one().blocked_reason == 'fraud'
+        lookup = client.get('/blacklists/a@example.com', headers=auth_headers)
+        assert lookup.json == {'blocked': True, 'reason': 'fraud'}
+
+    def test_apps_are_separate(self, client, auth_headers):
+        """Test that the same email from different apps keeps one row per app."""
+        for app_uuid in ('app-1', 'app-2', None, None, '', ''):
+            post(client, auth_headers, {'email': 'a@example.com', 'app_uuid': app_uuid, 'upsert': True})
+        assert Blacklist.query.count() == 4
+
+    def test_plain_rows_are_not_matched(self, client, auth_headers):
+        """Test that upserts leave entries written without upsert alone."""
+        post(client, auth_headers, {'email': 'a@example.com', 'app_uuid': 'app-1'})
+        post(client, auth_headers, {'email': 'a@example.com', 'app_uuid': 'app-1', 'upsert': True})
+        post(client, auth_headers, {'email': 'a@example.com', 'app_uuid': 'app-1', 'upsert': True})
+        assert Blacklist.query.count() == 2
+
+    def test_invalid_entry(self, client, auth_headers):
+        """Test that upserts are validated like bulk rows."""
+        response = post(client, auth_headers, {'email': 'a@example.com', 'app_uuid': 7, 'upsert': True})
+        assert response.status_code == 400
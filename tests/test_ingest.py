@@ -0,0 +1,137 @@
+"""
+Unit tests for bulk ingestion of blacklist entries.
+"""
+import json
+import pytest
+from app.ingest import _copy_csv, parse_items, validate_row
+from app.models import Blacklist
+
+
+class TestParseItems:
+    """Test cases for request body parsing."""
+
+    def test_json_array(self):
+        """Test parsing a JSON array body."""
+        items, errors = parse_items('[{"email": "a@example.com"}]', 'application/json')
+        assert items == [{'email': 'a@example.com'}]
+        assert errors == []
+
+    def test_json_object_rejected(self):
+        """Test that a JSON body must be an array."""
+        with pytest.raises(ValueError):
+            parse_items('{"email": "a@example.com"}', 'application/json')
+
+    def test_ndjson(self):
+        """Test parsing NDJSON, skipping blank lines and reporting bad lines."""
+        body = '{"email": "a@example.com"}\n\nnot json\n{"email": "b@example.com"}\n'
+        items, errors = parse_items(body, 'application/x-ndjson')
+        assert items == [{'email': 'a@example.com'}, None, {'email': 'b@example.com'}]
+        assert errors == [{'index': 1, 'msg': 'invalid JSON'}]
+
+
+class TestValidateRow:
+    """Test cases for per-row validation."""
+
+    def test_valid_row(self):
+        """Test that a valid entry is turned into an insertable row."""
+        row, error = validate_row({'email': 'a@example.com', 'blocked_reason': 'spam'}, '10.0.0.1')
+        assert error is None
+        assert row['email'] == 'a@example.com'
+        assert row['blocked_reason'] == 'spam'
+        assert row['ip_address'] == '10.0.0.1'
+        assert row['created_at'] is not None
+
+    @pytest.mark.parametrize('item', [
+        'a@example.com',
+        {},
+        {'email': ''},
+        {'email': 42},
+        {'email': 'a' * 256},
+        {'email': 'a@example.com', 'app_uuid': 7},
+        {'email': 'a@example.com', 'blocked_reason': 'x' * 1025},
+    ])
+    def test_invalid_rows(self, item):
+        """Test that invalid entries are rejected with a message."""
+        row, error = validate_row(item)
+        assert row is None
+        assert error
+
+
+class TestCopyCsv:
+    """Test cases for the CSV sent to PostgreSQL's COPY."""
+
+    def test_empty_strings_are_quoted_and_nulls_are_not(self):
+        """Test that COPY can tell an empty string from NULL."""
+        row, _ = validate_row({'email': 'a@example.com', 'app_uuid': '', 'blocked_reason': 'say "hi", bye'})
+        now = row['created_at'].isoformat()
+        assert _copy_csv([row]).read() == (
+            f'"a@example.com","\\x{row["email_key"].hex()}","","say ""hi"", bye",,"{now}","{now}",\n'
+        )
+
+
+class TestBulkEndpoint:
+    """Test cases for POST /blacklists/bulk."""
+
+    def test_bulk_insert_json(self, client, auth_headers, app):
+        """Test inserting a JSON array of entries."""
+        data = [{'email': f'bulk{i}@example.com', 'blocked_reason': 'spam'} for i in range(25)]
+        response = client.post('/blacklists/bulk', data=json.dumps(data), headers=auth_headers)
+
+        assert response.status_code == 201
+        assert response.json['inserted'] == 25
+        assert response.json['errors'] == []
+        assert Blacklist.query.count() == 25
+
+    def test_bulk_insert_ndjson_in_chunks(self, client, auth_headers, app):
+        """Test inserting NDJSON across several chunks."""
+        app.config['BULK_INSERT_CHUNK_SIZE'] = 3
+        body = '\n'.join(json.dumps({'email': f'nd{i}@example.com'}) for i in range(10))
+        headers = dict(auth_headers, **{'Content-Type': 'application/x-ndjson'})
+        response = client.post('/blacklists/bulk', data=body, headers=headers)
+
+        assert response.status_code == 201
+        assert response.json['inserted'] == 10
+        assert Blacklist.query.count() == 10
+
+    def test_bulk_reports_row_errors(self, client, auth_headers, app):
+        """Test that invalid rows are reported while valid rows are inserted."""
+        data = [{'email': 'ok@example.com'}, {'blocked_reason': 'no email'}, 'nope']
+        response = client.post('/blacklists/bulk', data=json.dumps(data), headers=auth_headers)
+
+        assert response.status_code == 201
+        assert response.json['inserted'] == 1
+        assert [error['index'] for error in response.json['errors']] == [1, 2]
+
+    def test_bulk_all_invalid(self, client, auth_headers):
+        """Test that a body without valid rows is rejected."""
+        response = client.post('/blacklists/bulk', data=json.dumps([{}]), headers=auth_headers)
+        assert response.status_code == 400
+        assert response.json['inserted'] == 0
+
+    def test_bulk_not_an_array(self, client, auth_headers):
+        """Test that a non-array JSON body is rejected."""
+        response = client.post('/blacklists/bulk', data='{}', headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_bulk_too_many_rows(self, client, auth_headers, app):
+        """Test that the per-request row limit is enforced."""
+        app.config['BULK_MAX_ROWS'] = 2
+        data = [{'email': f'x{i}@example.com'} for i in range(3)]
+        response = client.post('/blacklists/bulk', data=json.dumps(data), headers=auth_headers)
+        assert response.status_code == 413
+
+    def test_bulk_requires_token(self, client):
+        """Test that the bulk endpoint requires authentication."""
+        response = client.post('/blacklists/bulk', data='[]', headers={'Content-Type': 'application/json'})
+        assert response.status_code == 401
+
+    def test_bulk_inserted_emails_are_visible_to_lookups(self, client, auth_headers):
+        """Test that bulk-inserted emails pass the Bloom filter and cache."""
+        assert client.get('/blacklists/late@example.com', headers=auth_headers).json['blocked'] is False
+        client.post(
+            '/blacklists/bulk',
+            data=json.dumps([{'email': 'late@example.com', 'blocked_reason': 'bulk'}]),
+            headers=auth_headers
+        )
+        response = client.get('/blacklists/late@example.com', headers=auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'bulk'}
@@ -0,0 +1,122 @@
+"""
+Unit tests for the keyset-paginated listing endpoint.
+"""
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.listing import decode_cursor, encode_cursor, list_page
+from app.models import Blacklist
+
+
+@pytest.fixture
+def entries(app):
+    """Create ten entries, two per app, with one shared timestamp to exercise the id tiebreak."""
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(10):
+        rows.append(Blacklist(
+            email=f'user{i}@example.com',
+            app_uuid=f'app-{i % 5}',
+            blocked_reason='spam' if i % 2 else 'abuse',
+            created_at=start + timedelta(days=min(i, 8)),
+        ))
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def emails(items):
+    return [item['email'] for item in items]
+
+
+class TestCursor:
+    """Test cases for opaque cursors."""
+
+    def test_round_trip(self, app, entries):
+        """Test that a cursor decodes to the position of its row."""
+        assert decode_cursor(encode_cursor(entries[3])) == (entries[3].created_at, entries[3].id)
+
+    def test_malformed(self):
+        """Test that tampered cursors are rejected."""
+        # not base64, an empty list, a position without a timestamp
+        for cursor in ('not a cursor', 'W10', 'WyJ4IiwxXQ'):
+            with pytest.raises(ValueError):
+                decode_cursor(cursor)
+
+
+class TestListPage:
+    """Test cases for walking pages."""
+
+    def test_walks_every_row_newest_first(self, app, entries):
+        """Test that pages cover every row exactly once, ties broken by id."""
+        seen = []
+        cursor = None
+        while True:
+            rows, cursor = list_page(3, cursor)
+            seen.extend(row.email for row in rows)
+            if cursor is None:
+                break
+        assert seen == [f'user{i}@example.com' for i in (9, 8, 7, 6, 5, 4, 3, 2, 1, 0)]
+
+    def test_last_page_has_no_cursor(self, app, entries):
+        """Test that an exactly full last page does not point to an empty page."""
+        rows, cursor = list_page(10)
+        assert len(rows) == 10 and cursor is None
+
+    def test_new_rows_do_not_shift_pages(self, app, entries):
+        """Test that inserts ahead of the cursor do not repeat rows on later pages."""
+        first, cursor = list_page(5)
+        db.session.add(Blacklist(email='late@example.com', created_at=datetime(2030, 1, 1)))
+        db.session.commit()
+        second, _ = list_page(5, cursor)
+        assert not {row.id for row in first} & {row.id for row in second}
+
+
+class TestListEndpoint:
+    """Test cases for GET /blacklists."""
+
+    def test_pages(self, client, auth_headers, entries):
+        """Test following next_cursor through the listing."""
+        response = client.get('/blacklists?limit=4', headers=auth_headers)
+        assert response.status_code == 200
+        assert emails(response.json['items']) == ['user9@example.com', 'user8@example.com',
+                                                  'user7@example.com', 'user6@example.com']
+        assert 'email_key' not in response.json['items'][0]
+
+        cursor = response.json['next_cursor']
+        response = client.get(f'/blacklists?limit=4&cursor={cursor}', headers=auth_headers)
+        assert emails(response.json['items'])[0] == 'user5@example.com'
+
+    def test_filters(self, client, auth_headers, entries):
+        """Test filtering by app, reason and a half-open date range."""
+        response = client.get('/blacklists?app_uuid=app-1', headers=auth_headers)
+        assert emails(response.json['items']) == ['user6@example.com', 'user1@example.com']
+
+        response = client.get('/blacklists?blocked_reason=abuse&limit=2', headers=auth_headers)
+        assert emails(response.json['items']) == ['user8@example.com', 'user6@example.com']
+        assert response.json['next_cursor']
+
+        response = client.get(
+            '/blacklists?since=2024-01-02T00:00:00Z&until=2024-01-04T00:00:00Z', headers=auth_headers
+        )
+        assert emails(response.json['items']) == ['user2@example.com', 'user1@example.com']
+        assert response.json['next_cursor'] is None
+
+    @pytest.mark.parametrize('query', ['limit=0', 'limit=1001', 'limit=abc', 'cursor=bogus', 'since=yesterday'])
+    def test_invalid_parameters(self, client, auth_headers, query):
+        """Test that malformed parameters are rejected."""
+        assert client.get(f'/blacklists?{query}', headers=auth_headers).status_code == 400
+
+    def test_requires_token(self, client):
+        """Test that listing requires authentication."""
+        assert client.get('/blacklists').status_code == 401
+
+    def test_uses_composite_index(self, app, entries):
+        """Test that a filtered page is an index range scan rather than a sort."""
+        plan = db.session.execute(db.text(
+            'EXPLAIN QUERY PLAN SELECT id FROM blacklists WHERE app_uuid = :app '
+            'AND (created_at, id) < (:created_at, :id) ORDER BY created_at DESC, id DESC LIMIT 10'
+        ), {'app': 'app-1', 'created_at': datetime(2030, 1, 1), 'id': 1}).fetchall()
+        details = ' '.join(row[-1] for row in plan)
+        assert 'ix_blacklists_app_uuid_created_at_id' in details
+        assert 'TEMP B-TREE' not in details
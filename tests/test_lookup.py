@@ -0,0 +1,89 @@
+"""
+Unit tests for blacklist lookup resolution.
+"""
+import json
+import pytest
+from app import db
+from app.lookup import lookup_emails
+from app.models import Blacklist
+from app.normalize import email_key
+
+
+class TestLookupEmails:
+    """Test cases for resolving many emails at once."""
+
+    def test_resolves_latest_row_per_email(self, app, sample_blacklist):
+        """Test that each email maps to its most recent entry."""
+        results = lookup_emails(['blocked1@example.com', 'duplicate@example.com', 'clean@example.com'])
+        assert results == {
+            'blocked1@example.com': (True, 'spam'),
+            'duplicate@example.com': (True, 'second entry - most recent'),
+            'clean@example.com': (False, None),
+        }
+
+    def test_duplicates_in_request_are_collapsed(self, app, sample_blacklist):
+        """Test that repeated emails are resolved once."""
+        results = lookup_emails(['blocked2@example.com', 'blocked2@example.com'])
+        assert results == {'blocked2@example.com': (True, 'abuse')}
+
+    def test_chunks_large_requests(self, app, monkeypatch):
+        """Test that emails beyond one IN chunk are still resolved."""
+        monkeypatch.setattr('app.lookup.IN_CLAUSE_CHUNK_SIZE', 3)
+        for i in range(0, 10, 2):
+            db.session.add(Blacklist(email=f'user{i}@example.com', blocked_reason=f'r{i}'))
+        db.session.commit()
+
+        results = lookup_emails([f'user{i}@example.com' for i in range(10)])
+        assert results['user4@example.com'] == (True, 'r4')
+        assert results['user5@example.com'] == (False, None)
+        assert sum(blocked for blocked, _ in results.values()) == 5
+
+    def test_results_are_cached(self, app, sample_blacklist):
+        """Test that database answers are stored in the lookup cache."""
+        lookup_emails(['blocked1@example.com'])
+        cache = app.extensions['lookup_cache']
+        assert cache.get(email_key('blocked1@example.com')) == (True, 'spam')
+
+
+class TestBatchLookupEndpoint:
+    """Test cases for POST /blacklists/lookup."""
+
+    def test_batch_lookup(self, client, auth_headers, sample_blacklist):
+        """Test looking up several emails in one request."""
+        response = client.post(
+            '/blacklists/lookup',
+            data=json.dumps({'emails': ['blocked2@example.com', 'clean@example.com']}),
+            headers=auth_headers
+        )
+
+        assert response.status_code == 200
+        assert response.json['results'] == {
+            'blocked2@example.com': {'blocked': True, 'reason': 'abuse'},
+            'clean@example.com': {'blocked': False, 'reason': None},
+        }
+
+    def test_batch_lookup_invalid_body(self, client, auth_headers):
+        """Test that emails must be a list of strings."""
+        for body in ({}, {'emails': 'a@example.com'}, {'emails': [1]}, {'emails': ['']}, ['a@example.com'], None):
+            response = client.post('/blacklists/lookup', data=json.dumps(body), headers=auth_headers)
+            assert response.status_code == 400
+            assert response.json['msg'] == 'emails must be a list of email strings'
+
+    def test_batch_lookup_too_many_emails(self, client, auth_headers, app):
+        """Test that the per-request email limit is enforced."""
+        app.config['LOOKUP_BATCH_MAX_EMAILS'] = 1
+        response = client.post(
+            '/blacklists/lookup',
+            data=json.dumps({'emails': ['a@example.com', 'b@example.com']}),
+            headers=auth_headers
+        )
+        assert response.status_code == 413
+
+    def test_batch_lookup_requires_token(self, client):
+        """Test that the batch lookup requires authentication."""
+        response = client.post(
+            '/blacklists/lookup',
+            data=json.dumps({'emails': []}),
+            headers={'Content-Type': 'application/json'}
+        )
+        assert response.status_code == 401
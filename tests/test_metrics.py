@@ -0,0 +1,96 @@
+"""
+Unit tests for the Prometheus /metrics endpoint.
+"""
+import pytest
+from prometheus_client import REGISTRY
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetricsEndpoint:
+    """Test cases for GET /metrics."""
+
+    def test_exposes_metrics(self, client):
+        """Test that the endpoint renders the Prometheus text format."""
+        response = client.get('/metrics')
+
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        body = response.get_data(as_text=True)
+        assert 'blacklist_api_requests_total' in body
+        assert 'blacklist_api_db_statement_duration_seconds' in body
+        assert 'blacklist_api_db_pool_checked_out' in body
+
+    def test_counts_requests_per_resource(self, client, auth_headers):
+        """Test that requests are labelled with the resource class that served them."""
+        labels = {'resource': 'BlacklistLookupResource', 'method': 'GET', 'status': '200'}
+        before = sample('blacklist_api_requests_total', **labels)
+        latency_before = sample(
+            'blacklist_api_request_duration_seconds_count', resource='BlacklistLookupResource', method='GET'
+        )
+
+        client.get('/blacklists/someone@example.com', headers=auth_headers)
+
+        assert sample('blacklist_api_requests_total', **labels) == before + 1
+        assert sample(
+            'blacklist_api_request_duration_seconds_count', resource='BlacklistLookupResource', method='GET'
+        ) == latency_before + 1
+
+    def test_counts_status_codes(self, client):
+        """Test that error responses are counted under their status code."""
+        labels = {'resource': 'BlacklistLookupResource', 'method': 'GET', 'status': '401'}
+        before = sample('blacklist_api_requests_total', **labels)
+        client.get('/blacklists/someone@example.com')
+        assert sample('blacklist_api_requests_total', **labels) == before + 1
+
+    def test_health_check_and_unmatched_routes(self, client):
+        """Test that function views use the endpoint name and unknown paths share one label."""
+        health = {'resource': 'health_check', 'method': 'GET', 'status': '200'}
+        unmatched = {'resource': 'unmatched', 'method': 'GET', 'status': '404'}
+        health_before = sample('blacklist_api_requests_total', **health)
+        unmatched_before = sample('blacklist_api_requests_total', **unmatched)
+
+        client.get('/')
+        client.get('/no/such/path')
+
+        assert sample('blacklist_api_requests_total', **health) == health_before + 1
+        assert sample('blacklist_api_requests_total', **unmatched) == unmatched_before + 1
+
+    def test_times_database_statements(self, client, auth_headers, sample_blacklist):
+        """Test that statements run by a request are timed by operation."""
+        before = sample('blacklist_api_db_statement_duration_seconds_count', operation='SELECT')
+        client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+        assert sample('blacklist_api_db_statement_duration_seconds_count', operation='SELECT') > before
+
+    def test_pool_connections_are_checked_in(self, client, auth_headers):
+        """Test that connections checked out by a request are returned afterwards."""
+        before = sample('blacklist_api_db_pool_checked_out')
+        client.get('/blacklists/someone@example.com', headers=auth_headers)
+        assert sample('blacklist_api_db_pool_checked_out') == before
+
+    def test_counts_lookup_cache_and_bloom_filter_results(self, client, auth_headers, sample_blacklist):
+        """Test that the per-worker lookup cache and Bloom filter counters are exported."""
+        def counts():
+            return [
+                sample('blacklist_api_lookup_cache_total', result='hit'),
+                sample('blacklist_api_lookup_cache_total', result='miss'),
+                sample('blacklist_api_bloom_filter_total', outcome='filtered'),
+                sample('blacklist_api_bloom_filter_total', outcome='db_fallback'),
+            ]
+        hits, misses, filtered, fallbacks = counts()
+
+        client.get('/blacklists/unknown@example.com', headers=auth_headers)
+        for _ in range(2):
+            client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+
+        assert counts() == [hits + 1, misses + 1, filtered + 1, fallbacks + 2]
+
+    def test_disabled(self, monkeypatch):
+        """Test that the endpoint can be turned off."""
+        from app import create_app
+        monkeypatch.setenv('DATABASE_URL', 'sqlite:///:memory:')
+        monkeypatch.setenv('METRICS_ENABLED', 'false')
+        app = create_app()
+        assert app.test_client().get('/metrics').status_code == 404
@@ -4,7 +4,8 @@ Unit tests for Blacklist model.
 import pytest
 from datetime import datetime
 from app import db
-from app.models import Blacklist
+from app.models import Blacklist, BlacklistStatus, rebuild_status, status_needs_backfill
+from app.normalize import email_key
 
 
 class TestBlacklistModel:
@@ -68,3 +69,65 @@ class TestBlacklistModel:
             ).order_by(Blacklist.created_at.desc()).first()
             
             assert entry.blocked_reason == 'second entry - most recent'
+
+
+class TestBlacklistStatus:
+    """Test cases for the materialized current-status table."""
+
+    def test_insert_creates_status(self, app, sample_blacklist):
+        """Test that each inserted email gets a status row."""
+        with app.app_context():
+            status = db.session.get(BlacklistStatus, email_key('blocked1@example.com'))
+            assert status.blocked_reason == 'spam'
+            assert status.app_uuid == 'app-001'
+            assert BlacklistStatus.query.count() == 3
+
+    def test_status_tracks_latest_entry(self, app, sample_blacklist):
+        """Test that the status holds the most recent entry of an email."""
+        with app.app_context():
+            status = db.session.get(BlacklistStatus, email_key('duplicate@example.com'))
+            assert status.blocked_reason == 'second entry - most recent'
+
+    def test_older_entry_does_not_replace_status(self, app, sample_blacklist):
+        """Test that a backdated entry does not override a newer status."""
+        with app.app_context():
+            db.session.add(Blacklist(
+                email='blocked1@example.com',
+                blocked_reason='backdated',
+                created_at=datetime(2000, 1, 1)
+            ))
+            db.session.commit()
+            assert db.session.get(BlacklistStatus, email_key('blocked1@example.com')).blocked_reason == 'spam'
+
+    def test_delete_recomputes_status(self, app, sample_blacklist):
+        """Test that deleting the latest entry falls back to the previous one."""
+        with app.app_context():
+            latest = Blacklist.query.filter_by(blocked_reason='second entry - most recent').one()
+            db.session.delete(latest)
+            db.session.commit()
+            assert db.session.get(BlacklistStatus, email_key('duplicate@example.com')).blocked_reason == 'first entry'
+
+            db.session.delete(Blacklist.query.filter_by(email='duplicate@example.com').one())
+            db.session.commit()
+            assert db.session.get(BlacklistStatus, email_key('duplicate@example.com')) is None
+
+    def test_update_recomputes_status(self, app, sample_blacklist):
+        """Test that changing an entry's email moves its status."""
+        with app.app_context():
+            entry = Blacklist.query.filter_by(email='blocked2@example.com').one()
+            entry.email = 'moved@example.com'
+            db.session.commit()
+            assert db.session.get(BlacklistStatus, email_key('blocked2@example.com')) is None
+            assert db.session.get(BlacklistStatus, email_key('moved@example.com')).blocked_reason == 'abuse'
+
+    def test_rebuild_status(self, app, sample_blacklist):
+        """Test that the status table can be rebuilt from the history."""
+        with app.app_context():
+            BlacklistStatus.query.delete()
+            db.session.commit()
+            assert status_needs_backfill()
+
+            assert rebuild_status() == 3
+            assert not status_needs_backfill()
+            status = db.session.get(BlacklistStatus, email_key('duplicate@example.com'))
+            assert status.blocked_reason == 'second entry - most recent'
@@ -0,0 +1,167 @@
+"""
+Unit tests for email normalization and the email_key column.
+"""
+import json
+import sqlite3
+import pytest
+from sqlalchemy import inspect
+from app import create_app, db
+from app.models import Blacklist, BlacklistStatus
+from app.normalize import EMAIL_KEY_SIZE, dedup_key, email_key, normalize_email
+from app.schema import migrate_email_key
+
+
+class TestNormalizeEmail:
+    """Test cases for the canonical email form."""
+
+    def test_trims_and_lowercases(self):
+        """Test that case and surrounding whitespace are ignored."""
+        assert normalize_email('  User@Example.COM ') == 'user@example.com'
+
+    def test_keeps_dots_and_tags_by_default(self):
+        """Test that provider rules are opt-in."""
+        assert normalize_email('first.last+tag@gmail.com') == 'first.last+tag@gmail.com'
+
+    def test_gmail_provider_rules(self):
+        """Test Gmail dot and plus handling."""
+        assert normalize_email('First.Last+promo@googlemail.com', provider_rules=True) == 'firstlast@gmail.com'
+
+    def test_provider_rules_leave_other_domains_alone(self):
+        """Test that dot/plus handling only applies to known providers."""
+        assert normalize_email('first.last+tag@example.com', provider_rules=True) == 'first.last+tag@example.com'
+
+
+class TestEmailKey:
+    """Test cases for the fixed-width email key."""
+
+    def test_fixed_width(self):
+        """Test that keys are 16-byte digests."""
+        assert len(email_key('a@example.com')) == EMAIL_KEY_SIZE
+        assert len(email_key('a' * 250 + '@example.com')) == EMAIL_KEY_SIZE
+
+    def test_dedup_key_keeps_missing_app_apart(self):
+        """Test that a missing app_uuid and an empty one are different upsert targets."""
+        assert dedup_key('a@example.com', None) != dedup_key('a@example.com', '')
+        assert dedup_key('a@example.com', 'app') == dedup_key('A@example.com', 'app')
+
+    def test_case_variants_share_a_key(self):
+        """Test that spellings of the same address share a key."""
+        assert email_key('User@Example.com') == email_key('user@example.com')
+        assert email_key('a@example.com') != email_key('b@example.com')
+
+    def test_provider_rules_from_config(self, app):
+        """Test that the app's EMAIL_PROVIDER_RULES setting is applied."""
+        app.config['EMAIL_PROVIDER_RULES'] = True
+        assert email_key('f.l+x@gmail.com') == email_key('fl@gmail.com')
+
+    def test_model_sets_key(self, app):
+        """Test that the key is derived when a row is created."""
+        entry = Blacklist(email='Mixed@Example.com')
+        assert entry.email_key == email_key('mixed@example.com')
+
+    def test_core_insert_sets_key(self, app):
+        """Test that inserts outside the ORM also get a key."""
+        db.session.execute(Blacklist.__table__.insert().values(email='Core@Example.com'))
+        db.session.commit()
+        assert Blacklist.query.one().email_key == email_key('core@example.com')
+
+
+class TestCaseInsensitiveLookups:
+    """Test cases for lookups across spellings of an address."""
+
+    def test_lookup_matches_case_variants(self, client, auth_headers):
+        """Test that a blocked address is found in any case."""
+        client.post(
+            '/blacklists',
+            data=json.dumps({'email': 'User@Example.com', 'blocked_reason': 'spam'}),
+            headers=auth_headers
+        )
+        for variant in ('user@example.com', 'USER@EXAMPLE.COM', 'User@Example.com'):
+            response = client.get(f'/blacklists/{variant}', headers=auth_headers)
+            assert response.json == {'blocked': True, 'reason': 'spam'}
+
+    def test_batch_lookup_keeps_requested_spelling(self, client, auth_headers, sample_blacklist):
+        """Test that batch results are keyed by the emails as sent."""
+        response = client.post(
+            '/blacklists/lookup',
+            data=json.dumps({'emails': ['BLOCKED1@example.com', 'blocked1@example.com']}),
+            headers=auth_headers
+        )
+        assert response.json['results'] == {
+            'BLOCKED1@example.com': {'blocked': True, 'reason': 'spam'},
+            'blocked1@example.com': {'blocked': True, 'reason': 'spam'},
+        }
+
+
+class TestEmailKeyMigration:
+    """Test cases for upgrading databases created before email_key."""
+
+    @pytest.fixture
+    def legacy_db(self, tmp_path, monkeypatch):
+        """Create a database with the schema of earlier versions."""
+        path = tmp_path / 'legacy.db'
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE blacklists (
+                id INTEGER PRIMARY KEY, email VARCHAR(255) NOT NULL, app_uuid VARCHAR(255),
+                blocked_reason VARCHAR(1024), ip_address VARCHAR(45), request_date DATETIME,
+                created_at DATETIME
+            );
+            CREATE INDEX ix_blacklists_email ON blacklists (email);
+            CREATE TABLE blacklist_status (
+                email VARCHAR(255) PRIMARY KEY, app_uuid VARCHAR(255),
+                blocked_reason VARCHAR(1024), updated_at DATETIME NOT NULL
+            );
+            INSERT INTO blacklists (email, blocked_reason, created_at)
+                VALUES ('Old@Example.com', 'legacy', '2020-01-01 00:00:00');
+        """)
+        conn.close()
+        monkeypatch.setenv('DATABASE_URL', f'sqlite:///{path}')
+        monkeypatch.setenv('STATIC_BEARER_TOKEN', 'test-token')
+        return path
+
+    def test_startup_migrates_legacy_schema(self, legacy_db, auth_headers):
+        """Test that a legacy database is re-keyed and re-indexed."""
+        app = create_app()
+        with app.app_context():
+            indexes = {index['name'] for index in inspect(db.engine).get_indexes('blacklists')}
+            assert 'ix_blacklists_email_key' in indexes
+            assert 'ix_blacklists_email' not in indexes
+            assert db.session.get(BlacklistStatus, email_key('old@example.com')).blocked_reason == 'legacy'
+
+        response = app.test_client().get('/blacklists/OLD@example.com', headers=auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'legacy'}
+
+    def test_migration_recomputes_keys_for_new_rules(self, legacy_db):
+        """Test that re-running the migration applies changed provider rules."""
+        app = create_app()
+        with app.app_context():
+            db.session.add(Blacklist(email='f.l+x@gmail.com'))
+            db.session.commit()
+            assert migrate_email_key() == 0
+
+            app.config['EMAIL_PROVIDER_RULES'] = True
+            assert migrate_email_key() == 1
+            assert db.session.get(BlacklistStatus, email_key('fl@gmail.com')) is not None
+
+    def test_migration_recomputes_upsert_keys(self, legacy_db, auth_headers):
+        """Test that upserts still match their entry after the rules change, the newest of merged ones."""
+        app = create_app()
+        client = app.test_client()
+        for email, reason in (('f.l+x@gmail.com', 'older'), ('fl@gmail.com', 'newer'), ('a.b@gmail.com', 'other')):
+            client.post('/blacklists', headers=auth_headers, data=json.dumps(
+                {'email': email, 'app_uuid': 'app-1', 'blocked_reason': reason, 'upsert': True},
+            ))
+        with app.app_context():
+            app.config['EMAIL_PROVIDER_RULES'] = True
+            migrate_email_key()
+            keyed = Blacklist.query.filter(Blacklist.dedup_key.isnot(None)).order_by(Blacklist.id).all()
+            assert [row.blocked_reason for row in keyed] == ['newer', 'other']
+            assert keyed[0].dedup_key == dedup_key('fl@gmail.com', 'app-1')
+
+        client.post('/blacklists', headers=auth_headers, data=json.dumps(
+            {'email': 'ab@gmail.com', 'app_uuid': 'app-1', 'blocked_reason': 'updated', 'upsert': True},
+        ))
+        with app.app_context():
+            assert Blacklist.query.filter_by(blocked_reason='updated').one().email == 'ab@gmail.com'
+            assert Blacklist.query.count() == 4
@@ -0,0 +1,141 @@
+"""
+Unit tests for domain and subdomain patterns.
+"""
+import json
+import pytest
+from app import db
+from app.models import BlacklistPattern
+from app.patterns import DomainTrie, PatternIndex, parse_pattern
+
+
+class TestParsePattern:
+    """Test cases for recognizing patterns."""
+
+    def test_domain(self):
+        """Test a whole-domain pattern."""
+        assert parse_pattern('*@Mailinator.com') == ('mailinator.com', False)
+
+    def test_subdomains(self):
+        """Test a subdomain pattern."""
+        assert parse_pattern('*@*.tempmail.io') == ('tempmail.io', True)
+
+    def test_invalid(self):
+        """Test that anything else is rejected."""
+        for value in ('user@example.com', '*@', '*@*', '*@foo..com', '*@*.*.com', 'a*@example.com'):
+            assert parse_pattern(value) is None
+
+
+class TestDomainTrie:
+    """Test cases for the reversed-label trie."""
+
+    @pytest.fixture
+    def trie(self):
+        trie = DomainTrie()
+        trie.add('mailinator.com', False, 'exact')
+        trie.add('tempmail.io', True, 'subdomains')
+        trie.add('eu.tempmail.io', False, 'eu exact')
+        return trie
+
+    def test_exact_domain(self, trie):
+        """Test that *@domain matches only the domain itself."""
+        assert trie.match('mailinator.com') == 'exact'
+        assert trie.match('x.mailinator.com') is None
+
+    def test_subdomains(self, trie):
+        """Test that *@*.domain matches subdomains at any depth but not the domain."""
+        assert trie.match('a.tempmail.io') == 'subdomains'
+        assert trie.match('a.b.tempmail.io') == 'subdomains'
+        assert trie.match('tempmail.io') is None
+
+    def test_most_specific_pattern_wins(self, trie):
+        """Test that an exact pattern below a wildcard takes precedence."""
+        assert trie.match('eu.tempmail.io') == 'eu exact'
+        assert trie.match('x.eu.tempmail.io') == 'subdomains'
+
+    def test_unrelated_domains(self, trie):
+        """Test domains sharing only a suffix or a label."""
+        assert trie.match('com') is None
+        assert trie.match('notmailinator.com') is None
+        assert trie.match('tempmail.io.evil.com') is None
+
+
+class TestPatternLookups:
+    """Test cases for patterns on the API."""
+
+    def post(self, client, auth_headers, email, reason='disposable'):
+        return client.post(
+            '/blacklists',
+            data=json.dumps({'email': email, 'blocked_reason': reason}),
+            headers=auth_headers
+        )
+
+    def test_post_pattern(self, client, auth_headers, app):
+        """Test that a pattern is stored apart from exact entries."""
+        response = self.post(client, auth_headers, '*@*.TempMail.io')
+
+        assert response.status_code == 201
+        pattern = BlacklistPattern.query.one()
+        assert (pattern.pattern, pattern.domain, pattern.include_subdomains) == \
+            ('*@*.tempmail.io', 'tempmail.io', True)
+
+    def test_post_invalid_pattern(self, client, auth_headers):
+        """Test that malformed patterns are rejected."""
+        response = self.post(client, auth_headers, '*@bad..domain')
+        assert response.status_code == 400
+
+    def test_lookup_matches_pattern(self, client, auth_headers):
+        """Test that any address at a blocked domain is reported as blocked."""
+        self.post(client, auth_headers, '*@mailinator.com')
+
+        response = client.get('/blacklists/anyone@Mailinator.com', headers=auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'disposable'}
+        response = client.get('/blacklists/anyone@example.com', headers=auth_headers)
+        assert response.json == {'blocked': False, 'reason': None}
+
+    def test_batch_lookup_matches_pattern(self, client, auth_headers, sample_blacklist):
+        """Test that batch lookups combine patterns with exact entries."""
+        self.post(client, auth_headers, '*@*.tempmail.io')
+        response = client.post(
+            '/blacklists/lookup',
+            data=json.dumps({'emails': ['x@a.tempmail.io', 'blocked1@example.com', 'clean@example.com']}),
+            headers=auth_headers
+        )
+        assert response.json['results'] == {
+            'x@a.tempmail.io': {'blocked': True, 'reason': 'disposable'},
+            'blocked1@example.com': {'blocked': True, 'reason': 'spam'},
+            'clean@example.com': {'blocked': False, 'reason': None},
+        }
+
+    def test_refresh_picks_up_other_workers_patterns(self, app):
+        """Test that patterns inserted elsewhere are added past the watermark."""
+        index = PatternIndex(refresh_interval=0)
+        index.rebuild()
+        db.session.add(BlacklistPattern(pattern='*@spam.org', domain='spam.org', blocked_reason=None))
+        db.session.commit()
+
+        assert index.match('a@spam.org') == (True, None)
+        assert index.stats() == {'patterns': 1, 'watermark': 1}
+
+    def test_refresh_picks_up_patterns_committed_out_of_id_order(self, app):
+        """Test that a pattern committed after one with a higher id is not skipped."""
+        index = PatternIndex(refresh_interval=0)
+        index.rebuild()
+        db.session.add(BlacklistPattern(id=11, pattern='*@later.org', domain='later.org'))
+        db.session.commit()
+        assert index.match('a@later.org') == (True, None)
+        # a transaction that drew id 10 before id 11 was drawn commits last
+        db.session.add(BlacklistPattern(id=10, pattern='*@earlier.org', domain='earlier.org'))
+        db.session.commit()
+
+        assert index.match('a@earlier.org') == (True, None)
+        assert index.stats() == {'patterns': 2, 'watermark': 11}
+
+    def test_bulk_rejects_patterns(self, client, auth_headers):
+        """Test that bulk ingestion does not store patterns as literal emails."""
+        response = client.post(
+            '/blacklists/bulk',
+            data=json.dumps([{'email': '*@mailinator.com'}, {'email': 'ok@example.com'}]),
+            headers=auth_headers
+        )
+        assert response.json['inserted'] == 1
+        assert response.json['errors'][0]['index'] == 0
@@ -0,0 +1,132 @@
+"""
+Unit tests for sampled request profiling.
+"""
+import cProfile
+import os
+import pstats
+import pytest
+from app import create_app, db
+from app.profiling import ProfileStore, collapsed_stacks
+
+
+@pytest.fixture
+def profiled_app(tmp_path, monkeypatch):
+    """App that profiles every request into a temporary directory."""
+    monkeypatch.setenv('DATABASE_URL', 'sqlite:///:memory:')
+    monkeypatch.setenv('STATIC_BEARER_TOKEN', 'test-token')
+    monkeypatch.setenv('PROFILING_ENABLED', 'true')
+    monkeypatch.setenv('PROFILING_SAMPLE_RATE', '1')
+    monkeypatch.setenv('PROFILING_DIR', str(tmp_path / 'profiles'))
+    monkeypatch.setenv('PROFILING_MAX_FILES', '3')
+    monkeypatch.setenv('PROFILING_TOKEN', 'profile-me')
+    app = create_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def get(client, url, **kwargs):
+    """GET ``url`` and consume the body, which is when a server ends the profile."""
+    response = client.get(url, **kwargs)
+    response.get_data()
+    return response
+
+
+def _work(n):
+    return sum(i * i for i in range(n))
+
+
+class TestCollapsedStacks:
+    """Test cases for folding cProfile call graphs."""
+
+    def test_stacks_reach_callees(self):
+        """Test that callee time appears under its caller's stack."""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _work(20000)
+        profiler.disable()
+
+        stacks = collapsed_stacks(pstats.Stats(profiler))
+        assert any('_work (test_profiling.py' in stack and '<genexpr>' in stack for stack in stacks)
+        assert all(micros > 0 for micros in stacks.values())
+
+
+class TestProfileStore:
+    """Test cases for the on-disk ring buffer."""
+
+    def test_keeps_newest_profiles(self, tmp_path):
+        """Test that old profiles are deleted in pairs."""
+        store = ProfileStore(str(tmp_path), max_files=2)
+        names = []
+        for _ in range(4):
+            profiler = cProfile.Profile()
+            profiler.runcall(_work, 100)
+            names.append(store.save(profiler, 'GET', '/blacklists/user@example.com', 0.0123))
+
+        assert sorted(os.listdir(tmp_path)) == sorted(
+            name + suffix for name in names[2:] for suffix in ('.prof', '.collapsed')
+        )
+        assert names[0].endswith('-GET-blacklists_email-12ms')
+
+
+class TestProfilingMiddleware:
+    """Test cases for profiling requests."""
+
+    def test_sampled_requests_are_profiled(self, profiled_app, auth_headers):
+        """Test that a sampled request leaves a loadable profile."""
+        client = profiled_app.test_client()
+        response = get(client, '/blacklists/user@example.com', headers=auth_headers)
+        assert response.json == {'blocked': False, 'reason': None}
+
+        listing = get(client, '/debug/profiles', headers=auth_headers)
+        names = [entry['name'] for entry in listing.json['profiles']]
+        # the listing request itself has not been written yet
+        assert len(names) == 2
+        prof = next(name for name in names if name.endswith('.prof'))
+
+        response = get(client, f'/debug/profiles/{prof}', headers=auth_headers)
+        assert response.status_code == 200
+        path = os.path.join(profiled_app.config['PROFILING_DIR'], prof)
+        assert pstats.Stats(path).total_tt > 0
+
+    def test_ring_buffer(self, profiled_app, auth_headers):
+        """Test that only PROFILING_MAX_FILES profiles are kept."""
+        client = profiled_app.test_client()
+        for i in range(5):
+            get(client, f'/blacklists/user{i}@example.com', headers=auth_headers)
+        assert len(os.listdir(profiled_app.config['PROFILING_DIR'])) == 6
+
+    def test_privileged_header(self, profiled_app, auth_headers):
+        """Test that the profiling token forces a profile regardless of sampling."""
+        middleware = profiled_app.extensions['profiler']
+        middleware.sample_rate = 0
+        client = profiled_app.test_client()
+        get(client, '/', headers={'X-Profile': 'wrong'})
+        assert middleware.profiled == 0
+        get(client, '/', headers={'X-Profile': 'profile-me'})
+        assert middleware.profiled == 1
+
+    def test_non_ascii_header(self, profiled_app):
+        """Test that a non-ASCII profiling header is treated as a wrong token."""
+        middleware = profiled_app.extensions['profiler']
+        middleware.sample_rate = 0
+        response = profiled_app.test_client().get('/', headers={'X-Profile': 'café'})
+        assert response.status_code != 500
+        assert middleware.profiled == 0
+
+    def test_endpoints_require_token(self, profiled_app):
+        """Test that profiles cannot be listed or downloaded anonymously."""
+        client = profiled_app.test_client()
+        assert get(client, '/debug/profiles').status_code == 401
+        assert get(client, '/debug/profiles/x.prof').status_code == 401
+
+    def test_only_profiles_are_served(self, profiled_app, auth_headers):
+        """Test that the download endpoint does not serve other files."""
+        client = profiled_app.test_client()
+        assert get(client, '/debug/profiles/../../etc/passwd', headers=auth_headers).status_code == 404
+        assert get(client, '/debug/profiles/missing.prof', headers=auth_headers).status_code == 404
+
+    def test_disabled_by_default(self, app):
+        """Test that nothing is installed unless profiling is enabled."""
+        assert 'profiler' not in app.extensions
+        assert get(app.test_client(), '/debug/profiles').status_code == 404
@@ -0,0 +1,118 @@
+"""
+Unit tests for the slow query log, request query stats and query budgets.
+"""
+import json
+import logging
+import pytest
+from app import create_app, db
+from app.querylog import redact
+
+
+class TestRedact:
+    """Test cases for hiding parameter values."""
+
+    def test_values_become_types(self):
+        """Test that emails and keys never reach the log."""
+        assert redact(('user@example.com', b'\x00' * 16, 5, None)) == ['<str:16>', '<bytes:16>', '<int>', None]
+        assert redact({'email_1': 'user@example.com'}) == {'email_1': '<str:16>'}
+
+
+class TestSlowQueryLog:
+    """Test cases for logging slow statements."""
+
+    @pytest.fixture
+    def explaining_app(self, monkeypatch):
+        """App logging every statement as slow, with its plan."""
+        monkeypatch.setenv('DATABASE_URL', 'sqlite:///:memory:')
+        monkeypatch.setenv('SLOW_QUERY_THRESHOLD_MS', '0')
+        monkeypatch.setenv('SLOW_QUERY_EXPLAIN', 'true')
+        app = create_app()
+        with app.app_context():
+            yield app
+            db.session.remove()
+
+    def test_slow_query_is_logged_redacted(self, explaining_app, caplog):
+        """Test that statements over the threshold are logged without their values."""
+        with caplog.at_level(logging.WARNING, logger='app.querylog'):
+            db.session.execute(db.text('SELECT * FROM blacklists WHERE email = :email'),
+                               {'email': 'secret@example.com'})
+        messages = [record.getMessage() for record in caplog.records]
+        assert any('Slow query' in message and '<str:18>' in message for message in messages)
+        assert not any('secret@example.com' in message for message in messages)
+        assert any('plan:' in message and 'SCAN' in message for message in messages)
+
+    def test_fast_queries_are_not_logged(self, app, caplog):
+        """Test that the default threshold keeps ordinary statements out of the log."""
+        with caplog.at_level(logging.WARNING, logger='app.querylog'):
+            db.session.execute(db.text('SELECT 1'))
+        assert not caplog.records
+
+
+class TestRequestStats:
+    """Test cases for per-request statement counts."""
+
+    def test_stats_logged_per_request(self, client, auth_headers, sample_blacklist, caplog):
+        """Test that each request logs its statement count and time."""
+        client.application.extensions['bloom_filter'] = None
+        with caplog.at_level(logging.DEBUG, logger='app.querylog'):
+            client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+        assert any('GET /blacklists/blocked1@example.com 200: 1 queries' in record.getMessage()
+                   for record in caplog.records)
+
+    def test_app_log_records_carry_stats(self, client, app, caplog):
+        """Test that app.logger records get query_count and query_ms attributes."""
+        @app.route('/log-test')
+        def log_test():
+            db.session.execute(db.text('SELECT 1'))
+            app.logger.warning('inside request')
+            return 'ok'
+
+        with caplog.at_level(logging.WARNING):
+            client.get('/log-test')
+        record = next(record for record in caplog.records if record.getMessage() == 'inside request')
+        assert record.query_count == 1
+        assert record.query_ms >= 0
+
+
+class TestQueryBudgets:
+    """Query budgets of the hot endpoints."""
+
+    def test_lookup_hit_is_one_query(self, client, auth_headers, sample_blacklist, assert_max_queries):
+        """Test that a lookup past the Bloom filter is one primary key read."""
+        with assert_max_queries(1):
+            response = client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+        assert response.json['blocked'] is True
+
+    def test_lookup_miss_is_free(self, client, auth_headers, sample_blacklist, assert_max_queries):
+        """Test that the Bloom filter answers unknown emails without the database."""
+        with assert_max_queries(0):
+            client.get('/blacklists/unknown@example.com', headers=auth_headers)
+
+    def test_cached_lookup_is_free(self, client, auth_headers, sample_blacklist, assert_max_queries):
+        """Test that a repeated lookup is served from the cache."""
+        client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+        with assert_max_queries(0):
+            client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+
+    def test_batch_lookup_is_one_query(self, client, auth_headers, sample_blacklist, assert_max_queries):
+        """Test that a batch below the IN chunk size is one query."""
+        emails = ['blocked1@example.com', 'blocked2@example.com', 'duplicate@example.com']
+        with assert_max_queries(1):
+            client.post('/blacklists/lookup', data=json.dumps({'emails': emails}), headers=auth_headers)
+
+    def test_listing_is_one_query(self, client, auth_headers, sample_blacklist, assert_max_queries):
+        """Test that a page of the listing is one query."""
+        with assert_max_queries(1):
+            client.get('/blacklists?limit=2', headers=auth_headers)
+
+    def test_post_budget(self, client, auth_headers, assert_max_queries):
+        """Test that adding an entry is the insert, the status and stats upserts, the change and the reload."""
+        with assert_max_queries(5):
+            client.post('/blacklists', data=json.dumps({'email': 'new@example.com'}), headers=auth_headers)
+
+    def test_budget_failure_lists_statements(self, app, assert_max_queries):
+        """Test that exceeding a budget fails with the statements that ran."""
+        with pytest.raises(AssertionError, match='2 queries, budget 1'):
+            with assert_max_queries(1):
+                db.session.execute(db.text('SELECT 1'))
+                db.session.execute(db.text('SELECT 2'))
@@ -0,0 +1,120 @@
+"""
+Unit tests for routing reads to a read replica, using two SQLite files.
+"""
+import json
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+
+from app import create_app, db
+from app.models import Blacklist
+from app.normalize import email_key
+from app.replica import WRITE_COOKIE
+
+
+@pytest.fixture
+def replica_app(tmp_path, monkeypatch):
+    """App whose replica holds one entry the primary does not, so reads show where they went."""
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setenv('DATABASE_READ_URL', f"sqlite:///{tmp_path / 'replica.db'}")
+    monkeypatch.setenv('STATIC_BEARER_TOKEN', 'test-token')
+    monkeypatch.setenv('BLOOM_FILTER_ENABLED', 'false')
+    monkeypatch.setenv('LOOKUP_CACHE_TTL', '0')
+    app = create_app()
+    monitor = app.extensions['read_replica']
+    db.metadata.create_all(monitor.engine)
+    with monitor.engine.begin() as conn:
+        conn.execute(Blacklist.__table__.insert(), [
+            {'id': 1, 'email': 'replica@example.com', 'email_key': b'r' * 16,
+             'created_at': datetime.utcnow(), 'request_date': datetime.utcnow()},
+        ])
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+        monitor.engine.dispose()
+
+
+def listed(client, auth_headers):
+    response = client.get('/blacklists', headers=auth_headers)
+    return [item['email'] for item in response.json['items']]
+
+
+class TestReadRouting:
+    """Test cases for choosing the primary or the replica."""
+
+    def test_reads_go_to_replica(self, replica_app, auth_headers):
+        """Test that listing is served by the replica when it is current."""
+        assert listed(replica_app.test_client(), auth_headers) == ['replica@example.com']
+
+    def test_writes_go_to_primary(self, replica_app, auth_headers):
+        """Test that writes land on the primary and set the read-your-writes cookie."""
+        client = replica_app.test_client()
+        response = client.post('/blacklists', data=json.dumps({'email': 'new@example.com'}),
+                               headers=auth_headers)
+        assert response.status_code == 201
+        assert WRITE_COOKIE in response.headers['Set-Cookie']
+        assert [row.email for row in Blacklist.query.all()] == ['new@example.com']
+
+    def test_read_your_writes(self, replica_app, auth_headers):
+        """Test that a client reads from the primary right after its own write."""
+        client = replica_app.test_client()
+        client.post('/blacklists', data=json.dumps({'email': 'new@example.com'}), headers=auth_headers)
+        assert listed(client, auth_headers) == ['new@example.com']
+        # other clients, and this one once the window has passed, use the replica again
+        assert listed(replica_app.test_client(), auth_headers) == ['replica@example.com']
+        replica_app.config['READ_YOUR_WRITES_WINDOW'] = 0
+        assert listed(client, auth_headers) == ['replica@example.com']
+
+    def test_lagging_replica_falls_back(self, replica_app, auth_headers):
+        """Test that reads use the primary once the replica is too far behind."""
+        db.session.add(Blacklist(email='old@example.com', created_at=datetime.utcnow() - timedelta(minutes=1)))
+        db.session.add(Blacklist(email='older@example.com', created_at=datetime.utcnow() - timedelta(minutes=2)))
+        db.session.commit()
+        monitor = replica_app.extensions['read_replica']
+
+        # the replica has id 1, so the primary's id 2 is the oldest missing write
+        assert monitor.check() == pytest.approx(120, abs=5)
+        assert listed(replica_app.test_client(), auth_headers) == ['old@example.com', 'older@example.com']
+
+    def test_unreachable_replica_falls_back(self, replica_app, auth_headers):
+        """Test that reads use the primary when the replica cannot be queried."""
+        monitor = replica_app.extensions['read_replica']
+        with monitor.engine.begin() as conn:
+            conn.execute(text('DROP TABLE blacklists'))
+        assert monitor.check() is None
+        assert listed(replica_app.test_client(), auth_headers) == []
+
+    def test_lookup_uses_replica(self, replica_app, auth_headers):
+        """Test that single lookups read the status table of the replica."""
+        monitor = replica_app.extensions['read_replica']
+        with monitor.engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO blacklist_status (email_key, email, blocked_reason, updated_at) "
+                "VALUES (:key, 'replica@example.com', 'spam', :now)"
+            ), {'key': email_key('replica@example.com'), 'now': datetime.utcnow()})
+        response = replica_app.test_client().get('/blacklists/replica@example.com', headers=auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'spam'}
+
+    def test_lookup_after_write_skips_replica_cache(self, replica_app, auth_headers):
+        """Test that a client's lookup after its write is not answered from a result cached off the replica."""
+        replica_app.extensions['lookup_cache'].ttl = 30
+        writer = replica_app.test_client()
+        writer.post('/blacklists', data=json.dumps({'email': 'x@example.com'}), headers=auth_headers)
+
+        # the replica has not received the write yet; its answer is cached
+        response = replica_app.test_client().get('/blacklists/x@example.com', headers=auth_headers)
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.json['blocked'] is False
+
+        response = writer.get('/blacklists/x@example.com', headers=auth_headers)
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.json['blocked'] is True
+        replica_app.extensions['lookup_cache'].set(email_key('x@example.com'), (False, None))
+        response = writer.post('/blacklists/lookup', data=json.dumps({'emails': ['x@example.com']}),
+                               headers=auth_headers)
+        assert response.json['results']['x@example.com']['blocked'] is True
+
+    def test_disabled_without_read_url(self, app):
+        """Test that everything uses the primary by default."""
+        assert 'read_replica' not in app.extensions
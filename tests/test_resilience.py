@@ -0,0 +1,265 @@
+"""
+Unit tests for stale-while-revalidate lookups and the lookup circuit breaker.
+"""
+import json
+import logging
+import time
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.models import BlacklistStatus
+from app.normalize import email_key
+from app.resilience import CircuitBreaker, CircuitOpen
+from app.snapshot import write_snapshot
+
+
+class FakeClock:
+    """Manually advanced clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def failing():
+    raise OperationalError('SELECT 1', {}, Exception('server closed the connection'))
+
+
+class TestCircuitBreaker:
+    """Test cases for the CircuitBreaker class."""
+
+    def test_opens_after_consecutive_failures(self):
+        """Test that the breaker opens after ``failures`` errors in a row and then rejects calls."""
+        breaker = CircuitBreaker(failures=2, errors=(OperationalError,))
+        for _ in range(2):
+            with pytest.raises(OperationalError):
+                breaker.call(failing)
+        assert breaker.is_open
+        with pytest.raises(CircuitOpen):
+            breaker.call(lambda: 'not called')
+        assert breaker.stats() == {'state': 'open', 'consecutive_failures': 2, 'trips': 1, 'rejected': 1}
+
+    def test_success_resets_the_count(self):
+        """Test that only consecutive failures count."""
+        breaker = CircuitBreaker(failures=2, errors=(OperationalError,))
+        with pytest.raises(OperationalError):
+            breaker.call(failing)
+        assert breaker.call(lambda: 'ok') == 'ok'
+        with pytest.raises(OperationalError):
+            breaker.call(failing)
+        assert not breaker.is_open
+
+    def test_trial_call_after_reset_timeout(self):
+        """Test that one trial call closes the breaker again, or reopens it on failure."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failures=1, reset_timeout=10, errors=(OperationalError,), clock=clock)
+        with pytest.raises(OperationalError):
+            breaker.call(failing)
+        clock.now = 10.0
+        assert not breaker.is_open
+        with pytest.raises(OperationalError):
+            breaker.call(failing)
+        with pytest.raises(CircuitOpen) as excinfo:
+            breaker.call(lambda: 'not called')
+        assert excinfo.value.retry_after == 10.0
+        clock.now = 20.0
+        assert breaker.call(lambda: 'ok') == 'ok'
+        assert breaker.stats()['state'] == 'closed'
+
+    def test_slow_calls_count_as_failures(self):
+        """Test that calls slower than ``slow_call`` trip the breaker but still return."""
+        breaker = CircuitBreaker(failures=1, slow_call=0.01)
+        assert breaker.call(lambda: time.sleep(0.02) or 'slow') == 'slow'
+        assert breaker.is_open
+
+    def test_other_errors_do_not_count(self):
+        """Test that errors outside ``errors`` propagate without tripping the breaker."""
+        breaker = CircuitBreaker(failures=1, errors=(OperationalError,))
+        with pytest.raises(KeyError):
+            breaker.call(lambda: {}['missing'])
+        assert not breaker.is_open
+
+
+@pytest.fixture
+def clock(app):
+    """Drive the lookup cache of ``app`` with a fake clock."""
+    fake = FakeClock()
+    app.extensions['lookup_cache']._clock = fake
+    return fake
+
+
+def get(client, auth_headers, email='blocked1@example.com'):
+    return client.get(f'/blacklists/{email}', headers=auth_headers)
+
+
+def wait_for_refresh(app, count=1):
+    revalidator = app.extensions['lookup_revalidator']
+    deadline = time.monotonic() + 5
+    while revalidator.stats()['refreshed'] + revalidator.stats()['failed'] < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+class TestStaleWhileRevalidate:
+    """Test cases for serving stale cache entries while refreshing them."""
+
+    def test_cache_headers(self, client, auth_headers, sample_blacklist, clock):
+        """Test that responses tell a database read from a cached one and its age."""
+        response = get(client, auth_headers)
+        assert response.headers['X-Cache'] == 'MISS'
+        assert 'Age' not in response.headers
+        clock.now = 12.5
+        response = get(client, auth_headers)
+        assert (response.headers['X-Cache'], response.headers['Age']) == ('HIT', '12')
+        assert 'Warning' not in response.headers
+
+    def test_stale_entry_served_and_refreshed(self, app, client, auth_headers, sample_blacklist, clock):
+        """Test that an expired entry is answered at once and refreshed in the background."""
+        get(client, auth_headers)
+        db.session.get(BlacklistStatus, email_key('blocked1@example.com')).blocked_reason = 'fraud'
+        db.session.commit()
+        clock.now = app.config['LOOKUP_CACHE_TTL'] + 1
+        response = get(client, auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'spam'}
+        assert response.headers['X-Cache'] == 'STALE'
+        assert response.headers['Warning'] == '110 - "Response is Stale"'
+        wait_for_refresh(app)
+        response = get(client, auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'fraud'}
+        assert response.headers['X-Cache'] == 'HIT'
+
+    def test_entries_past_stale_ttl_are_read_again(self, app, client, auth_headers, sample_blacklist, clock):
+        """Test that entries older than ``LOOKUP_CACHE_STALE_TTL`` are not served."""
+        get(client, auth_headers)
+        clock.now = app.config['LOOKUP_CACHE_TTL'] + app.config['LOOKUP_CACHE_STALE_TTL']
+        assert get(client, auth_headers).headers['X-Cache'] == 'MISS'
+
+
+class TestDatabaseFailures:
+    """Test cases for lookups while the database fails."""
+
+    @pytest.fixture
+    def broken(self, monkeypatch):
+        """Make every database lookup fail; return the list of attempts."""
+        calls = []
+
+        def load(key, cache):
+            calls.append(key)
+            failing()
+
+        monkeypatch.setattr('app.lookup._load', load)
+        return calls
+
+    def test_error_mode(self, client, auth_headers, sample_blacklist, broken):
+        """Test that a failed lookup without a cached result answers 503 by default."""
+        response = get(client, auth_headers)
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
+
+    @pytest.mark.parametrize('mode, blocked', [('open', False), ('closed', True)])
+    def test_fail_open_and_closed(self, app, client, auth_headers, sample_blacklist, broken, mode, blocked):
+        """Test the configured answer when there is no cached result."""
+        app.config['LOOKUP_FAIL_MODE'] = mode
+        response = get(client, auth_headers)
+        assert response.status_code == 200
+        assert response.json == {'blocked': blocked, 'reason': None}
+        assert response.headers['X-Cache'] == 'FALLBACK'
+        assert response.headers['Warning'] == f'199 - "Database unavailable; fail-{mode} answer"'
+        assert len(app.extensions['lookup_cache']) == 0
+
+    def test_breaker_stops_queries(self, app, client, auth_headers, sample_blacklist, broken):
+        """Test that lookups stop reaching the database once the breaker opens."""
+        app.config['LOOKUP_FAIL_MODE'] = 'open'
+        for _ in range(app.config['LOOKUP_BREAKER_FAILURES'] + 3):
+            get(client, auth_headers)
+        assert len(broken) == app.config['LOOKUP_BREAKER_FAILURES']
+        assert app.extensions['lookup_breaker'].is_open
+
+    def test_stale_entry_while_breaker_open(self, app, client, auth_headers, sample_blacklist, clock):
+        """Test that an open breaker serves stale entries without trying to refresh them."""
+        get(client, auth_headers)
+        breaker = app.extensions['lookup_breaker']
+        for _ in range(breaker.failures):
+            with pytest.raises(OperationalError):
+                breaker.call(failing)
+        clock.now = app.config['LOOKUP_CACHE_TTL'] + 1
+        response = get(client, auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'spam'}
+        assert response.headers['X-Cache'] == 'STALE'
+        assert response.headers['Warning'] == '111 - "Revalidation Failed"'
+        assert app.extensions['lookup_revalidator'].stats()['pending'] == 0
+
+    def test_invalid_fail_mode(self, monkeypatch):
+        """Test that an unknown LOOKUP_FAIL_MODE is rejected at startup."""
+        monkeypatch.setenv('DATABASE_URL', 'sqlite:///:memory:')
+        monkeypatch.setenv('LOOKUP_FAIL_MODE', 'maybe')
+        with pytest.raises(ValueError):
+            create_app()
+
+
+class TestDatabaseDown:
+    """Test cases for lookups once the database itself is unreachable."""
+
+    @pytest.fixture
+    def down_app(self, tmp_path, monkeypatch):
+        """App with the Bloom filter, patterns and snapshot; call ``take_down()`` to cut off its database."""
+        monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'blacklist.db'}")
+        monkeypatch.setenv('STATIC_BEARER_TOKEN', 'test-token')
+        monkeypatch.setenv('SNAPSHOT_PATH', str(tmp_path / 'snapshot.bin'))
+        app = create_app()
+        with app.app_context():
+            engine = db.engine
+
+            def take_down():
+                db.session.remove()
+                engine.dispose()
+                engine.pool = create_engine(f"sqlite:///{tmp_path / 'gone' / 'blacklist.db'}").pool
+                for name in ('bloom_filter', 'blacklist_patterns', 'blacklist_snapshot'):
+                    app.extensions[name].refresh_interval = 0
+
+            app.take_down = take_down
+            yield app
+            db.session.remove()
+            engine.dispose()
+
+    def seed(self, client, auth_headers):
+        for email, reason in (('blocked1@example.com', 'spam'), ('blocked2@example.com', 'abuse'),
+                              ('*@spam.test', 'domain')):
+            client.post('/blacklists', data=json.dumps({'email': email, 'blocked_reason': reason}),
+                        headers=auth_headers)
+
+    def test_fast_paths_keep_their_state(self, down_app, auth_headers, caplog):
+        """Test that failed refreshes of the in-memory paths keep answering lookups."""
+        client = down_app.test_client()
+        self.seed(client, auth_headers)
+        write_snapshot(down_app.config['SNAPSHOT_PATH'])
+        assert get(client, auth_headers).json == {'blocked': True, 'reason': 'spam'}
+        down_app.take_down()
+
+        with caplog.at_level(logging.WARNING):
+            assert get(client, auth_headers).json == {'blocked': True, 'reason': 'spam'}
+            assert get(client, auth_headers, 'a@spam.test').json == {'blocked': True, 'reason': 'domain'}
+            assert get(client, auth_headers, 'clean@example.com').json == {'blocked': False, 'reason': None}
+            response = client.post('/blacklists/lookup', headers=auth_headers,
+                                   data=json.dumps({'emails': ['blocked2@example.com', 'clean@example.com']}))
+        assert response.status_code == 200
+        assert response.json['results']['blocked2@example.com'] == {'blocked': True, 'reason': 'abuse'}
+        failed = {record.name for record in caplog.records if 'failed; keeping' in record.getMessage()}
+        assert failed == {'app.bloom', 'app.patterns', 'app.snapshot'}
+
+    def test_lookups_fall_back(self, down_app, auth_headers):
+        """Test that lookups past the Bloom filter get the cached or fail mode answer, not a 500."""
+        client = down_app.test_client()
+        self.seed(client, auth_headers)
+        get(client, auth_headers)
+        down_app.take_down()
+
+        response = get(client, auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'spam'}
+        assert response.headers['X-Cache'] == 'HIT'
+        response = get(client, auth_headers, 'blocked2@example.com')
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
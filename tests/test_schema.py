@@ -0,0 +1,106 @@
+"""
+Unit tests for schema initialization and the schema version check.
+"""
+import pytest
+from sqlalchemy import inspect
+
+from app import create_app, db
+from app.models import Blacklist, SchemaVersion
+from app.normalize import dedup_key
+from app.schema import SCHEMA_VERSION, check_schema, current_schema_version, init_db
+
+
+class TestInitDb:
+    """Test cases for creating and upgrading the schema."""
+
+    def test_version_recorded_on_first_start(self, app):
+        """Test that auto-initialization records the schema version."""
+        assert current_schema_version() == SCHEMA_VERSION
+
+    def test_idempotent(self, app):
+        """Test that running init_db on a current schema changes nothing."""
+        assert init_db() == SCHEMA_VERSION
+        assert SchemaVersion.query.count() == 1
+
+    def test_indexes_added_to_existing_tables(self, app):
+        """Test that upgrading creates indexes declared after the table was created."""
+        db.session.execute(db.text('DROP INDEX ix_blacklists_created_at_id'))
+        db.session.commit()
+        init_db()
+        indexes = {index['name'] for index in inspect(db.engine).get_indexes('blacklists')}
+        assert 'ix_blacklists_created_at_id' in indexes
+
+    def test_columns_added_to_existing_tables(self, app):
+        """Test that upgrading adds nullable columns declared after the table was created."""
+        db.session.execute(db.text('DROP INDEX ix_blacklists_dedup_key'))
+        db.session.execute(db.text('ALTER TABLE blacklists DROP COLUMN dedup_key'))
+        db.session.commit()
+        init_db()
+        inspector = inspect(db.engine)
+        assert 'dedup_key' in {column['name'] for column in inspector.get_columns('blacklists')}
+        assert 'ix_blacklists_dedup_key' in {index['name'] for index in inspector.get_indexes('blacklists')}
+
+    def test_upgrade_rekeys_upserts_without_app(self, app):
+        """Test that upgrading from version 7 recomputes dedup keys of upserts without an app_uuid."""
+        db.session.add(Blacklist(email='a@example.com', dedup_key=b'\0' * 16))
+        SchemaVersion.query.delete()
+        db.session.add(SchemaVersion(version=7))
+        db.session.commit()
+        init_db()
+        assert Blacklist.query.one().dedup_key == dedup_key('a@example.com', None)
+
+    def test_newer_schema_is_accepted(self, app):
+        """Test that workers of the previous release keep running after an upgrade."""
+        db.session.add(SchemaVersion(version=SCHEMA_VERSION + 1))
+        db.session.commit()
+        assert check_schema(app)
+
+
+class TestWithoutAutoInit:
+    """Test cases for starting against an uninitialized database with DB_AUTO_INIT off."""
+
+    @pytest.fixture
+    def uninitialized_app(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'empty.db'}")
+        monkeypatch.setenv('DB_AUTO_INIT', 'false')
+        app = create_app()
+        with app.app_context():
+            yield app
+            db.session.remove()
+            db.engine.dispose()
+
+    def test_schema_is_not_created(self, uninitialized_app):
+        """Test that workers never create tables themselves."""
+        assert not inspect(db.engine).has_table('blacklists')
+        assert 'bloom_filter' not in uninitialized_app.extensions
+
+    def test_health_check_reports_unhealthy(self, uninitialized_app):
+        """Test that the health check fails until the schema is initialized."""
+        response = uninitialized_app.test_client().get('/')
+        assert response.status_code == 503
+        assert response.json['status'] == 'unhealthy'
+
+    def test_ready_after_init_db(self, uninitialized_app):
+        """Test that a running worker becomes ready once init-db has run."""
+        uninitialized_app.config['SCHEMA_CHECK_INTERVAL'] = 0
+        assert init_db() is None
+        db.session.remove()
+        assert uninitialized_app.test_client().get('/').status_code == 200
+        assert uninitialized_app.extensions['schema_ready']
+        assert 'bloom_filter' in uninitialized_app.extensions
+        assert 'blacklist_patterns' in uninitialized_app.extensions
+
+    def test_schema_checks_are_rate_limited(self, uninitialized_app):
+        """Test that an unready worker checks the schema at most every SCHEMA_CHECK_INTERVAL seconds."""
+        uninitialized_app.config['SCHEMA_CHECK_INTERVAL'] = 60
+        init_db()
+        db.session.remove()
+        assert uninitialized_app.test_client().get('/').status_code == 503
+
+    def test_init_db_command(self, uninitialized_app):
+        """Test that `flask init-db` is registered by create_app, not only by run.py."""
+        result = uninitialized_app.test_cli_runner().invoke(args=['init-db'])
+        assert result.exit_code == 0, result.output
+        assert f'Database schema at version {SCHEMA_VERSION}' in result.output
+        assert create_app().extensions['schema_ready']
+        assert {'create-db', 'sweep-expired', 'write-snapshot'} <= set(uninitialized_app.cli.commands)
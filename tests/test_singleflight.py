@@ -0,0 +1,170 @@
+"""
+Unit tests for coalescing concurrent lookups.
+"""
+import threading
+import time
+import json
+import pytest
+from sqlalchemy import event
+from app import create_app, db
+from app.lookup import invalidate_keys
+from app.normalize import email_key
+from app.singleflight import FlightTimeout, SingleFlight, _Call
+
+
+def run_concurrently(flights, key, fn, count):
+    """Call ``flights.do(key, fn)`` from ``count`` threads; return their outcomes."""
+    outcomes = [None] * count
+
+    def call(index):
+        try:
+            outcomes[index] = flights.do(key, fn)
+        except Exception as exc:
+            outcomes[index] = exc
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_for_waiters(flights, key, count):
+    deadline = time.monotonic() + 5
+    while flights._calls[key].waiters < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+class TestSingleFlight:
+    """Test cases for the SingleFlight class."""
+
+    def test_concurrent_calls_share_one_result(self):
+        """Test that concurrent callers of one key run the function once."""
+        flights = SingleFlight()
+        release = threading.Event()
+        runs = []
+
+        def query():
+            runs.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads, outcomes = run_concurrently(flights, 'key', query, 8)
+        wait_for_waiters(flights, 'key', 7)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(runs) == 1
+        assert sorted(outcomes) == [('result', False)] + [('result', True)] * 7
+        assert flights.stats() == {'in_flight': 0, 'calls': 1, 'coalesced': 7, 'timeouts': 0, 'errors': 0}
+
+    def test_error_reaches_every_waiter(self):
+        """Test that a failing call raises its error in all callers."""
+        flights = SingleFlight()
+        release = threading.Event()
+
+        def query():
+            release.wait(5)
+            raise RuntimeError('database is down')
+
+        threads, outcomes = run_concurrently(flights, 'key', query, 4)
+        wait_for_waiters(flights, 'key', 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+        assert flights.stats()['errors'] == 1
+        # the failure is not remembered
+        assert flights.do('key', lambda: 'ok') == ('ok', False)
+
+    def test_waiters_time_out(self):
+        """Test that waiters give up after ``timeout`` while the call goes on."""
+        flights = SingleFlight(timeout=0.01)
+        release = threading.Event()
+        threads, outcomes = run_concurrently(flights, 'key', lambda: release.wait(5), 1)
+        while 'key' not in flights._calls:
+            time.sleep(0.001)
+        with pytest.raises(FlightTimeout):
+            flights.do('key', lambda: 'never runs')
+        release.set()
+        threads[0].join()
+        assert outcomes == [(True, False)]
+        assert flights.stats()['timeouts'] == 1
+
+    def test_forget_starts_a_new_call(self):
+        """Test that callers after ``forget`` do not join the running call."""
+        flights = SingleFlight()
+        release = threading.Event()
+        threads, outcomes = run_concurrently(flights, 'key', lambda: release.wait(5) and 'old', 1)
+        while 'key' not in flights._calls:
+            time.sleep(0.001)
+        flights.forget('key')
+        assert flights.do('key', lambda: 'new') == ('new', False)
+        release.set()
+        threads[0].join()
+        assert outcomes == [('old', False)]
+        assert len(flights) == 0
+
+
+class TestLookupCoalescing:
+    """Test cases for coalescing GET /blacklists/<email>."""
+
+    def test_enabled_by_default(self, app):
+        """Test that lookups are coalesced unless disabled."""
+        assert isinstance(app.extensions['lookup_singleflight'], SingleFlight)
+
+    def test_can_be_disabled(self, monkeypatch):
+        """Test that LOOKUP_SINGLEFLIGHT=false queries for every cache miss."""
+        monkeypatch.setenv('DATABASE_URL', 'sqlite:///:memory:')
+        monkeypatch.setenv('LOOKUP_SINGLEFLIGHT', 'false')
+        assert 'lookup_singleflight' not in create_app().extensions
+
+    def test_lookup_joins_running_query(self, app, client, auth_headers, sample_blacklist):
+        """Test that a lookup waits for a query already running for its email, and 503s on timeout."""
+        flights = app.extensions['lookup_singleflight']
+        flights.timeout = 0.01
+        flights._calls[(email_key('blocked1@example.com'), False)] = _Call()
+        response = client.get('/blacklists/blocked1@example.com', headers=auth_headers)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert flights.stats()['coalesced'] == 1
+
+    def test_write_forgets_running_query(self, app):
+        """Test that a write makes later lookups start their own query."""
+        flights = app.extensions['lookup_singleflight']
+        key = email_key('hot@example.com')
+        flights._calls[(key, False)] = _Call()
+        invalidate_keys([key])
+        assert len(flights) == 0
+
+    def test_write_during_query_is_not_overwritten(self, tmp_path, monkeypatch, auth_headers):
+        """Test that a query that read before a write does not cache its result after the write."""
+        monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'blacklist.db'}")
+        monkeypatch.setenv('STATIC_BEARER_TOKEN', 'test-token')
+        monkeypatch.setenv('BLOOM_FILTER_ENABLED', 'false')
+        app = create_app()
+        interleaved = []
+
+        def write_during_query(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM blacklist_status' in statement and not interleaved:
+                interleaved.append(statement)
+                # the write commits and invalidates while the lookup holds its result
+                writer = threading.Thread(target=app.test_client().post, args=('/blacklists',), kwargs={
+                    'data': json.dumps({'email': 'hot@example.com'}), 'headers': auth_headers,
+                })
+                writer.start()
+                writer.join()
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'after_cursor_execute', write_during_query)
+        client = app.test_client()
+        try:
+            assert client.get('/blacklists/hot@example.com', headers=auth_headers).json['blocked'] is False
+            response = client.get('/blacklists/hot@example.com', headers=auth_headers)
+        finally:
+            event.remove(engine, 'after_cursor_execute', write_during_query)
+            engine.dispose()
+        assert interleaved
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.json['blocked'] is True
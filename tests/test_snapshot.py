@@ -0,0 +1,203 @@
+"""
+Unit tests for the memory-mapped blacklist snapshot.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+from app import db
+from app.cache import MISSING
+from app.changes import purge_changes
+from app.models import Blacklist
+from app.normalize import email_key
+from app.snapshot import BlacklistSnapshot, write_snapshot
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return str(tmp_path / 'blacklist.snapshot')
+
+
+@pytest.fixture
+def snapshot_app(app, sample_blacklist, snapshot_path):
+    """App whose lookups are served by a snapshot of the sample blacklist."""
+    db.session.add(Blacklist(email='noreason@example.com'))
+    db.session.commit()
+    write_snapshot(snapshot_path)
+    snapshot = BlacklistSnapshot(snapshot_path, refresh_interval=3600)
+    assert snapshot.load()
+    app.extensions['blacklist_snapshot'] = snapshot
+    return app
+
+
+def count_statements():
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    return statements
+
+
+class TestBlacklistSnapshot:
+    """Test cases for writing and reading the snapshot file."""
+
+    def test_lookup(self, snapshot_app):
+        """Test that the snapshot answers with the latest reason of every email."""
+        snapshot = snapshot_app.extensions['blacklist_snapshot']
+        assert snapshot.count == 4
+        assert snapshot.lookup(email_key('blocked1@example.com')) == (True, 'spam')
+        assert snapshot.lookup(email_key('duplicate@example.com')) == (True, 'second entry - most recent')
+        assert snapshot.lookup(email_key('noreason@example.com')) == (True, None)
+        assert snapshot.lookup(email_key('clean@example.com')) == (False, None)
+
+    def test_empty_snapshot(self, app, snapshot_path):
+        """Test that a snapshot of an empty blacklist loads and blocks nothing."""
+        assert write_snapshot(snapshot_path) == 0
+        snapshot = BlacklistSnapshot(snapshot_path)
+        assert snapshot.load()
+        assert snapshot.lookup(email_key('anyone@example.com')) == (False, None)
+
+    def test_missing_or_invalid_file(self, app, snapshot_path):
+        """Test that lookups are left to the database without a valid snapshot."""
+        snapshot = BlacklistSnapshot(snapshot_path)
+        assert not snapshot.load()
+        assert snapshot.lookup(email_key('blocked1@example.com')) is MISSING
+        with open(snapshot_path, 'wb') as fh:
+            fh.write(b'not a snapshot')
+        assert not snapshot.load()
+
+    def test_rows_past_watermark_are_read_into_delta(self, snapshot_app):
+        """Test that rows written after the snapshot are found once the delta refreshes."""
+        snapshot = snapshot_app.extensions['blacklist_snapshot']
+        db.session.add(Blacklist(email='late@example.com', blocked_reason='late'))
+        db.session.commit()
+        assert snapshot.lookup(email_key('late@example.com')) == (False, None)
+
+        snapshot.expire()
+        assert snapshot.lookup(email_key('late@example.com')) == (True, 'late')
+        assert snapshot.stats()['delta'] == 1
+
+    def test_rows_committed_out_of_id_order_are_read(self, snapshot_app):
+        """Test that a row committed after one with a higher id is not skipped."""
+        snapshot = snapshot_app.extensions['blacklist_snapshot']
+        db.session.add(Blacklist(id=11, email='later@example.com'))
+        db.session.commit()
+        snapshot.refresh()
+        # a transaction that drew id 10 before id 11 was drawn commits last
+        db.session.add(Blacklist(id=10, email='earlier@example.com', blocked_reason='late'))
+        db.session.commit()
+        snapshot.refresh()
+
+        assert snapshot.lookup(email_key('earlier@example.com')) == (True, 'late')
+
+    def test_removed_entries_are_unblocked(self, snapshot_app):
+        """Test that deleting an email's last entry unblocks it in the delta."""
+        snapshot = snapshot_app.extensions['blacklist_snapshot']
+        db.session.delete(Blacklist.query.filter_by(email='blocked1@example.com').one())
+        db.session.commit()
+        snapshot.refresh()
+
+        assert snapshot.lookup(email_key('blocked1@example.com')) == (False, None)
+
+    def test_ignored_when_changes_were_purged(self, snapshot_app):
+        """Test that lookups go to the database if changes since the snapshot are gone."""
+        snapshot = snapshot_app.extensions['blacklist_snapshot']
+        for i in range(2):
+            db.session.add(Blacklist(email=f'late{i}@example.com'))
+            db.session.commit()
+        purge_changes(retention_days=-1)
+        snapshot.refresh()
+
+        assert not snapshot.loaded
+        assert snapshot.lookup(email_key('blocked1@example.com')) is MISSING
+
+    def test_expired_entries_fall_through(self, app, snapshot_path):
+        """Test that entries past their expiry are left to the database."""
+        now = datetime.utcnow()
+        db.session.add(Blacklist(email='later@example.com', expires_at=now + timedelta(hours=1)))
+        db.session.add(Blacklist(email='past@example.com', expires_at=now - timedelta(seconds=1)))
+        db.session.commit()
+        write_snapshot(snapshot_path)
+        snapshot = BlacklistSnapshot(snapshot_path, refresh_interval=3600)
+        assert snapshot.load()
+        db.session.add(Blacklist(email='delta@example.com', expires_at=now - timedelta(seconds=1)))
+        db.session.commit()
+        snapshot.refresh()
+
+        assert snapshot.lookup(email_key('later@example.com')) == (True, None)
+        assert snapshot.lookup(email_key('past@example.com')) is MISSING
+        assert snapshot.lookup(email_key('delta@example.com')) is MISSING
+
+    def test_newer_snapshot_replaces_delta(self, snapshot_app, snapshot_path):
+        """Test that a rewritten snapshot is mapped and the delta it covers is dropped."""
+        snapshot = snapshot_app.extensions['blacklist_snapshot']
+        db.session.add(Blacklist(email='late@example.com', blocked_reason='late'))
+        db.session.commit()
+        snapshot.refresh()
+        assert snapshot.stats()['delta'] == 1
+
+        write_snapshot(snapshot_path)
+        os.utime(snapshot_path, (0, 0))
+        snapshot.refresh()
+        assert snapshot.count == 5
+        assert snapshot.stats()['delta'] == 0
+        assert snapshot.lookup(email_key('late@example.com')) == (True, 'late')
+
+
+class TestSnapshotLookups:
+    """Test cases for lookups served from the snapshot."""
+
+    def test_lookup_endpoint_skips_database(self, client, auth_headers, snapshot_app):
+        """Test that a snapshot hit runs no query."""
+        statements = count_statements()
+        response = client.get('/blacklists/Blocked2@Example.com', headers=auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'abuse'}
+        assert statements == []
+
+    def test_batch_lookup(self, client, auth_headers, snapshot_app):
+        """Test that batch lookups are answered by the snapshot."""
+        statements = count_statements()
+        response = client.post(
+            '/blacklists/lookup',
+            data=json.dumps({'emails': ['blocked1@example.com', 'clean@example.com']}),
+            headers=auth_headers
+        )
+        assert response.json['results'] == {
+            'blocked1@example.com': {'blocked': True, 'reason': 'spam'},
+            'clean@example.com': {'blocked': False, 'reason': None},
+        }
+        assert statements == []
+
+    def test_own_writes_are_visible(self, client, auth_headers, snapshot_app):
+        """Test that an email posted by this worker is blocked right away."""
+        client.post(
+            '/blacklists',
+            data=json.dumps({'email': 'fresh@example.com', 'blocked_reason': 'fresh'}),
+            headers=auth_headers
+        )
+        response = client.get('/blacklists/fresh@example.com', headers=auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'fresh'}
+
+    def test_upserted_reason_is_visible(self, client, auth_headers, app, snapshot_path):
+        """Test that an upsert, which keeps the row id, replaces the reason in the snapshot."""
+        def upsert(reason):
+            client.post('/blacklists', data=json.dumps(
+                {'email': 'upsert@example.com', 'app_uuid': 'app-1', 'blocked_reason': reason, 'upsert': True}
+            ), headers=auth_headers)
+
+        upsert('first')
+        write_snapshot(snapshot_path)
+        snapshot = BlacklistSnapshot(snapshot_path, refresh_interval=3600)
+        assert snapshot.load()
+        app.extensions['blacklist_snapshot'] = snapshot
+        upsert('second')
+
+        response = client.get('/blacklists/upsert@example.com', headers=auth_headers)
+        assert response.json == {'blocked': True, 'reason': 'second'}
+
+    def test_configured_from_environment(self, monkeypatch, tmp_path):
+        """Test that SNAPSHOT_PATH enables the snapshot at startup."""
+        from app import create_app
+        monkeypatch.setenv('DATABASE_URL', 'sqlite:///:memory:')
+        monkeypatch.setenv('SNAPSHOT_PATH', str(tmp_path / 'missing.snapshot'))
+        app = create_app()
+        assert not app.extensions['blacklist_snapshot'].loaded
@@ -0,0 +1,155 @@
+"""
+Unit tests for the daily block counts and GET /blacklists/stats.
+"""
+import json
+from datetime import date, datetime
+import pytest
+from sqlalchemy import func
+from app import db
+from app.ingest import insert_rows, upsert_row, validate_row
+from app.models import Blacklist, BlacklistDailyStats, rebuild_stats, stats_need_backfill
+from app.stats import block_counts
+
+
+def counted():
+    """Return the maintained counts as ``{(day, app_uuid, blocked_reason): count}``."""
+    return {
+        (row.day, row.app_uuid, row.blocked_reason): row.count
+        for row in BlacklistDailyStats.query.all()
+        if row.count
+    }
+
+
+def recounted():
+    """Return the same counts computed from the history."""
+    day = func.date(Blacklist.created_at, type_=db.Date)
+    rows = db.session.query(day, Blacklist.app_uuid, Blacklist.blocked_reason, func.count()).group_by(
+        day, Blacklist.app_uuid, Blacklist.blocked_reason,
+    )
+    return {tuple(row[:3]): row[3] for row in rows}
+
+
+def row(email, app_uuid='app-1', blocked_reason='spam', created_at=datetime(2024, 1, 1, 12)):
+    entry, error = validate_row({'email': email, 'app_uuid': app_uuid, 'blocked_reason': blocked_reason})
+    assert error is None
+    entry['created_at'] = created_at
+    return entry
+
+
+class TestMaintenance:
+    """Test cases for keeping the counts in step with every write."""
+
+    def test_orm_inserts(self, app, sample_blacklist):
+        """Test that entries added through the session are counted."""
+        today = sample_blacklist[0].created_at.date()
+        assert counted() == {
+            (today, 'app-001', 'spam'): 1,
+            (today, 'app-002', 'abuse'): 1,
+            (today, 'app-003', 'first entry'): 1,
+            (today, 'app-004', 'second entry - most recent'): 1,
+        }
+
+    def test_bulk_insert(self, app):
+        """Test that bulk inserts count each group once across chunks."""
+        rows = [row(f'user{i}@example.com', blocked_reason=None if i % 2 else 'spam') for i in range(25)]
+        insert_rows(rows, chunk_size=10)
+        assert counted() == {(date(2024, 1, 1), 'app-1', 'spam'): 13, (date(2024, 1, 1), 'app-1', None): 12}
+
+    def test_null_and_empty_are_different_groups(self, app):
+        """Test that a NULL reason and an empty one are counted apart."""
+        insert_rows([row('a@example.com', blocked_reason=None), row('b@example.com', blocked_reason='')])
+        assert counted() == recounted()
+        assert len(counted()) == 2
+
+    def test_upsert_moves_entry_between_groups(self, app):
+        """Test that an upsert changing the reason and day moves the entry instead of adding one."""
+        upsert_row(row('user@example.com', blocked_reason='spam', created_at=datetime(2024, 1, 1)))
+        upsert_row(row('user@example.com', blocked_reason='abuse', created_at=datetime(2024, 1, 2)))
+        assert counted() == {(date(2024, 1, 2), 'app-1', 'abuse'): 1}
+        assert counted() == recounted()
+
+    def test_orm_update_and_delete(self, app, sample_blacklist):
+        """Test that changed and deleted entries leave their groups."""
+        entry = Blacklist.query.filter_by(email='blocked1@example.com').one()
+        entry.blocked_reason = 'fraud'
+        db.session.commit()
+        db.session.delete(Blacklist.query.filter_by(email='blocked2@example.com').one())
+        db.session.commit()
+        assert counted() == recounted()
+        assert ('app-002', 'abuse') not in {group[1:] for group in counted()}
+
+    def test_rebuild(self, app, sample_blacklist):
+        """Test that the counts can be rebuilt from the history."""
+        expected = counted()
+        BlacklistDailyStats.query.delete()
+        db.session.commit()
+        assert stats_need_backfill()
+        assert rebuild_stats() == 4
+        assert counted() == expected
+        assert not stats_need_backfill()
+
+
+class TestBlockCounts:
+    """Test cases for reading the counts."""
+
+    @pytest.fixture
+    def history(self, app):
+        insert_rows([
+            row('a@example.com', 'app-1', 'spam', datetime(2024, 1, 1)),
+            row('b@example.com', 'app-1', 'spam', datetime(2024, 1, 1, 23, 59)),
+            row('c@example.com', 'app-1', 'abuse', datetime(2024, 1, 2)),
+            row('d@example.com', 'app-2', 'spam', datetime(2024, 1, 3)),
+        ])
+
+    def test_all_dimensions(self, app, history):
+        """Test the finest grouping, ordered by day."""
+        groups, total = block_counts()
+        assert groups == [
+            {'day': '2024-01-01', 'app_uuid': 'app-1', 'blocked_reason': 'spam', 'count': 2},
+            {'day': '2024-01-02', 'app_uuid': 'app-1', 'blocked_reason': 'abuse', 'count': 1},
+            {'day': '2024-01-03', 'app_uuid': 'app-2', 'blocked_reason': 'spam', 'count': 1},
+        ]
+        assert total == 4
+
+    def test_coarser_grouping_and_filters(self, app, history):
+        """Test summing over dimensions and filtering by app and date range."""
+        assert block_counts(['blocked_reason'])[0] == [
+            {'blocked_reason': 'abuse', 'count': 1}, {'blocked_reason': 'spam', 'count': 3},
+        ]
+        assert block_counts([], app_uuid='app-1') == ([{'count': 3}], 3)
+        assert block_counts(['day'], since=date(2024, 1, 2), until=date(2024, 1, 3)) == (
+            [{'day': '2024-01-02', 'count': 1}], 1,
+        )
+
+
+class TestStatsEndpoint:
+    """Test cases for GET /blacklists/stats."""
+
+    def test_requires_auth(self, client):
+        """Test that the endpoint needs the bearer token."""
+        assert client.get('/blacklists/stats').status_code == 401
+
+    def test_grouped_counts(self, client, auth_headers, sample_blacklist):
+        """Test counts grouped by app."""
+        response = client.get('/blacklists/stats?group_by=app_uuid&app_uuid=app-001', headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json == {'groups': [{'app_uuid': 'app-001', 'count': 1}], 'total': 1}
+
+    @pytest.mark.parametrize('query', ['group_by=email', 'group_by=day,day', 'since=yesterday'])
+    def test_invalid_parameters(self, client, auth_headers, query):
+        """Test that unknown groupings and malformed dates are rejected."""
+        assert client.get(f'/blacklists/stats?{query}', headers=auth_headers).status_code == 400
+
+    def test_reads_only_the_rollup(self, client, auth_headers, sample_blacklist, assert_max_queries):
+        """Test that the counts are one query on the rollup table."""
+        with assert_max_queries(1) as counter:
+            client.get('/blacklists/stats', headers=auth_headers)
+        assert 'blacklist_daily_stats' in counter.statements[0]
+        assert 'FROM blacklists' not in counter.statements[0]
+
+    def test_posts_are_counted(self, client, auth_headers):
+        """Test that entries added through the API show up in the counts."""
+        for body in ({'email': 'a@example.com', 'app_uuid': 'x'}, {'email': 'b@example.com', 'app_uuid': 'x'}):
+            client.post('/blacklists', data=json.dumps(body), headers=auth_headers)
+        response = client.get('/blacklists/stats?group_by=app_uuid', headers=auth_headers)
+        assert response.json['groups'] == [{'app_uuid': 'x', 'count': 2}]
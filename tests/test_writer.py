@@ -0,0 +1,150 @@
+"""
+Unit tests for the write-behind mode of POST /blacklists.
+"""
+import json
+import os
+import time
+from datetime import datetime
+import pytest
+from app import create_app, db
+from app import writer as writer_module
+from app.models import Blacklist
+from app.normalize import email_key
+from app.writer import _dump_row, _load_row
+
+
+@pytest.fixture
+def write_behind_app(monkeypatch, tmp_path):
+    """Create an application with write-behind enabled."""
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path / "writer.db"}')
+    monkeypatch.setenv('STATIC_BEARER_TOKEN', 'test-token')
+    monkeypatch.setenv('WRITE_BEHIND_ENABLED', 'true')
+    monkeypatch.setenv('WRITE_BEHIND_SPOOL_DIR', str(tmp_path / 'spool'))
+    monkeypatch.setenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.05')
+    app = create_app()
+    with app.app_context():
+        yield app
+        app.extensions['write_behind'].stop()
+        db.session.remove()
+        db.drop_all()
+
+
+def _post(app, headers, **data):
+    return app.test_client().post('/blacklists', data=json.dumps(data), headers=headers)
+
+
+class TestSpoolFormat:
+    """Test cases for spool file serialization."""
+
+    def test_round_trip(self):
+        """Test that rows survive a trip through the spool format."""
+        row = {
+            'email': 'a@example.com',
+            'email_key': email_key('a@example.com'),
+            'blocked_reason': None,
+            'created_at': datetime(2024, 1, 2, 3, 4, 5),
+        }
+        assert _load_row(_dump_row(row)) == row
+
+
+class TestWriteBehind:
+    """Test cases for asynchronous POST handling."""
+
+    def test_disabled_by_default(self, app):
+        """Test that POST writes synchronously unless enabled."""
+        assert 'write_behind' not in app.extensions
+
+    def test_post_is_accepted_and_flushed(self, write_behind_app, auth_headers):
+        """Test that an accepted entry is written by the background thread."""
+        response = _post(write_behind_app, auth_headers, email='queued@example.com', blocked_reason='spam')
+        assert response.status_code == 202
+
+        writer = write_behind_app.extensions['write_behind']
+        writer.stop()
+        assert writer.pending() == 0
+        assert Blacklist.query.filter_by(email='queued@example.com').count() == 1
+        assert os.listdir(write_behind_app.config['WRITE_BEHIND_SPOOL_DIR']) == []
+
+    def test_invalid_entry_rejected(self, write_behind_app, auth_headers):
+        """Test that entries are validated before being accepted."""
+        response = _post(write_behind_app, auth_headers, email='a' * 300)
+        assert response.status_code == 400
+
+    def test_full_queue_returns_503(self, write_behind_app, auth_headers):
+        """Test that a full queue pushes back on clients."""
+        writer = write_behind_app.extensions['write_behind']
+        writer.max_queue = 2
+        writer.flush_interval = 60
+        writer.batch_size = 100
+        assert _post(write_behind_app, auth_headers, email='one@example.com').status_code == 202
+        assert _post(write_behind_app, auth_headers, email='two@example.com').status_code == 202
+
+        response = _post(write_behind_app, auth_headers, email='three@example.com')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+
+        writer.stop()
+        assert Blacklist.query.count() == 2
+
+    def test_accepted_entries_are_spooled(self, write_behind_app, auth_headers):
+        """Test that pending entries are on disk before they are written."""
+        writer = write_behind_app.extensions['write_behind']
+        writer.flush_interval = 60
+        writer.batch_size = 100
+        _post(write_behind_app, auth_headers, email='spooled@example.com')
+
+        with open(writer._spool_path) as spool:
+            assert json.loads(spool.readline())['email'] == 'spooled@example.com'
+
+    def test_orphaned_spool_is_replayed(self, write_behind_app, auth_headers):
+        """Test that entries left by a crashed process are inserted."""
+        spool_dir = write_behind_app.config['WRITE_BEHIND_SPOOL_DIR']
+        os.makedirs(spool_dir, exist_ok=True)
+        orphan = os.path.join(spool_dir, 'spool-1-1.ndjson')
+        with open(orphan, 'w') as fh:
+            fh.write(_dump_row({'email': 'orphan@example.com', 'created_at': datetime.utcnow()}) + '\n')
+
+        _post(write_behind_app, auth_headers, email='live@example.com')
+        write_behind_app.extensions['write_behind'].stop()
+
+        assert not os.path.exists(orphan)
+        assert Blacklist.query.filter_by(email='orphan@example.com').count() == 1
+        assert Blacklist.query.filter_by(email='live@example.com').count() == 1
+
+    def test_crash_under_load_replays_only_uncommitted_rows(self, write_behind_app, auth_headers, monkeypatch):
+        """Test that batches committed while writes kept arriving are not replayed after a crash."""
+        writer = write_behind_app.extensions['write_behind']
+        writer.batch_size = 2
+        insert_rows = writer_module.insert_rows
+        calls = []
+
+        def fail_after_two_batches(rows, chunk_size):
+            calls.append(len(rows))
+            if len(calls) > 2:
+                raise RuntimeError('database went away')
+            insert_rows(rows, chunk_size)
+
+        monkeypatch.setattr(writer_module, 'insert_rows', fail_after_two_batches)
+        emails = [f'load{i}@example.com' for i in range(7)]
+        for email in emails:
+            assert _post(write_behind_app, auth_headers, email=email).status_code == 202
+        deadline = time.monotonic() + 5
+        while not writer.failed_flushes:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        # crash: the writer thread stops without draining and the spool locks are released
+        writer._stopping.set()
+        writer._thread.join(5)
+        for segment in writer._segments.values():
+            segment.file.close()
+        writer._pid = None
+        assert Blacklist.query.count() == writer.flushed > 0
+
+        monkeypatch.setattr(writer_module, 'insert_rows', insert_rows)
+        replayer = create_app().extensions['write_behind']
+        replayer._ensure_started()
+        replayer.stop()
+
+        for email in emails:
+            assert Blacklist.query.filter_by(email=email).count() == 1
+        assert os.listdir(write_behind_app.config['WRITE_BEHIND_SPOOL_DIR']) == []